@@ -0,0 +1,97 @@
+"""
+Alternative route benchmark: k diverse routes from one in-memory graph.
+
+Builds the routing Graph from EdgeAttributes for a synthetic network, then
+times penalty_alternatives for growing num_routes between random vertex
+pairs, against k separate shortest-path searches (what a client calling
+PlanRoute k times pays for the searches alone). Also reports how many
+routes were found, their smallest pairwise dissimilarity and how much
+longer than the shortest route the alternatives are.
+
+    python benchmarks/bench_alternatives.py --grid-size 150
+"""
+import argparse
+import os
+import random
+
+import bench_utils
+import road_network
+from bench_edge_costs import attributes
+
+bench_utils.add_planner_to_path()
+os.environ.setdefault('ARIADNE_CONFIG', os.path.join(
+    bench_utils.PLANNER_DIR, 'config', 'config.example.json'))
+
+from routers import alternatives  # noqa
+from routers.graph import Graph  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--grid-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pairs', type=int, default=20)
+    parser.add_argument('--routes', default='1,3,5',
+                        help='num_routes values to test')
+    parser.add_argument('--min-dissimilarity', type=float, default=0.3)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    network = road_network.synthetic_grid(args.grid_size, args.grid_size,
+                                          seed=args.seed)
+    attrs = attributes(network)
+    graph = Graph.from_attributes(attrs)
+    rng = random.Random(args.seed)
+    pairs = [(graph.vertex(a.id), graph.vertex(b.id))
+             for a, b in (rng.sample(network.vertices, 2)
+                          for _ in range(args.pairs))]
+
+    results = []
+    for k in (int(x) for x in args.routes.split(',')):
+        found, dissimilarity, stretch = [], [], []
+        for s, t in pairs:
+            paths = alternatives.penalty_alternatives(
+                graph, s, t, k, min_dissimilarity=args.min_dissimilarity)
+            found.append(len(paths))
+            costs = [graph.costs[p].sum() for p in paths]
+            stretch.extend(c / costs[0] for c in costs[1:])
+            dissimilarity.extend(
+                alternatives.dissimilarity(graph, a, b)
+                for i, a in enumerate(paths) for b in paths[i + 1:])
+
+        it = iter(pairs * 1000)
+
+        def alternatives_call():
+            s, t = next(it)
+            alternatives.penalty_alternatives(
+                graph, s, t, k, min_dissimilarity=args.min_dissimilarity)
+
+        def repeated_call():
+            s, t = next(it)
+            for _ in range(k):
+                graph.shortest_path(s, t)
+
+        results.append({
+            'num_routes': k,
+            'alternatives_ms': bench_utils.time_call(alternatives_call,
+                                                     len(pairs)),
+            'repeated_searches_ms': bench_utils.time_call(repeated_call,
+                                                          len(pairs)),
+            'routes_found': bench_utils.summarize(found),
+            'min_dissimilarity': min(dissimilarity) if dissimilarity else None,
+            'cost_stretch': bench_utils.summarize(stretch)
+            if stretch else None,
+        })
+
+    bench_utils.write_report({
+        'benchmark': 'alternatives',
+        'environment': bench_utils.environment(),
+        'network': network.summary(),
+        'build_graph_ms': bench_utils.time_call(
+            lambda: Graph.from_attributes(attrs), 5),
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""
+Edge preference cost benchmark: does asking for flat/hilly routes cost more?
+
+Compares the existing green/popularity preferences against the same
+preferences plus 'flat', on two paths:
+  - in memory: EdgeAttributes.costs() over the whole network;
+  - SQL: make_edges_sql + one-to-one pgr_dijkstra between random vertices,
+    if a benchmark database is reachable (see docker-compose.yml).
+
+    python benchmarks/bench_edge_costs.py --network grid --grid-size 150
+    python benchmarks/bench_edge_costs.py --sql --load
+"""
+import argparse
+import itertools
+import os
+import random
+
+import numpy as np
+
+import bench_utils
+import road_network
+
+bench_utils.add_planner_to_path()
+os.environ.setdefault('ARIADNE_CONFIG', os.path.join(
+    bench_utils.PLANNER_DIR, 'config', 'config.example.json'))
+
+from routers import edge_costs  # noqa
+
+BASELINE = {'green': 1.0, 'popularity': 0.5}
+WITH_CLIMB = dict(BASELINE, flat=1.0)
+
+
+def attributes(network: road_network.RoadNetwork) -> edge_costs.EdgeAttributes:
+    """EdgeAttributes for a benchmark network, climb from vertex elevations."""
+    elevation = {v.id: v.elevation for v in network.vertices}
+    edges = network.edges
+    rise = np.array([elevation[e.target] - elevation[e.source] for e in edges])
+    length = np.array([e.length_m for e in edges])
+    return edge_costs.EdgeAttributes(
+        [e.gid for e in edges], [e.source for e in edges],
+        [e.target for e in edges], length,
+        [e.reverse_cost for e in edges], [e.greenery for e in edges],
+        [e.popularity for e in edges],
+        edge_costs.climb_score(np.maximum(rise, 0), length),
+        edge_costs.climb_score(np.maximum(-rise, 0), length))
+
+
+def bench_sql(args, network, pairs):
+    import psycopg2
+    from routers.orienteering_router import make_edges_sql
+
+    conn = psycopg2.connect(host=args.db_host, port=args.db_port,
+                            dbname=args.db_name, user=args.db_user,
+                            password=args.db_pass)
+    if args.load:
+        import load_pgrouting
+        import put_edge_elevation
+        load_pgrouting.load_network(conn, network)
+        load_pgrouting.install_sql_functions(conn)
+        put_edge_elevation.add_edge_elevation_sql(conn, from_vertices=True)
+
+    def route(prefs):
+        it = itertools.cycle(pairs)
+
+        def call():
+            source, target = next(it)
+            with conn.cursor() as cur:
+                cur.execute('SELECT count(*) FROM pgr_dijkstra(%s, %s, %s)',
+                            (make_edges_sql(conn, prefs), source, target))
+                cur.fetchone()
+        return bench_utils.time_call(call, repeat=len(pairs))
+
+    try:
+        return {'baseline': route(BASELINE), 'with_flat': route(WITH_CLIMB)}
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--network', choices=('graphml', 'grid'),
+                        default='grid')
+    parser.add_argument('--graphml', default=road_network.DEFAULT_GRAPHML)
+    parser.add_argument('--grid-size', type=int, default=150)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--sql', action='store_true',
+                        help='Also time pgr_dijkstra against the database')
+    parser.add_argument('--routes', type=int, default=50)
+    parser.add_argument('--load', action='store_true',
+                        help='(Re)load the network into the database first')
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=5433)
+    parser.add_argument('--db-name', default='ariadne_bench')
+    parser.add_argument('--db-user', default='ariadne_bench')
+    parser.add_argument('--db-pass', default='ariadne_bench')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if args.network == 'graphml':
+        network = road_network.from_graphml(args.graphml, seed=args.seed)
+    else:
+        network = road_network.synthetic_grid(args.grid_size, args.grid_size,
+                                              seed=args.seed)
+    attrs = attributes(network)
+
+    report = {
+        'benchmark': 'edge_costs',
+        'environment': bench_utils.environment(),
+        'network': network.summary(),
+        'in_memory_ms': {
+            'baseline': bench_utils.time_call(
+                lambda: attrs.costs(BASELINE), repeat=args.repeat),
+            'with_flat': bench_utils.time_call(
+                lambda: attrs.costs(WITH_CLIMB), repeat=args.repeat),
+        },
+    }
+    if args.sql:
+        rng = random.Random(args.seed)
+        ids = [v.id for v in network.vertices]
+        pairs = [tuple(rng.sample(ids, 2)) for _ in range(args.routes)]
+        report['sql_route_ms'] = bench_sql(args, network, pairs)
+    bench_utils.write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Elevation lookup microbenchmark.
+
+Compares batch sampling from local DEM tiles (ElevationProvider with the
+tile LRU cache) against one HTTP round trip per point, which is what
+elevation_utils used to do. The HTTP side talks to a local stub of the USGS
+point query service, so it measures only per-request overhead; the real
+service adds network latency on top of that.
+
+    python benchmarks/bench_elevation.py --points 10000
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import numpy as np
+
+import bench_utils
+
+bench_utils.add_planner_to_path()
+
+from utils.elevation_provider import ElevationProvider, UsgsBackend  # noqa
+
+
+def write_synthetic_hgt(directory: str, south: int, west: int,
+                        size: int = 1201):
+    yy, xx = np.mgrid[0:size, 0:size]
+    data = 300 + 200 * np.sin(yy / 150.0) * np.cos(xx / 190.0)
+    name = '{}{:02d}{}{:03d}.hgt'.format('N' if south >= 0 else 'S',
+                                         abs(south),
+                                         'E' if west >= 0 else 'W', abs(west))
+    data.astype('>i2').tofile(os.path.join(directory, name))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_usgs_stub() -> HTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            q = dict(urllib.parse.parse_qsl(
+                urllib.parse.urlparse(self.path).query))
+            elevation = 300 + float(q['y']) % 1 * 100
+            body = ('<?xml version="1.0"?><USGS_Elevation_Point_Query_Service>'
+                    '<Elevation_Query><Elevation>{:.2f}</Elevation>'
+                    '</Elevation_Query></USGS_Elevation_Point_Query_Service>'
+                    .format(elevation)).encode()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--points', type=int, default=10000)
+    parser.add_argument('--http-points', type=int, default=300,
+                        help='Points looked up one request at a time')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    lats = rng.uniform(34.0, 35.0, args.points)
+    lons = rng.uniform(-119.0, -117.0, args.points)
+
+    with tempfile.TemporaryDirectory() as dem_dir:
+        write_synthetic_hgt(dem_dir, 34, -119)
+        write_synthetic_hgt(dem_dir, 34, -118)
+
+        cold = ElevationProvider(dem_dir)
+        start = time.perf_counter()
+        cold.elevations(lats, lons)
+        cold_ms = (time.perf_counter() - start) * 1000
+
+        warm = ElevationProvider(dem_dir)
+        warm.elevations(lats, lons)
+        batch = bench_utils.time_call(lambda: warm.elevations(lats, lons))
+
+        # 10-point route profile, as sampleElevations makes
+        profile = bench_utils.time_call(lambda: warm.elevations(
+            np.linspace(34.1, 34.2, 10), np.linspace(-118.2, -118.1, 10)),
+            repeat=200)
+
+    server = start_usgs_stub()
+    backend = UsgsBackend('127.0.0.1', server.server_address[1], workers=1)
+    n = args.http_points
+    start = time.perf_counter()
+    for lat, lon in zip(lats[:n], lons[:n]):
+        backend.elevation(lat, lon)
+    per_point_ms = (time.perf_counter() - start) * 1000 / n
+    server.shutdown()
+
+    bench_utils.write_report({
+        'benchmark': 'elevation',
+        'environment': bench_utils.environment(),
+        'points': args.points,
+        'dem_batch_cold_ms': round(cold_ms, 3),
+        'dem_batch_warm_ms': batch,
+        'dem_10_point_profile_ms': profile,
+        'http_per_point_ms': round(per_point_ms, 3),
+        'http_estimated_batch_ms': round(per_point_ms * args.points, 1),
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
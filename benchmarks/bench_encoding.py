@@ -0,0 +1,101 @@
+"""
+Reply encoding microbenchmark: RouteEncoder vs encode_reply.
+
+Builds PlanRoute replies for routes of increasing length (GeoJSON from the
+edge geometry cache, packed elevationData, an elevation profile and a few
+POIs) and times RouteEncoder().encode, which parses and re-serializes the
+GeoJSON, against encode_reply with each available backend. Also checks that
+every backend's output parses to the same JSON and that the stdlib backend
+is byte-identical to RouteEncoder.
+
+    python benchmarks/bench_encoding.py
+"""
+import argparse
+import json
+import os
+import random
+
+import numpy as np
+
+import bench_utils
+import road_network
+from bench_route_geometry import random_walk
+
+bench_utils.add_planner_to_path()
+os.environ.setdefault('ARIADNE_CONFIG', os.path.join(
+    bench_utils.PLANNER_DIR, 'config', 'config.example.json'))
+
+from routers import edge_geometry  # noqa
+from routers.base_router import (ElevationData, PoiResult,  # noqa
+                                 RouteEncoder, RouteResult)
+from routers.route_encoding import WRITERS, encode_reply  # noqa
+
+
+def make_reply(network, geometries, n_edges: int, rng: random.Random):
+    gids, forward = random_walk(network, n_edges, rng)
+    coords = geometries.path(gids, forward)
+    idx = geometries.index(gids)
+    lengths = [network.edges[i].length_m for i in idx]
+    route = RouteResult(
+        # json.dumps layout, so the stdlib output can be compared bytewise
+        geojson=json.dumps({'type': 'LineString',
+                            'coordinates': coords.tolist()}),
+        score=rng.random() * 100, length=float(sum(lengths)),
+        elevationData=ElevationData(
+            lengths, [rng.uniform(500, 1500) for _ in idx],
+            np.cumsum(geometries.segments(idx))),
+        pois=[PoiResult((rng.uniform(34, 35), rng.uniform(-119, -118)),
+                        'Place {}'.format(i), 'cafe', rng.uniform(100, 900))
+              for i in range(5)],
+        elevationProfile=[round(rng.uniform(500, 1500), 1)
+                          for _ in range(n_edges * 4)])
+    return {'routes': route}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--grid-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lengths', default='50,500,5000',
+                        help='Route lengths to test, in edges')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    network = road_network.synthetic_grid(args.grid_size, args.grid_size,
+                                          seed=args.seed)
+    geometries = edge_geometry.EdgeGeometries.from_linestrings(
+        [e.gid for e in network.edges],
+        [np.array(e.coords) for e in network.edges])
+    rng = random.Random(args.seed)
+
+    results = []
+    for n in (int(x) for x in args.lengths.split(',')):
+        reply = make_reply(network, geometries, n, rng)
+        expected = RouteEncoder().encode(reply)
+        result = {
+            'edges': n,
+            'reply_bytes': len(expected),
+            'route_encoder_ms': bench_utils.time_call(
+                lambda: RouteEncoder().encode(reply), args.repeat),
+        }
+        for backend in sorted(WRITERS):
+            text = encode_reply(reply, backend)
+            result[backend] = {
+                'ms': bench_utils.time_call(
+                    lambda: encode_reply(reply, backend), args.repeat),
+                'same_json': json.loads(text) == json.loads(expected),
+                'same_bytes': text == expected,
+            }
+        results.append(result)
+
+    bench_utils.write_report({
+        'benchmark': 'encoding',
+        'environment': bench_utils.environment(),
+        'backends': sorted(WRITERS),
+        'replies': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
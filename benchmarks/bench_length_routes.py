@@ -0,0 +1,88 @@
+"""
+Desired-length route benchmark: latency and length accuracy of
+loop_routes.length_routes, which DistEdgePrefsRouter uses.
+
+For each desired length, times loops (origin = destination) and routes
+between random vertex pairs closer together than that length on a synthetic
+network with green/popularity preferences, and reports achieved / desired
+length. pathfromnearestknownpointslength, which the router used before, is
+not in sql/ so it can't be compared here.
+
+    python benchmarks/bench_length_routes.py --grid-size 150
+"""
+import argparse
+import os
+import random
+import time
+
+import bench_utils
+import road_network
+from bench_edge_costs import BASELINE, attributes
+from road_network import haversine_m
+
+bench_utils.add_planner_to_path()
+os.environ.setdefault('ARIADNE_CONFIG', os.path.join(
+    bench_utils.PLANNER_DIR, 'config', 'config.example.json'))
+
+from routers import loop_routes  # noqa
+from routers.graph import Graph  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--grid-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lengths', default='2000,5000,10000',
+                        help='Desired lengths to test, in meters')
+    parser.add_argument('--routes', type=int, default=20,
+                        help='Routes per length and kind')
+    parser.add_argument('--num-routes', type=int, default=1)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    network = road_network.synthetic_grid(args.grid_size, args.grid_size,
+                                          seed=args.seed)
+    attrs = attributes(network)
+    start = time.perf_counter()
+    graph = Graph.from_attributes(attrs, BASELINE)
+    build_ms = (time.perf_counter() - start) * 1000
+    rng = random.Random(args.seed)
+
+    results = []
+    for desired in (float(x) for x in args.lengths.split(',')):
+        for kind in ('loop', 'point_to_point'):
+            times, ratios = [], []
+            while len(times) < args.routes:
+                a = rng.choice(network.vertices)
+                b = a
+                if kind == 'point_to_point':
+                    b = rng.choice(network.vertices)
+                    if not 0.2 * desired \
+                            < haversine_m(a.lat, a.lon, b.lat, b.lon) \
+                            < 0.6 * desired:
+                        continue
+                start = time.perf_counter()
+                routes = loop_routes.length_routes(
+                    graph, graph.vertex(a.id), graph.vertex(b.id), desired,
+                    k=args.num_routes)
+                times.append((time.perf_counter() - start) * 1000)
+                ratios.extend(r.length / desired for r in routes)
+            results.append({
+                'desired_m': desired,
+                'kind': kind,
+                'ms': bench_utils.summarize(times),
+                'achieved_over_desired': bench_utils.summarize(ratios),
+            })
+
+    bench_utils.write_report({
+        'benchmark': 'length_routes',
+        'environment': bench_utils.environment(),
+        'network': network.summary(),
+        'build_graph_ms': round(build_ms, 3),
+        'num_routes': args.num_routes,
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Orienteering solver benchmark: exact bitmask DP vs the randomized search.
+
+For growing POI counts, generates random instances (POIs scattered around
+the origin and destination, road distances a noisy 1.3x the straight line)
+and times solve_orienteering_exact against the 1000-trial randomized search
+solve_orienteering falls back to. Reports the score each gets, how often
+the randomized search misses the optimum, and the largest POI count at
+which the exact solver is still faster, i.e. where EXACT_MAX_POIS should be.
+
+    python benchmarks/bench_orienteering_solver.py --pois 4,6,8,10,12,14
+"""
+import argparse
+import math
+import os
+import random
+import time
+
+import bench_utils
+
+bench_utils.add_planner_to_path()
+os.environ.setdefault('ARIADNE_CONFIG', os.path.join(
+    bench_utils.PLANNER_DIR, 'config', 'config.example.json'))
+
+from routers import accel, orienteering_router  # noqa
+from routers.orienteering_exact import solve_orienteering_exact  # noqa
+
+
+def make_instance(n: int, rng: random.Random, budget_factor: float):
+    """(poi_score, max_distance, pairdist, origin, dest) with n POIs."""
+    origin, dest = 0, n + 1
+    coords = {origin: (0.0, 0.0), dest: (2000.0, 0.0)}
+    for v in range(1, n + 1):
+        coords[v] = (rng.uniform(-1000, 3000), rng.uniform(-1500, 1500))
+    pairdist = {}
+    for a in coords:
+        for b in coords:
+            if a != b:
+                crow = math.hypot(coords[a][0] - coords[b][0],
+                                  coords[a][1] - coords[b][1])
+                pairdist[(a, b)] = crow * rng.uniform(1.2, 1.4)
+    poi_score = {v: rng.uniform(1, 5) for v in range(1, n + 1)}
+    return (poi_score, budget_factor * pairdist[(origin, dest)], pairdist,
+            origin, dest)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--pois', default='4,6,8,10,12,14')
+    parser.add_argument('--instances', type=int, default=10,
+                        help='Random instances per POI count')
+    parser.add_argument('--budget-factor', type=float, default=2.5,
+                        help='max_distance as a multiple of the direct '
+                             'route')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results = []
+    crossover = None
+    for n in (int(x) for x in args.pois.split(',')):
+        exact_ms, heuristic_ms, gaps, misses = [], [], [], 0
+        for _ in range(args.instances):
+            instance = make_instance(n, rng, args.budget_factor)
+
+            start = time.perf_counter()
+            exact = solve_orienteering_exact(*instance)[0]
+            exact_ms.append((time.perf_counter() - start) * 1000)
+
+            # Force the randomized search whatever EXACT_MAX_POIS is
+            saved = orienteering_router.EXACT_MAX_POIS
+            orienteering_router.EXACT_MAX_POIS = -1
+            try:
+                start = time.perf_counter()
+                heuristic = orienteering_router.solve_orienteering(
+                    *instance)[0]
+                heuristic_ms.append((time.perf_counter() - start) * 1000)
+            finally:
+                orienteering_router.EXACT_MAX_POIS = saved
+
+            assert heuristic.score <= exact.score + 1e-9
+            gaps.append(exact.score - heuristic.score)
+            misses += heuristic.score < exact.score - 1e-9
+
+        exact_summary = bench_utils.summarize(exact_ms)
+        heuristic_summary = bench_utils.summarize(heuristic_ms)
+        if exact_summary['p50'] < heuristic_summary['p50']:
+            crossover = n
+        results.append({
+            'pois': n,
+            'exact_ms': exact_summary,
+            'heuristic_ms': heuristic_summary,
+            'heuristic_score_gap': bench_utils.summarize(gaps),
+            'heuristic_misses_optimum': misses,
+        })
+
+    bench_utils.write_report({
+        'benchmark': 'orienteering_solver',
+        'environment': bench_utils.environment(),
+        'numba': accel.ENABLED,
+        'instances': args.instances,
+        'budget_factor': args.budget_factor,
+        'exact_faster_up_to_pois': crossover,
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""
+Memory footprint of route results, before and after slotted result types.
+
+Results used to be plain classes with a __dict__, with elevationData kept as
+the nested lists psycopg2 returns ([[length, Decimal elevation, index],
+...]). Now RouteResult and PoiResult use __slots__ and elevationData is an
+ElevationData of three parallel arrays. This builds a batch of routes each
+way from the same rows and reports the memory retained per route
+(excluding the GeoJSON text, which is identical).
+
+    python benchmarks/bench_result_memory.py --routes 1000
+"""
+import argparse
+import gc
+import os
+import random
+import tracemalloc
+from decimal import Decimal
+
+import bench_utils
+
+bench_utils.add_planner_to_path()
+os.environ.setdefault('ARIADNE_CONFIG', os.path.join(
+    bench_utils.PLANNER_DIR, 'config', 'config.example.json'))
+
+from routers.base_router import ElevationData, PoiResult, RouteResult  # noqa
+
+
+class OldPoiResult:
+    def __init__(self, location, name, type, length_of_leg):
+        self.location = location
+        self.name = name
+        self.type = type
+        self.length_of_leg = length_of_leg
+
+
+class OldRouteResult:
+    def __init__(self, geojson, score, length, elevationData, pois):
+        self.geojson = geojson
+        self.score = score
+        self.length = length
+        self.elevationData = elevationData
+        self.pois = pois
+
+
+def db_rows(n_edges: int, rng: random.Random):
+    """elevationData rows as psycopg2 returns them from numeric columns."""
+    rows, points = [], 0
+    for _ in range(n_edges):
+        points += rng.randint(1, 6)
+        rows.append([rng.uniform(10, 300),
+                     Decimal('%.3f' % rng.uniform(500, 1500)), points])
+    return rows
+
+
+def retained_per_route(build, n_routes: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    results = [build() for _ in range(n_routes)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+    del results
+    return round(size / n_routes, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--routes', type=int, default=1000)
+    parser.add_argument('--edges', default='20,200,2000',
+                        help='Route sizes to test, in edges')
+    parser.add_argument('--pois', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    geojson = '{"type": "LineString", "coordinates": []}'
+    results = []
+    for n in (int(x) for x in args.edges.split(',')):
+        rng = random.Random(args.seed)
+
+        def old():
+            return OldRouteResult(
+                geojson, rng.random(), rng.random(), db_rows(n, rng),
+                [OldPoiResult((rng.random(), rng.random()), 'Place', 'cafe',
+                              rng.random()) for _ in range(args.pois)])
+
+        def new():
+            return RouteResult(
+                geojson, rng.random(), rng.random(),
+                ElevationData.from_rows(db_rows(n, rng)),
+                [PoiResult((rng.random(), rng.random()), 'Place', 'cafe',
+                           rng.random()) for _ in range(args.pois)])
+
+        before = retained_per_route(old, args.routes)
+        after = retained_per_route(new, args.routes)
+        results.append({
+            'edges': n,
+            'before_bytes_per_route': before,
+            'after_bytes_per_route': after,
+            'ratio': round(before / after, 2),
+        })
+
+    bench_utils.write_report({
+        'benchmark': 'result_memory',
+        'environment': bench_utils.environment(),
+        'routes': args.routes,
+        'pois_per_route': args.pois,
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
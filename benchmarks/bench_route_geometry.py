@@ -0,0 +1,111 @@
+"""
+Route geometry benchmark: cached edge geometry buffer vs GeoJSON round trips.
+
+Before the edge geometry cache, PostGIS built each route's GeoJSON and the
+planner parsed and re-serialized it (json.loads/json.dumps) before the reply
+encoder parsed it once more. This times that Python-side round trip against
+building the same route from EdgeGeometries and serializing it directly, for
+random walks of increasing length, and reports peak allocations of each.
+
+    python benchmarks/bench_route_geometry.py --grid-size 150
+"""
+import argparse
+import json
+import random
+import tracemalloc
+
+import numpy as np
+
+import bench_utils
+import road_network
+
+bench_utils.add_planner_to_path()
+
+from routers import edge_geometry  # noqa
+
+
+def random_walk(network, n_edges: int, rng: random.Random):
+    """(gids, forward) of a walk of n_edges along the network."""
+    adjacent = {}
+    for e in network.edges:
+        adjacent.setdefault(e.source, []).append((e.gid, True, e.target))
+        adjacent.setdefault(e.target, []).append((e.gid, False, e.source))
+    node = rng.choice(list(adjacent))
+    gids, forward = [], []
+    for _ in range(n_edges):
+        gid, fwd, node = rng.choice(adjacent[node])
+        gids.append(gid)
+        forward.append(fwd)
+    return gids, forward
+
+
+def peak_kib(fn) -> float:
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return round(peak / 1024, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--grid-size', type=int, default=150)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lengths', default='50,500,5000',
+                        help='Route lengths to test, in edges')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    network = road_network.synthetic_grid(args.grid_size, args.grid_size,
+                                          seed=args.seed)
+    geometries = edge_geometry.EdgeGeometries.from_linestrings(
+        [e.gid for e in network.edges],
+        [np.array(e.coords) for e in network.edges])
+    rng = random.Random(args.seed)
+
+    routes = []
+    for n in (int(x) for x in args.lengths.split(',')):
+        gids, forward = random_walk(network, n, rng)
+        coords = geometries.path(gids, forward)
+        # What PostGIS used to hand back for this route
+        postgis_text = json.dumps({'type': 'LineString',
+                                   'coordinates': coords.tolist()})
+
+        def round_trip():
+            json.dumps(json.loads(json.dumps(json.loads(postgis_text))))
+
+        def cached():
+            edge_geometry.geojson(geometries.path(gids, forward))
+
+        def polyline():
+            edge_geometry.encoded_polyline(geometries.path(gids, forward))
+
+        routes.append({
+            'edges': n,
+            'points': len(coords),
+            'geojson_bytes': len(postgis_text),
+            'polyline_bytes': len(edge_geometry.encoded_polyline(coords)),
+            'json_round_trip_ms': bench_utils.time_call(round_trip,
+                                                        args.repeat),
+            'cached_geojson_ms': bench_utils.time_call(cached, args.repeat),
+            'cached_polyline_ms': bench_utils.time_call(polyline,
+                                                        args.repeat),
+            'json_round_trip_peak_kib': peak_kib(round_trip),
+            'cached_geojson_peak_kib': peak_kib(cached),
+            'cached_polyline_peak_kib': peak_kib(polyline),
+        })
+
+    bench_utils.write_report({
+        'benchmark': 'route_geometry',
+        'environment': bench_utils.environment(),
+        'network': network.summary(),
+        'cache_mib': round((geometries.coords.nbytes
+                            + geometries.offsets.nbytes
+                            + geometries.gids.nbytes) / 2 ** 20, 2),
+        'routes': routes,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
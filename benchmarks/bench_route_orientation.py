@@ -0,0 +1,185 @@
+"""
+Point-to-point route geometry benchmark for multi-kilometer routes.
+
+pathFromNearestKnownPoints used to merge the path's edges with
+ST_LineMerge(ST_Union(...)), which doesn't keep path order, and the planner
+then parsed the GeoJSON, flipped it if it started at the destination and
+dumped it again (orient_linestring). It now builds the line in path order.
+
+In memory, this times the removed Python round trip on routes of a few
+kilometers. With --sql it also times the old function (recreated as a
+temporary function) plus that round trip against the current function,
+and checks that every new route starts at the origin.
+
+    python benchmarks/bench_route_orientation.py
+    python benchmarks/bench_route_orientation.py --sql --load
+"""
+import argparse
+import json
+import math
+import random
+import time
+
+import bench_utils
+import road_network
+from road_network import haversine_m
+
+OLD_FUNCTION_SQL = '''
+CREATE FUNCTION pg_temp.pathFromNearestKnownPointsUnion(
+    x1 numeric, y1 numeric, x2 numeric, y2 numeric)
+RETURNS TABLE (geojson TEXT, length FLOAT) AS
+$BODY$
+    WITH
+    dijkstra AS (
+        SELECT * FROM pgr_dijkstra(
+            'SELECT gid AS id, source, target, cost FROM ways',
+            (SELECT id FROM ways_vertices_pgr
+                ORDER BY the_geom <-> ST_SetSRID(ST_Point(x1, y1), 4326) LIMIT 1),
+            (SELECT id FROM ways_vertices_pgr
+                ORDER BY the_geom <-> ST_SetSRID(ST_Point(x2, y2), 4326) LIMIT 1),
+            directed:=false)
+    )
+    SELECT ST_AsGeoJSON(ST_LineMerge(ST_Union(the_geom))), SUM(length_m)
+    FROM dijkstra JOIN ways ON dijkstra.edge = ways.gid;
+$BODY$
+LANGUAGE sql;
+'''
+
+
+def orient_linestring(origin, dest, linestring):
+    """The removed planner hack, kept here as the baseline."""
+    def distance(a, b):
+        return math.hypot(a[0] - b[0], a[1] - b[1])
+    linestring = json.loads(linestring)
+    if distance(tuple(reversed(dest)), linestring['coordinates'][0]) \
+            < distance(tuple(reversed(origin)), linestring['coordinates'][0]):
+        linestring['coordinates'].reverse()
+    return json.dumps(linestring)
+
+
+def walk_of_length(network, length_m: float, rng: random.Random):
+    """Coordinates of a random walk at least length_m long."""
+    adjacent = {}
+    for e in network.edges:
+        adjacent.setdefault(e.source, []).append((e, True, e.target))
+        adjacent.setdefault(e.target, []).append((e, False, e.source))
+    node = rng.choice(list(adjacent))
+    coords, total = [], 0.0
+    while total < length_m:
+        edge, forward, node = rng.choice(adjacent[node])
+        part = edge.coords if forward else edge.coords[::-1]
+        coords.extend(part[1:] if coords else part)
+        total += edge.length_m
+    return coords
+
+
+def bench_sql(args, network, lengths):
+    import psycopg2
+
+    conn = psycopg2.connect(host=args.db_host, port=args.db_port,
+                            dbname=args.db_name, user=args.db_user,
+                            password=args.db_pass)
+    if args.load:
+        bench_utils.add_planner_to_path()
+        import load_pgrouting
+        import put_edge_elevation
+        load_pgrouting.load_network(conn, network)
+        load_pgrouting.install_sql_functions(conn)
+        put_edge_elevation.add_edge_elevation_sql(conn, from_vertices=True)
+    with conn.cursor() as cur:
+        cur.execute(OLD_FUNCTION_SQL)
+
+    rng = random.Random(args.seed)
+    results = []
+    for length in lengths:
+        pairs = []
+        while len(pairs) < args.routes:
+            a, b = rng.sample(network.vertices, 2)
+            if 0.8 * length <= haversine_m(a.lat, a.lon, b.lat, b.lon) \
+                    <= 1.2 * length:
+                pairs.append(((a.lat, a.lon), (b.lat, b.lon)))
+
+        old, new, misoriented = [], [], 0
+        with conn.cursor() as cur:
+            for origin, dest in pairs:
+                coord_args = (origin[1], origin[0], dest[1], dest[0])
+                start = time.perf_counter()
+                cur.execute('SELECT * FROM pg_temp.'
+                            'pathFromNearestKnownPointsUnion(%s,%s,%s,%s)',
+                            coord_args)
+                geojson, _ = cur.fetchone()
+                orient_linestring(origin, dest, geojson)
+                old.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                cur.execute('SELECT * FROM pathFromNearestKnownPoints'
+                            '(%s,%s,%s,%s)', coord_args)
+                geojson, _, _ = cur.fetchone()
+                new.append((time.perf_counter() - start) * 1000)
+                first = json.loads(geojson)['coordinates'][0]
+                if haversine_m(first[1], first[0], *dest) \
+                        < haversine_m(first[1], first[0], *origin):
+                    misoriented += 1
+        results.append({
+            'crow_distance_m': length,
+            'union_plus_orient_ms': bench_utils.summarize(old),
+            'ordered_ms': bench_utils.summarize(new),
+            'misoriented': misoriented,
+        })
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--grid-size', type=int, default=150)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lengths', default='2000,5000,10000',
+                        help='Route lengths to test, in meters')
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--sql', action='store_true',
+                        help='Also time the path functions in the database')
+    parser.add_argument('--routes', type=int, default=20,
+                        help='Database routes per length')
+    parser.add_argument('--load', action='store_true',
+                        help='(Re)load the network into the database first')
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=5433)
+    parser.add_argument('--db-name', default='ariadne_bench')
+    parser.add_argument('--db-user', default='ariadne_bench')
+    parser.add_argument('--db-pass', default='ariadne_bench')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    network = road_network.synthetic_grid(args.grid_size, args.grid_size,
+                                          seed=args.seed)
+    lengths = [float(x) for x in args.lengths.split(',')]
+    rng = random.Random(args.seed)
+
+    in_memory = []
+    for length in lengths:
+        coords = walk_of_length(network, length, rng)
+        # Reversed, so the baseline has to flip it
+        text = json.dumps({'type': 'LineString',
+                           'coordinates': coords[::-1]})
+        origin, dest = coords[0][::-1], coords[-1][::-1]
+        in_memory.append({
+            'route_length_m': length,
+            'points': len(coords),
+            'orient_linestring_ms': bench_utils.time_call(
+                lambda: orient_linestring(origin, dest, text), args.repeat),
+        })
+
+    report = {
+        'benchmark': 'route_orientation',
+        'environment': bench_utils.environment(),
+        'network': network.summary(),
+        'in_memory': in_memory,
+    }
+    if args.sql:
+        report['sql'] = bench_sql(args, network, lengths)
+    bench_utils.write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    main()
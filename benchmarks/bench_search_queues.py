@@ -0,0 +1,162 @@
+"""
+Search queue benchmark: Graph searches with each priority queue of
+routers/search.py against the dict-and-heapq Dijkstra Graph used before.
+
+On a road network (the nx_graph GraphML export or a synthetic grid), times
+point-to-point shortest_path between random vertex pairs and length-bounded
+search trees from random roots with every queue, and checks that every
+queue finds paths of the same cost as the reference search. With Numba
+installed every queue name runs the same compiled kernel (routers/accel.py).
+
+    python benchmarks/bench_search_queues.py --network graphml
+    python benchmarks/bench_search_queues.py --grid-size 150
+"""
+import argparse
+import heapq
+import itertools
+import os
+import random
+
+import bench_utils
+import road_network
+from bench_edge_costs import attributes
+
+bench_utils.add_planner_to_path()
+os.environ.setdefault('ARIADNE_CONFIG', os.path.join(
+    bench_utils.PLANNER_DIR, 'config', 'config.example.json'))
+
+from routers import accel, search  # noqa
+from routers.graph import Graph  # noqa
+
+
+class ReferenceGraph:
+    """The dict-and-heapq searches, over a Graph's lists."""
+
+    def __init__(self, graph: Graph):
+        self.indptr = graph.indptr.tolist()
+        self.heads = graph.heads.tolist()
+        self.costs = graph.costs.tolist()
+        self.lengths = graph.lengths.tolist()
+
+    def shortest_path(self, source: int, target: int):
+        """Path cost, None if target is unreachable."""
+        indptr, heads, costs = self.indptr, self.heads, self.costs
+        dist = {source: 0.0}
+        pred = {}
+        done = set()
+        heap = [(0.0, source)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if v in done:
+                continue
+            if v == target:
+                return d
+            done.add(v)
+            for arc in range(indptr[v], indptr[v + 1]):
+                w = heads[arc]
+                nd = d + costs[arc]
+                if nd < dist.get(w, float('inf')):
+                    dist[w] = nd
+                    pred[w] = arc
+                    heapq.heappush(heap, (nd, w))
+        return None
+
+    def tree(self, root: int, max_length: float):
+        indptr, heads = self.indptr, self.heads
+        costs, lengths = self.costs, self.lengths
+        cost = {root: 0.0}
+        length = {root: 0.0}
+        pred = {}
+        done = set()
+        heap = [(0.0, root)]
+        while heap:
+            d, v = heapq.heappop(heap)
+            if v in done:
+                continue
+            done.add(v)
+            lv = length[v]
+            for arc in range(indptr[v], indptr[v + 1]):
+                w = heads[arc]
+                nl = lv + lengths[arc]
+                if nl > max_length:
+                    continue
+                nd = d + costs[arc]
+                if nd < cost.get(w, float('inf')):
+                    cost[w] = nd
+                    length[w] = nl
+                    pred[w] = arc
+                    heapq.heappush(heap, (nd, w))
+        return cost
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--network', choices=('graphml', 'grid'),
+                        default='grid')
+    parser.add_argument('--graphml', default=road_network.DEFAULT_GRAPHML)
+    parser.add_argument('--grid-size', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pairs', type=int, default=50)
+    parser.add_argument('--tree-length', type=float, default=3000.0,
+                        help='max_length of the timed search trees, meters')
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if args.network == 'graphml':
+        network = road_network.from_graphml(args.graphml, seed=args.seed)
+    else:
+        network = road_network.synthetic_grid(args.grid_size, args.grid_size,
+                                              seed=args.seed)
+    graph = Graph.from_attributes(attributes(network))
+    rng = random.Random(args.seed)
+    pairs = [(rng.randrange(len(graph)), rng.randrange(len(graph)))
+             for _ in range(args.pairs)]
+
+    reference = ReferenceGraph(graph)
+    expected = [reference.shortest_path(s, t) for s, t in pairs]
+    it = itertools.cycle(pairs)
+    results = {'reference': {
+        'shortest_path_ms': bench_utils.time_call(
+            lambda: reference.shortest_path(*next(it)), len(pairs)),
+        'tree_ms': bench_utils.time_call(
+            lambda: reference.tree(next(it)[0], args.tree_length),
+            len(pairs)),
+    }}
+
+    for queue in search.QUEUES:
+        graph.queue = queue
+        # Quantized costs may pick a different path, but never one more
+        # than a rounding step per arc more expensive
+        max_error = 0.0
+        for (s, t), cost in zip(pairs, expected):
+            path = graph.shortest_path(s, t)
+            assert (path is None) == (cost is None), (queue, s, t)
+            if path is not None:
+                error = float(graph.costs[path].sum()) - cost
+                assert error <= search.COST_RESOLUTION * max(len(path), 1), \
+                    (queue, s, t, error)
+                max_error = max(max_error, error)
+
+        it = itertools.cycle(pairs)
+        results[queue] = {
+            'shortest_path_ms': bench_utils.time_call(
+                lambda: graph.shortest_path(*next(it)), len(pairs)),
+            'tree_ms': bench_utils.time_call(
+                lambda: graph.tree(next(it)[0], args.tree_length),
+                len(pairs)),
+            'max_cost_error': round(max_error, 3),
+        }
+
+    bench_utils.write_report({
+        'benchmark': 'search_queues',
+        'environment': bench_utils.environment(),
+        'network': network.summary(),
+        'numba': accel.ENABLED,
+        'cost_resolution': search.COST_RESOLUTION,
+        'tree_length_m': args.tree_length,
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
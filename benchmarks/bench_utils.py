@@ -0,0 +1,76 @@
+"""
+Helpers shared by the benchmark scripts.
+"""
+import json
+import os
+import platform
+import sys
+import time
+from typing import *
+
+PLANNER_DIR = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), os.pardir, 'planner'))
+
+
+def add_planner_to_path():
+    """Make planner modules importable the way start_server.py sees them."""
+    if PLANNER_DIR not in sys.path:
+        sys.path.insert(0, PLANNER_DIR)
+
+
+def percentile(sorted_samples: Sequence[float], q: float) -> float:
+    """Linearly interpolated percentile, q in [0, 100]."""
+    if not sorted_samples:
+        return float('nan')
+    pos = (len(sorted_samples) - 1) * q / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(sorted_samples) - 1)
+    return sorted_samples[lo] + (sorted_samples[hi] - sorted_samples[lo]) \
+        * (pos - lo)
+
+
+def summarize(samples: Iterable[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max of samples (usually milliseconds)."""
+    s = sorted(samples)
+    if not s:
+        return {'count': 0}
+    return {
+        'count': len(s),
+        'mean': round(sum(s) / len(s), 3),
+        'p50': round(percentile(s, 50), 3),
+        'p95': round(percentile(s, 95), 3),
+        'p99': round(percentile(s, 99), 3),
+        'max': round(s[-1], 3),
+    }
+
+
+def time_call(fn: Callable[[], Any], repeat: int = 20,
+              warmup: int = 2) -> Dict[str, float]:
+    """Time fn() repeat times; return summarize() of the timings in ms."""
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return summarize(timings)
+
+
+def environment() -> Dict[str, str]:
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def write_report(report: Dict[str, Any], output: Optional[str]):
+    """Write report as JSON to output, or stdout if output is None."""
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if output is None:
+        print(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
@@ -0,0 +1,123 @@
+"""
+Vertex order benchmark: how much numbering graph vertices along a
+space-filling curve (or breadth first) speeds up searches.
+
+Real pgRouting and OSM ids are unrelated to geography, so the network's
+vertex ids are shuffled first; 'id' order is then what Graph used before.
+For every order in vertex_order.ORDERS, builds the Graph the way
+edge_costs.edge_attributes would and reports the mean arc span (index
+distance between an arc's ends), the time to compute the order, and the
+time of point-to-point searches, search trees and a many-to-many distance
+matrix between the same vertices. Run with and without Numba installed:
+the compiled kernels are where memory locality shows most.
+
+    python benchmarks/bench_vertex_order.py --grid-size 300
+"""
+import argparse
+import itertools
+import os
+import random
+import time
+
+import numpy as np
+
+import bench_utils
+import road_network
+from bench_edge_costs import attributes
+
+bench_utils.add_planner_to_path()
+os.environ.setdefault('ARIADNE_CONFIG', os.path.join(
+    bench_utils.PLANNER_DIR, 'config', 'config.example.json'))
+
+from routers import accel, edge_costs, vertex_order  # noqa
+from routers.graph import Graph  # noqa
+
+
+def shuffled_ids(network: road_network.RoadNetwork, seed: int):
+    """(EdgeAttributes, VertexTable) with vertex ids shuffled."""
+    rng = np.random.RandomState(seed)
+    old = np.array([v.id for v in network.vertices])
+    new = rng.permutation(len(old)) + 1
+    remap = dict(zip(old.tolist(), new.tolist()))
+    attrs = attributes(network)
+    attrs = edge_costs.EdgeAttributes(
+        attrs.gid, [remap[s] for s in attrs.source.tolist()],
+        [remap[t] for t in attrs.target.tolist()], attrs.length_m,
+        attrs.reverse_cost, attrs.greenery, attrs.popularity, attrs.climb,
+        attrs.reverse_climb)
+    table = vertex_order.VertexTable(
+        new, [v.osm_id for v in network.vertices],
+        [v.lon for v in network.vertices], [v.lat for v in network.vertices])
+    return attrs, table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--network', choices=('graphml', 'grid'),
+                        default='grid')
+    parser.add_argument('--graphml', default=road_network.DEFAULT_GRAPHML)
+    parser.add_argument('--grid-size', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pairs', type=int, default=50)
+    parser.add_argument('--tree-length', type=float, default=3000.0)
+    parser.add_argument('--matrix-size', type=int, default=20)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if args.network == 'graphml':
+        network = road_network.from_graphml(args.graphml, seed=args.seed)
+    else:
+        network = road_network.synthetic_grid(args.grid_size, args.grid_size,
+                                              seed=args.seed)
+    attrs, table = shuffled_ids(network, args.seed)
+    rng = random.Random(args.seed)
+    ids = table.ids.tolist()
+    pairs = [tuple(rng.sample(ids, 2)) for _ in range(args.pairs)]
+    matrix_ids = rng.sample(ids, args.matrix_size)
+
+    results = {}
+    expected = None
+    for method in vertex_order.ORDERS:
+        start = time.perf_counter()
+        ordered = attrs
+        if method != 'id':
+            ordered = attrs.in_vertex_order(
+                table.ordered(method, attrs.source, attrs.target))
+        order_ms = (time.perf_counter() - start) * 1000
+        graph = Graph.from_attributes(ordered)
+        index = [(graph.vertex(s), graph.vertex(t)) for s, t in pairs]
+        matrix = [graph.vertex(v) for v in matrix_ids]
+
+        # Every order must find equally cheap paths
+        costs = [float(graph.costs[p].sum()) if p is not None else None
+                 for p in (graph.shortest_path(s, t) for s, t in index)]
+        if expected is None:
+            expected = costs
+        assert all((a is None) == (b is None)
+                   and (a is None or abs(a - b) < 1e-6)
+                   for a, b in zip(costs, expected)), method
+
+        it = itertools.cycle(index)
+        results[method] = {
+            'order_ms': round(order_ms, 3),
+            'arc_span': round(vertex_order.arc_span(graph), 1),
+            'shortest_path_ms': bench_utils.time_call(
+                lambda: graph.shortest_path(*next(it)), len(index)),
+            'tree_ms': bench_utils.time_call(
+                lambda: graph.tree(next(it)[0], args.tree_length),
+                len(index)),
+            'distance_matrix_ms': bench_utils.time_call(
+                lambda: graph.distance_matrix(matrix, matrix), 5),
+        }
+
+    bench_utils.write_report({
+        'benchmark': 'vertex_order',
+        'environment': bench_utils.environment(),
+        'network': network.summary(),
+        'numba': accel.ENABLED,
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Load a benchmark RoadNetwork into a PostGIS/pgRouting database.
+
+Creates the subset of the osm2pgrouting schema the planner queries
+(`ways`, `ways_vertices_pgr`, `ways_metadata`), bulk loads it with COPY and
+installs the functions from `sql/`. Meant for a throwaway database such as
+the one in benchmarks/docker-compose.yml; existing tables are dropped.
+"""
+import glob
+import io
+import os
+
+from road_network import RoadNetwork
+
+SQL_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'sql')
+
+SCHEMA_SQL = '''
+CREATE EXTENSION IF NOT EXISTS postgis;
+CREATE EXTENSION IF NOT EXISTS pgrouting;
+
+DROP TABLE IF EXISTS ways_elevation;
+DROP TABLE IF EXISTS vertex_components;
+DROP TABLE IF EXISTS ways_metadata;
+DROP TABLE IF EXISTS ways;
+DROP TABLE IF EXISTS ways_vertices_pgr;
+
+CREATE TABLE ways_vertices_pgr (
+    id bigint PRIMARY KEY,
+    osm_id bigint,
+    lat numeric(11, 8),
+    lon numeric(11, 8),
+    the_geom geometry(Point, 4326),
+    elevation numeric(11, 3)
+);
+
+CREATE TABLE ways (
+    gid bigint PRIMARY KEY,
+    source bigint,
+    target bigint,
+    source_osm bigint,
+    target_osm bigint,
+    length_m double precision,
+    cost double precision,
+    reverse_cost double precision,
+    the_geom geometry(LineString, 4326)
+);
+
+CREATE TABLE ways_metadata (
+    gid bigint PRIMARY KEY,
+    greenery double precision,
+    popularity_highres double precision
+);
+'''
+
+INDEX_SQL = '''
+CREATE INDEX ways_vertices_pgr_the_geom_idx
+    ON ways_vertices_pgr USING GIST (the_geom);
+CREATE INDEX ways_the_geom_idx ON ways USING GIST (the_geom);
+CREATE INDEX ways_source_idx ON ways (source);
+CREATE INDEX ways_target_idx ON ways (target);
+ANALYZE ways_vertices_pgr;
+ANALYZE ways;
+ANALYZE ways_metadata;
+'''
+
+
+def _copy(cur, table: str, columns, rows):
+    buf = io.StringIO()
+    for row in rows:
+        buf.write('\t'.join(str(x) for x in row))
+        buf.write('\n')
+    buf.seek(0)
+    cur.copy_expert('COPY {} ({}) FROM STDIN'.format(table, ', '.join(columns)),
+                    buf)
+
+
+def load_network(conn, network: RoadNetwork):
+    """Replace the routing tables with network."""
+    with conn.cursor() as cur:
+        cur.execute(SCHEMA_SQL)
+        _copy(cur, 'ways_vertices_pgr',
+              ('id', 'osm_id', 'lat', 'lon', 'the_geom', 'elevation'),
+              ((v.id, v.osm_id, v.lat, v.lon,
+                'SRID=4326;POINT({!r} {!r})'.format(v.lon, v.lat),
+                round(v.elevation, 3))
+               for v in network.vertices))
+        _copy(cur, 'ways',
+              ('gid', 'source', 'target', 'source_osm', 'target_osm',
+               'length_m', 'cost', 'reverse_cost', 'the_geom'),
+              ((e.gid, e.source, e.target, e.source_osm, e.target_osm,
+                e.length_m, e.cost, e.reverse_cost,
+                'SRID=4326;LINESTRING({})'.format(
+                    ','.join('{!r} {!r}'.format(x, y) for x, y in e.coords)))
+               for e in network.edges))
+        _copy(cur, 'ways_metadata', ('gid', 'greenery', 'popularity_highres'),
+              ((e.gid, e.greenery, e.popularity) for e in network.edges))
+        cur.execute(INDEX_SQL)
+    conn.commit()
+
+
+def install_sql_functions(conn, sql_dir: str = SQL_DIR):
+    """Run every .sql file in sql_dir, in name order."""
+    with conn.cursor() as cur:
+        for path in sorted(glob.glob(os.path.join(sql_dir, '*.sql'))):
+            with open(path) as f:
+                cur.execute(f.read())
+    conn.commit()
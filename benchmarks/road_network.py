@@ -0,0 +1,184 @@
+"""
+Road networks for benchmarking.
+
+Builds a pgRouting-shaped road network (vertices, edges with geometry,
+lengths, costs and greenery/popularity metadata) either from the checked-in
+`nx_graph/network.graphml` extract or as a synthetic jittered grid of any
+size. Everything is deterministic for a given seed, so two benchmark runs see
+exactly the same graph.
+"""
+import math
+import os
+import random
+import xml.etree.ElementTree as ET
+from typing import *
+
+EARTH_RADIUS_M = 6371000.0
+GRAPHML_NS = '{http://graphml.graphdrawing.org/xmlns}'
+DEFAULT_GRAPHML = os.path.join(
+    os.path.dirname(__file__), os.pardir, 'nx_graph', 'network.graphml')
+
+
+class Vertex(NamedTuple):
+    id: int
+    osm_id: int
+    lat: float
+    lon: float
+    elevation: float  # Feet, like the USGS data in ways_vertices_pgr
+
+
+class Edge(NamedTuple):
+    gid: int
+    source: int
+    target: int
+    source_osm: int
+    target_osm: int
+    length_m: float
+    cost: float
+    reverse_cost: float  # Negative for one-way edges, as in osm2pgrouting
+    coords: List[Tuple[float, float]]  # (lon, lat) pairs, source -> target
+    greenery: float
+    popularity: float
+
+
+class RoadNetwork(NamedTuple):
+    name: str
+    vertices: List[Vertex]
+    edges: List[Edge]
+
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """Return (min_lat, min_lon, max_lat, max_lon)."""
+        lats = [v.lat for v in self.vertices]
+        lons = [v.lon for v in self.vertices]
+        return min(lats), min(lons), max(lats), max(lons)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'vertices': len(self.vertices),
+            'edges': len(self.edges),
+            'total_length_m': round(sum(e.length_m for e in self.edges), 1),
+        }
+
+
+def haversine_m(lat1, lon1, lat2, lon2) -> float:
+    """Great-circle distance in meters."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 \
+        + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def linestring_length_m(coords: List[Tuple[float, float]]) -> float:
+    return sum(haversine_m(a[1], a[0], b[1], b[0])
+               for a, b in zip(coords[:-1], coords[1:]))
+
+
+def synthetic_elevation_ft(lat: float, lon: float) -> float:
+    """Smooth rolling terrain, roughly the relief of the Pasadena foothills."""
+    return 800.0 + 250.0 * math.sin(lat * 400.0) * math.cos(lon * 300.0) \
+        + 120.0 * math.sin(lat * 1300.0 + lon * 900.0)
+
+
+def _make_edge(rng: random.Random, gid: int, u: Vertex, v: Vertex,
+               interior_points: int, oneway_fraction: float) -> Edge:
+    coords = [(u.lon, u.lat)]
+    for i in range(1, interior_points + 1):
+        t = i / (interior_points + 1)
+        # Bend the street slightly so edges have realistic vertex counts
+        coords.append((u.lon + (v.lon - u.lon) * t + rng.uniform(-2e-5, 2e-5),
+                       u.lat + (v.lat - u.lat) * t + rng.uniform(-2e-5, 2e-5)))
+    coords.append((v.lon, v.lat))
+    length = linestring_length_m(coords)
+    oneway = rng.random() < oneway_fraction
+    return Edge(
+        gid=gid, source=u.id, target=v.id,
+        source_osm=u.osm_id, target_osm=v.osm_id,
+        length_m=length, cost=length,
+        reverse_cost=-length if oneway else length,
+        coords=coords,
+        greenery=rng.random(), popularity=rng.random())
+
+
+def from_graphml(path: str = DEFAULT_GRAPHML, seed: int = 0,
+                 interior_points: int = 0,
+                 oneway_fraction: float = 0.0) -> RoadNetwork:
+    """
+    Build a network from a GraphML file written by generate_graph_file.py.
+    The export only carries node coordinates, so edge geometry is a straight
+    segment (plus optional interior points) and metadata is random.
+    :param path: GraphML file.
+    :param seed: Seed for the generated metadata.
+    :param interior_points: Extra points per edge geometry.
+    :param oneway_fraction: Fraction of edges marked one-way.
+    """
+    rng = random.Random(seed)
+    root = ET.parse(path).getroot()
+    key_names = {k.get('id'): k.get('attr.name')
+                 for k in root.iter(GRAPHML_NS + 'key')}
+
+    vertices = []
+    by_osm = {}
+    for node in root.iter(GRAPHML_NS + 'node'):
+        attrs = {key_names[d.get('key')]: float(d.text)
+                 for d in node.iter(GRAPHML_NS + 'data')}
+        osm_id = int(node.get('id'))
+        v = Vertex(len(vertices) + 1, osm_id, attrs['lat'], attrs['lng'],
+                   synthetic_elevation_ft(attrs['lat'], attrs['lng']))
+        vertices.append(v)
+        by_osm[osm_id] = v
+
+    edges = []
+    for e in root.iter(GRAPHML_NS + 'edge'):
+        u = by_osm[int(e.get('source'))]
+        v = by_osm[int(e.get('target'))]
+        if u.id == v.id:
+            continue
+        edges.append(_make_edge(rng, len(edges) + 1, u, v, interior_points,
+                                oneway_fraction))
+
+    return RoadNetwork('graphml:' + os.path.basename(path), vertices, edges)
+
+
+def synthetic_grid(rows: int = 50, cols: int = 50, spacing_m: float = 120.0,
+                   origin: Tuple[float, float] = (34.13, -118.15),
+                   seed: int = 0, drop_fraction: float = 0.05,
+                   interior_points: int = 3,
+                   oneway_fraction: float = 0.1) -> RoadNetwork:
+    """
+    Build a jittered grid street network anchored at origin (lat, lon).
+    A small fraction of edges is dropped so shortest paths are not trivially
+    Manhattan, and a few are one-way.
+    """
+    rng = random.Random(seed)
+    dlat = math.degrees(spacing_m / EARTH_RADIUS_M)
+    dlon = dlat / math.cos(math.radians(origin[0]))
+
+    vertices = []
+    for r in range(rows):
+        for c in range(cols):
+            lat = origin[0] + r * dlat + rng.uniform(-0.15, 0.15) * dlat
+            lon = origin[1] + c * dlon + rng.uniform(-0.15, 0.15) * dlon
+            vid = len(vertices) + 1
+            vertices.append(Vertex(vid, 10 ** 9 + vid, lat, lon,
+                                   synthetic_elevation_ft(lat, lon)))
+
+    edges = []
+    for r in range(rows):
+        for c in range(cols):
+            u = vertices[r * cols + c]
+            neighbours = []
+            if c + 1 < cols:
+                neighbours.append(vertices[r * cols + c + 1])
+            if r + 1 < rows:
+                neighbours.append(vertices[(r + 1) * cols + c])
+            for v in neighbours:
+                if rng.random() < drop_fraction:
+                    continue
+                edges.append(_make_edge(rng, len(edges) + 1, u, v,
+                                        interior_points, oneway_fraction))
+
+    return RoadNetwork('grid:{}x{}'.format(rows, cols), vertices, edges)
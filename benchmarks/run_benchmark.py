@@ -0,0 +1,291 @@
+"""
+End-to-end throughput/latency benchmark for the route planner.
+
+Builds a road network (the GraphML extract or a synthetic grid), optionally
+loads it into a local PostGIS/pgRouting database (see docker-compose.yml),
+serves Google Places from a local stub and fires a concurrent mix of all four
+router types at RoutePlanner.PlanRoute. The report is JSON, so runs can be
+diffed for regressions:
+
+    docker compose -f benchmarks/docker-compose.yml up -d
+    python benchmarks/run_benchmark.py --load --network grid --requests 400 \\
+        --concurrency 8 --output bench_output.json
+
+Latency is measured around each PlanRoute call; per-stage times come from
+the `timings` the planner returns for requests with `debug_timings` set.
+"""
+import argparse
+import collections
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent import futures
+from typing import *
+
+import bench_utils
+import road_network
+from road_network import RoadNetwork, haversine_m
+from stub_places import StubPlacesServer
+
+ROUTER_KINDS = ('point2point', 'pois_on_way', 'dist_edge_prefs',
+                'orienteering')
+DEFAULT_MIX = 'point2point=4,pois_on_way=2,dist_edge_prefs=2,orienteering=1'
+POI_TYPES = ('park', 'cafe', 'museum', 'art_gallery')
+
+
+class BenchContext:
+    """Minimal grpc.ServicerContext for in-process PlanRoute calls."""
+
+    def __init__(self):
+        self.code = None
+        self.details = None
+
+    def set_code(self, code):
+        self.code = code
+
+    def set_details(self, details):
+        self.details = details
+
+    def time_remaining(self):
+        return None
+
+    def is_active(self):
+        return True
+
+    def add_callback(self, callback):
+        return True
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(','):
+        kind, weight = part.split('=')
+        if kind not in ROUTER_KINDS:
+            raise ValueError('Unknown router kind {!r}'.format(kind))
+        weights[kind] = float(weight)
+    return weights
+
+
+def make_workload(network: RoadNetwork, n: int, mix: Dict[str, float],
+                  seed: int, min_dist: float = 300,
+                  max_dist: float = 2500) -> List[Tuple[str, Dict]]:
+    """Generate n (kind, request) pairs with origin/dest on the network."""
+    rng = random.Random(seed)
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    workload = []
+    while len(workload) < n:
+        a, b = rng.sample(network.vertices, 2)
+        crow = haversine_m(a.lat, a.lon, b.lat, b.lon)
+        if not min_dist <= crow <= max_dist:
+            continue
+        kind = rng.choices(kinds, weights)[0]
+        req = {
+            'origin': {'latitude': a.lat, 'longitude': a.lon},
+            'dest': {'latitude': b.lat, 'longitude': b.lon},
+            'edge_prefs': rng.choice([
+                {}, {'green': 1}, {'popularity': 1},
+                {'green': rng.randint(1, 5), 'popularity': rng.randint(1, 5)},
+            ]),
+        }
+        if kind in ('dist_edge_prefs', 'orienteering'):
+            req['desired_dist'] = round(crow * rng.uniform(1.5, 3.0))
+        if kind in ('pois_on_way', 'orienteering'):
+            req['poi_prefs'] = {t: rng.randint(1, 5)
+                                for t in rng.sample(POI_TYPES, 2)}
+        workload.append((kind, req))
+    return workload
+
+
+def build_network(args) -> RoadNetwork:
+    if args.network == 'graphml':
+        return road_network.from_graphml(
+            args.graphml, seed=args.seed, interior_points=2,
+            oneway_fraction=0.05)
+    return road_network.synthetic_grid(args.grid_size, args.grid_size,
+                                       seed=args.seed)
+
+
+def write_planner_config(args) -> str:
+    """Write a planner config for the benchmark DB; return its path."""
+    fd, path = tempfile.mkstemp(prefix='ariadne-bench-', suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({
+            'dbHost': args.db_host, 'dbName': args.db_name,
+            'dbUser': args.db_user, 'dbPass': args.db_pass,
+            'dbPort': args.db_port, 'gmapsApiKey': 'benchmark',
+        }, f)
+    return path
+
+
+def stage_breakdown(reply) -> Dict[str, float]:
+    """Per-stage ms from a debug_timings reply; the rest is 'other'."""
+    if reply is None or not reply.jsonData:
+        return {}
+    timings = json.loads(reply.jsonData).get('timings', {})
+    total = timings.pop('total', 0.0)
+    if timings:
+        timings['other'] = max(total - sum(timings.values()), 0.0)
+    return timings
+
+
+def in_process_caller():
+    import planner_pb2
+    from start_server import RoutePlanner
+    servicer = RoutePlanner()
+
+    def call(req):
+        ctx = BenchContext()
+        reply = servicer.PlanRoute(
+            planner_pb2.JsonReply(jsonData=json.dumps(req)), ctx)
+        error = None if ctx.code is None else str(ctx.code)
+        return reply, error
+    return call
+
+
+def grpc_caller(target: str, timeout: float):
+    import grpc
+    import planner_pb2
+    import planner_pb2_grpc
+    stub = planner_pb2_grpc.RoutePlannerStub(grpc.insecure_channel(target))
+
+    def call(req):
+        try:
+            reply = stub.PlanRoute(
+                planner_pb2.JsonReply(jsonData=json.dumps(req)),
+                timeout=timeout)
+            return reply, None
+        except grpc.RpcError as e:
+            return None, str(e.code())
+    return call
+
+
+def run(call, workload, concurrency: int) -> Tuple[List[Dict], float]:
+    def one(item):
+        kind, req = item
+        start = time.perf_counter()
+        try:
+            reply, error = call(dict(req, debug_timings=True))
+            breakdown = stage_breakdown(reply)
+        except Exception as e:
+            error, breakdown = type(e).__name__, {}
+        return {'kind': kind,
+                'latency_ms': (time.perf_counter() - start) * 1000,
+                'error': error, 'stages': breakdown}
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, workload))
+    return results, time.perf_counter() - start
+
+
+def make_report(results: List[Dict], wall_s: float) -> Dict[str, Any]:
+    def section(rs):
+        ok = [r for r in rs if r['error'] is None]
+        errors = collections.Counter(r['error'] for r in rs
+                                     if r['error'] is not None)
+        return {
+            'requests': len(rs),
+            'errors': dict(errors),
+            'latency_ms': bench_utils.summarize(r['latency_ms'] for r in ok),
+        }
+
+    report = section(results)
+    report['wall_s'] = round(wall_s, 3)
+    report['throughput_rps'] = round(
+        sum(1 for r in results if r['error'] is None) / wall_s, 3)
+    report['by_router'] = {}
+    for kind in ROUTER_KINDS:
+        rs = [r for r in results if r['kind'] == kind]
+        if not rs:
+            continue
+        entry = section(rs)
+        ok = [r for r in rs if r['error'] is None and r['stages']]
+        if ok:
+            names = sorted({s for r in ok for s in r['stages']})
+            entry['stages_ms'] = {
+                s: bench_utils.summarize(r['stages'].get(s, 0.0) for r in ok)
+                for s in names}
+        report['by_router'][kind] = entry
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--network', choices=('graphml', 'grid'),
+                        default='graphml')
+    parser.add_argument('--graphml', default=road_network.DEFAULT_GRAPHML)
+    parser.add_argument('--grid-size', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--load', action='store_true',
+                        help='(Re)load the network into the database first')
+    parser.add_argument('--db-host', default='localhost')
+    parser.add_argument('--db-port', type=int, default=5433)
+    parser.add_argument('--db-name', default='ariadne_bench')
+    parser.add_argument('--db-user', default='ariadne_bench')
+    parser.add_argument('--db-pass', default='ariadne_bench')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--mix', default=DEFAULT_MIX)
+    parser.add_argument('--places-latency-ms', type=float, default=0.0,
+                        help='Artificial Google Places round trip')
+    parser.add_argument('--target', default=None,
+                        help='host:port of a running planner; drive it over '
+                             'gRPC instead of in-process')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    network = build_network(args)
+    workload = make_workload(network, args.requests, parse_mix(args.mix),
+                             args.seed)
+
+    bench_utils.add_planner_to_path()
+    if args.load:
+        import psycopg2
+        import load_pgrouting
+        import put_components
+        import put_edge_elevation
+        conn = psycopg2.connect(host=args.db_host, port=args.db_port,
+                                dbname=args.db_name, user=args.db_user,
+                                password=args.db_pass)
+        load_pgrouting.load_network(conn, network)
+        load_pgrouting.install_sql_functions(conn)
+        put_edge_elevation.add_edge_elevation_sql(conn, from_vertices=True)
+        put_components.add_components_sql(conn)
+        conn.close()
+
+    places = None
+    if args.target is None:
+        os.environ['ARIADNE_CONFIG'] = write_planner_config(args)
+        places = StubPlacesServer(network, seed=args.seed,
+                                  latency_ms=args.places_latency_ms).start()
+        places.install()
+        call = in_process_caller()
+    else:
+        call = grpc_caller(args.target, args.timeout)
+
+    results, wall_s = run(call, workload, args.concurrency)
+
+    report = {
+        'benchmark': 'plan_route',
+        'environment': bench_utils.environment(),
+        'network': network.summary(),
+        'settings': {
+            'requests': args.requests, 'concurrency': args.concurrency,
+            'mix': args.mix, 'seed': args.seed,
+            'mode': 'grpc' if args.target else 'in-process',
+        },
+        'results': make_report(results, wall_s),
+    }
+    if places is not None:
+        report['places_requests'] = places.request_count
+        places.stop()
+    bench_utils.write_report(report, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
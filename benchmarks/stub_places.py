@@ -0,0 +1,128 @@
+"""
+Local stand-in for the Google Places Nearby Search endpoint.
+
+Serves deterministic POIs scattered over the benchmark road network, in the
+JSON shape python-google-places expects, so routers that query Google can be
+driven without an API key or network access. `install()` points
+`googleplaces.GooglePlaces` at the stub for the current process.
+"""
+import json
+import random
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import *
+
+from road_network import RoadNetwork, haversine_m
+
+MAX_RESULTS = 20  # Same page size as the real API
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StubPlacesServer:
+    """Nearby Search stub backed by random POIs placed near network vertices."""
+
+    def __init__(self, network: RoadNetwork, seed: int = 0,
+                 pois_per_type: int = 40, latency_ms: float = 0.0,
+                 host: str = '127.0.0.1', port: int = 0):
+        """
+        :param network: Network to scatter POIs over.
+        :param seed: Seed for POI placement and ratings.
+        :param pois_per_type: Number of POIs generated for each place type.
+        :param latency_ms: Artificial delay added to every response, to
+            mimic the round trip to Google.
+        """
+        self.network = network
+        self.seed = seed
+        self.pois_per_type = pois_per_type
+        self.latency_ms = latency_ms
+        self.request_count = 0
+        self._pois = {}
+        self._lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}/maps/api/place'.format(host, port)
+
+    def pois_for_type(self, place_type: str) -> List[Dict[str, Any]]:
+        with self._lock:
+            if place_type not in self._pois:
+                rng = random.Random('{}:{}'.format(self.seed, place_type))
+                vertices = rng.sample(
+                    self.network.vertices,
+                    min(self.pois_per_type, len(self.network.vertices)))
+                self._pois[place_type] = [{
+                    'place_id': 'stub-{}-{}'.format(place_type, i),
+                    'name': '{} {}'.format(place_type, i),
+                    'rating': round(rng.uniform(2.5, 5.0), 1),
+                    'types': [place_type],
+                    'geometry': {'location': {
+                        'lat': v.lat + rng.uniform(-1e-4, 1e-4),
+                        'lng': v.lon + rng.uniform(-1e-4, 1e-4)}},
+                } for i, v in enumerate(vertices)]
+            return self._pois[place_type]
+
+    def nearby_search(self, params: Dict[str, str]) -> Dict[str, Any]:
+        lat, lng = (float(x) for x in params['location'].split(','))
+        radius = float(params.get('radius', 50000))
+        candidates = []
+        for place in self.pois_for_type(params.get('type', 'establishment')):
+            loc = place['geometry']['location']
+            d = haversine_m(lat, lng, loc['lat'], loc['lng'])
+            if d <= radius:
+                candidates.append((d, place))
+        candidates.sort(key=lambda c: c[0])
+        results = [place for _, place in candidates[:MAX_RESULTS]]
+        return {
+            'html_attributions': [],
+            'results': results,
+            'status': 'OK' if results else 'ZERO_RESULTS',
+        }
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urllib.parse.urlparse(self.path)
+                params = dict(urllib.parse.parse_qsl(parsed.query))
+                if not parsed.path.endswith('/nearbysearch/json'):
+                    self.send_error(404)
+                    return
+                if stub.latency_ms:
+                    threading.Event().wait(stub.latency_ms / 1000)
+                with stub._lock:
+                    stub.request_count += 1
+                body = json.dumps(stub.nearby_search(params)).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> 'StubPlacesServer':
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='stub-places', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def install(self):
+        """Redirect python-google-places Nearby Search calls to this stub."""
+        from googleplaces import GooglePlaces
+        GooglePlaces.NEARBY_SEARCH_API_URL = self.url + '/nearbysearch/json?'
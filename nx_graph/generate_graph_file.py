@@ -1,52 +1,238 @@
-import os
+"""
+Export the road network to a file, streaming it out of the database.
+
+Vertices (ways_vertices_pgr) and edges (ways with ways_metadata) are read
+from server-side cursors CHUNK_ROWS rows at a time, so memory doesn't grow
+with the size of the extract:
+  - graphml (the default, network.graphml next to this file): rows are
+    written straight to the file. It is a simple undirected graph, like the
+    networkx Graph this script used to build: nodes are keyed by osm_id
+    with lat/lng and their pgRouting id, and each pair of nodes has one
+    edge (the shortest of its ways) with gid, length_m, cost, reverse_cost,
+    greenery and popularity. Vertices and ways without OSM ids are left
+    out. benchmarks/road_network.py and networkx read it.
+  - npz: rows are copied into arrays preallocated from the row counts.
+    Vertices are stored in --order (see planner/routers/vertex_order.py)
+    with their pgRouting and OSM ids, and edges sorted to match.
+Everything is read in one repeatable-read transaction, so counts and rows
+agree. Row counts, output size and time are printed at the end.
+
+    python generate_graph_file.py
+    python generate_graph_file.py --format npz --output network.npz
+"""
+import argparse
 import json
+import os
+import sys
+import time
+
+import numpy as np
 import psycopg2
-import networkx as nx
-
-# Import app config
-config = json.load(open('config.json'))
-
-# Setup `psycopg` connection, http://initd.org/psycopg/docs/usage.html
-conn = psycopg2.connect(
-    host=config.get('dbHost'),
-    dbname=config.get('dbName'),
-    user=config.get('dbUser'),
-    password=config.get('dbPass'),
-    port=config.get('dbPort')
-)
-cur = conn.cursor()
-
-print('Testing GIS DB connection...')
-cur.execute('SELECT 1')
-cur.fetchone()
-print('Test successful!')
-
-G = nx.Graph()
-
-print('\nFetching nodes...')
-cur.execute('SELECT osm_id, lat, lon FROM ways_vertices_pgr;')
-nodes = cur.fetchall()
-pos = []
-for node in nodes:
-    node_id = node[0]
-    node_lat = float(node[1])
-    node_lng = float(node[2])
-    G.add_node(node_id, lat=node_lat, lng=node_lng)
-print('Done! Processed {} node(s).'.format(len(nodes)))
-
-print('\nFetching edges...')
-cur.execute('SELECT source_osm, target_osm FROM ways;')
-edges = cur.fetchall()
-for edge in edges:
-    edge_source = edge[0]
-    edge_target = edge[1]
-    G.add_edge(edge_source, edge_target)
-print('Done! Processed {} edge(s).'.format(len(edges)))
-
-output_file = os.path.join(os.path.dirname(__file__), 'network.graphml')
-nx.write_graphml(G, output_file)
-
-# Commit changes to the database (if any) and close connection
-conn.commit()
-cur.close()
-conn.close()
+
+CHUNK_ROWS = 50000
+
+VERTICES_SQL = '''
+    SELECT id, osm_id, lat, lon
+    FROM ways_vertices_pgr
+    ORDER BY id
+    '''
+
+EDGES_SQL = '''
+    SELECT ways.gid, source, target, source_osm, target_osm, length_m, cost,
+           reverse_cost, greenery, popularity_highres
+    FROM ways
+      LEFT JOIN ways_metadata USING (gid)
+    ORDER BY ways.gid
+    '''
+
+# What write_graphml writes: one vertex per osm_id and one way per pair of
+# them. DISTINCT ON runs in the database, so the export still streams.
+GRAPHML_VERTICES_SQL = '''
+    SELECT DISTINCT ON (osm_id) id, osm_id, lat, lon
+    FROM ways_vertices_pgr
+    WHERE osm_id IS NOT NULL
+    ORDER BY osm_id, id
+    '''
+
+GRAPHML_EDGES_SQL = '''
+    SELECT DISTINCT ON (LEAST(source_osm, target_osm),
+                        GREATEST(source_osm, target_osm))
+           ways.gid, source, target, source_osm, target_osm, length_m, cost,
+           reverse_cost, greenery, popularity_highres
+    FROM ways
+      LEFT JOIN ways_metadata USING (gid)
+    WHERE source_osm IS NOT NULL AND target_osm IS NOT NULL
+    ORDER BY LEAST(source_osm, target_osm),
+             GREATEST(source_osm, target_osm), length_m, ways.gid
+    '''
+
+EDGE_COLUMNS = ('gid', 'source', 'target', 'source_osm', 'target_osm',
+                'length_m', 'cost', 'reverse_cost', 'greenery', 'popularity')
+
+# (id, name, type) of the GraphML data keys. d0 and d1 are what networkx
+# wrote before.
+NODE_KEYS = [('d0', 'lng', 'double'), ('d1', 'lat', 'double'),
+             ('d2', 'pgr_id', 'long')]
+EDGE_KEYS = [('d3', 'gid', 'long'), ('d4', 'length_m', 'double'),
+             ('d5', 'cost', 'double'), ('d6', 'reverse_cost', 'double'),
+             ('d7', 'greenery', 'double'), ('d8', 'popularity', 'double')]
+
+GRAPHML_HEADER = '''<?xml version='1.0' encoding='utf-8'?>
+<graphml xmlns="http://graphml.graphdrawing.org/xmlns" \
+xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" \
+xsi:schemaLocation="http://graphml.graphdrawing.org/xmlns \
+http://graphml.graphdrawing.org/xmlns/1.0/graphml.xsd">
+'''
+
+
+def stream(conn, sql: str, name: str, chunk_rows: int):
+    """Rows of sql, in lists of up to chunk_rows, from a named cursor."""
+    with conn.cursor(name=name) as cur:
+        cur.itersize = chunk_rows
+        cur.execute(sql)
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield rows
+
+
+def count(conn, table: str) -> int:
+    with conn.cursor() as cur:
+        cur.execute('SELECT count(*) FROM {}'.format(table))
+        return cur.fetchone()[0]
+
+
+def _data(keys, values) -> str:
+    """<data> elements for the values that aren't NULL."""
+    return ''.join('      <data key="{}">{}</data>\n'.format(key[0], value)
+                   for key, value in zip(keys, values) if value is not None)
+
+
+def write_graphml(conn, path: str, chunk_rows: int = CHUNK_ROWS):
+    """:return: (vertices, edges) written."""
+    vertices = edges = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(GRAPHML_HEADER)
+        for key_id, name, type_ in NODE_KEYS:
+            f.write('  <key attr.name="{}" attr.type="{}" for="node" '
+                    'id="{}" />\n'.format(name, type_, key_id))
+        for key_id, name, type_ in EDGE_KEYS:
+            f.write('  <key attr.name="{}" attr.type="{}" for="edge" '
+                    'id="{}" />\n'.format(name, type_, key_id))
+        f.write('  <graph edgedefault="undirected">\n')
+
+        for rows in stream(conn, GRAPHML_VERTICES_SQL, 'export_vertices',
+                           chunk_rows):
+            f.write(''.join(
+                '    <node id="{}">\n{}    </node>\n'.format(
+                    osm_id, _data(NODE_KEYS, (lon, lat, pgr_id)))
+                for pgr_id, osm_id, lat, lon in rows))
+            vertices += len(rows)
+        print('Wrote {} vertices'.format(vertices))
+
+        for rows in stream(conn, GRAPHML_EDGES_SQL, 'export_edges',
+                           chunk_rows):
+            f.write(''.join(
+                '    <edge source="{}" target="{}">\n{}    </edge>\n'.format(
+                    row[3], row[4], _data(EDGE_KEYS, row[:1] + row[5:]))
+                for row in rows))
+            edges += len(rows)
+        print('Wrote {} edges'.format(edges))
+
+        f.write('  </graph>\n</graphml>\n')
+    return vertices, edges
+
+
+def _fill(conn, sql: str, name: str, n: int, width: int,
+          chunk_rows: int) -> np.ndarray:
+    """(n, width) float64 array of the rows of sql, NULLs as NaN."""
+    out = np.empty((n, width), dtype=np.float64)
+    i = 0
+    for rows in stream(conn, sql, name, chunk_rows):
+        out[i:i + len(rows)] = np.array(rows, dtype=np.float64)
+        i += len(rows)
+    return out[:i]
+
+
+def write_npz(conn, path: str, order: str, chunk_rows: int = CHUNK_ROWS):
+    """:return: (vertices, edges) written."""
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(
+        __file__)), os.pardir, 'planner'))
+    from routers.vertex_order import VertexTable
+
+    vertices = _fill(conn, VERTICES_SQL, 'export_vertices',
+                     count(conn, 'ways_vertices_pgr'), 4, chunk_rows)
+    print('Read {} vertices'.format(len(vertices)))
+    edges = _fill(conn, EDGES_SQL, 'export_edges', count(conn, 'ways'),
+                  len(EDGE_COLUMNS), chunk_rows)
+    print('Read {} edges'.format(len(edges)))
+
+    ids, osm_ids, lat, lon = vertices.T
+    table = VertexTable(ids, np.nan_to_num(osm_ids), lon, lat).ordered(
+        order, edges[:, 1], edges[:, 2])
+    # Edges by the position of their ends, as EdgeAttributes.in_vertex_order
+    rows = [table.position(edges[:, 1]), table.position(edges[:, 2])]
+    for r in rows:
+        r[r < 0] = len(table)
+    edges = edges[np.lexsort((np.maximum(*rows), np.minimum(*rows)))]
+
+    columns = {name: edges[:, i] for i, name in enumerate(EDGE_COLUMNS)}
+    for name in ('gid', 'source', 'target', 'source_osm', 'target_osm'):
+        columns[name] = np.nan_to_num(columns[name]).astype(np.int64)
+    with open(path, 'wb') as f:
+        np.savez(f, vertex_order=order, vertex_id=table.ids,
+                 vertex_osm_id=table.osm_ids, lat=table.lat, lon=table.lon,
+                 **columns)
+    return len(table), len(edges)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Export the road network to GraphML or npz')
+    parser.add_argument('--config', default='config.json',
+                        help='Planner config with the database settings')
+    parser.add_argument('--format', choices=('graphml', 'npz'),
+                        default='graphml')
+    parser.add_argument('--output', default=None,
+                        help='Defaults to network.<format> next to this '
+                             'script')
+    parser.add_argument('--order', default='hilbert',
+                        help='npz vertex order: hilbert, morton, bfs or id')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    output = args.output or os.path.join(os.path.dirname(__file__),
+                                         'network.' + args.format)
+
+    conn = psycopg2.connect(
+        host=config.get('dbHost'),
+        dbname=config.get('dbName'),
+        user=config.get('dbUser'),
+        password=config.get('dbPass'),
+        port=config.get('dbPort')
+    )
+    # One snapshot for the counts and every chunk
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    start = time.perf_counter()
+    try:
+        if args.format == 'graphml':
+            vertices, edges = write_graphml(conn, output, args.chunk_rows)
+        else:
+            vertices, edges = write_npz(conn, output, args.order,
+                                        args.chunk_rows)
+    finally:
+        conn.rollback()
+        conn.close()
+    elapsed = time.perf_counter() - start
+
+    size = os.path.getsize(output)
+    print('{}: {} vertices, {} edges, {:.1f} MB in {:.1f}s ({:.0f} rows/s)'
+          .format(output, vertices, edges, size / 1e6, elapsed,
+                  (vertices + edges) / max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
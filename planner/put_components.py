@@ -0,0 +1,54 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Precompute vertex_components (see sql/vertexComponents.sql) so routers can
+# tell up front whether two vertices are connected, instead of finding out
+# from an empty pgRouting result.
+
+CONNECTED_EDGES_SQL = \
+    'SELECT gid AS id, source, target, length_m AS cost FROM ways'
+STRONG_EDGES_SQL = '''
+    SELECT gid AS id, source, target, length_m AS cost,
+           length_m * SIGN(reverse_cost) AS reverse_cost
+    FROM ways'''
+
+
+def add_components_sql(conn):
+    """
+    Rebuild vertex_components with pgr_connectedComponents and
+    pgr_strongComponents.
+    :return: Number of vertices labelled.
+    """
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute('''
+            TRUNCATE vertex_components;
+            INSERT INTO vertex_components (id, component, strong_component)
+            SELECT cc.node, cc.component, sc.component
+            FROM pgr_connectedComponents(%s) cc
+              JOIN pgr_strongComponents(%s) sc USING (node);
+            ANALYZE vertex_components;
+            ''', (CONNECTED_EDGES_SQL, STRONG_EDGES_SQL))
+        cur.execute('SELECT count(*) FROM vertex_components')
+        written = cur.fetchone()[0]
+    conn.commit()
+    logger.info('Labelled %d vertices in %.1fs', written,
+                time.perf_counter() - start)
+    return written
+
+
+def main():
+    conn = db_conn.connPool.getconn()
+    try:
+        print(add_components_sql(conn))
+    finally:
+        db_conn.connPool.putconn(conn)
+
+
+if __name__ == '__main__':
+    import db_conn
+
+    logging.basicConfig(level=logging.INFO)
+    main()
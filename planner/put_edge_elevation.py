@@ -0,0 +1,205 @@
+import argparse
+import io
+import json
+import logging
+import time
+from typing import *
+
+import numpy as np
+
+from routers import edge_costs
+from utils import elevation_utils
+from utils.elevation_provider import ElevationProvider, UsgsBackend
+
+logger = logging.getLogger(__name__)
+
+# Precompute ways_elevation (see sql/waysElevation.sql) so routes can be given
+# elevation data without joining ways_vertices_pgr for every path node.
+#
+# Profiles are sampled every PROFILE_SPACING_M along the edge from the DEM, or
+# taken as a straight line between the endpoint vertex elevations with
+# --from-vertices.
+
+PROFILE_SPACING_M = 25.0
+CHUNK_SIZE = 20000
+EARTH_RADIUS_M = 6371000.0
+
+
+def _segment_lengths_m(lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """Haversine length of each segment of a polyline, in meters."""
+    phi = np.radians(lats)
+    dphi = np.diff(phi)
+    dlmb = np.radians(np.diff(lons))
+    a = np.sin(dphi / 2) ** 2 \
+        + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
+
+
+def sample_points(coords, spacing: float = PROFILE_SPACING_M):
+    """
+    Points every `spacing` meters along a linestring, including both ends.
+    :param coords: [(lon, lat), ...] of the edge geometry.
+    :return: (lons, lats, distances along the edge in meters).
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    seg = _segment_lengths_m(coords[:, 0], coords[:, 1])
+    along = np.concatenate([[0.0], np.cumsum(seg)])
+    total = along[-1]
+    n = max(int(np.ceil(total / spacing)), 1) + 1
+    at = np.linspace(0.0, total, n)
+    return (np.interp(at, along, coords[:, 0]),
+            np.interp(at, along, coords[:, 1]), at)
+
+
+def summarize_profile(elevations_ft: np.ndarray, distances_m: np.ndarray):
+    """
+    :return: (gain, loss, climb, reverse_climb, max_grade, profile) for
+        travelling the samples in order. profile is float16 relative to the
+        first sample.
+    """
+    diffs = np.diff(elevations_ft)
+    gain = float(diffs[diffs > 0].sum())
+    loss = float(-diffs[diffs < 0].sum())
+    runs = np.diff(distances_m)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grades = np.abs(elevation_utils.feetToMeters(diffs)) / runs
+    grades = grades[np.isfinite(grades)]
+    max_grade = float(grades.max()) if len(grades) else 0.0
+    length = distances_m[-1] - distances_m[0]
+    profile = (elevations_ft - elevations_ft[0]).astype('<f2')
+    return (gain, loss, float(edge_costs.climb_score(gain, length)),
+            float(edge_costs.climb_score(loss, length)), max_grade, profile)
+
+
+def _copy_rows(cur, rows):
+    buf = io.StringIO()
+    for gid, src, tgt, gain, loss, climb, reverse, grade, profile in rows:
+        buf.write('%d\t%.3f\t%.3f\t%.3f\t%.3f\t%.4f\t%.4f\t%.5f\t' % (
+            gid, src, tgt, gain, loss, climb, reverse, grade))
+        buf.write('\\\\x%s\n' % profile.tobytes().hex())
+    buf.seek(0)
+    cur.copy_expert('''
+        COPY ways_elevation_staging
+            (gid, source_elevation, target_elevation, gain, loss, climb,
+             reverse_climb, max_grade, profile)
+        FROM STDIN''', buf)
+
+
+def _dem_rows(conn, provider: ElevationProvider, chunk_size: int,
+              spacing: float):
+    with conn.cursor(name='edge_geometries') as edges:
+        edges.itersize = chunk_size
+        edges.execute('SELECT gid, ST_AsGeoJSON(the_geom) FROM ways')
+        while True:
+            chunk = edges.fetchmany(chunk_size)
+            if not chunk:
+                break
+            # Sample every edge of the chunk with a single provider call
+            samples = [sample_points(json.loads(g)['coordinates'], spacing)
+                       for _, g in chunk]
+            lons = np.concatenate([s[0] for s in samples])
+            lats = np.concatenate([s[1] for s in samples])
+            elevations = elevation_utils.metersToFeet(
+                provider.elevations(lats, lons))
+            offset = 0
+            rows = []
+            for (gid, _), (_, _, at) in zip(chunk, samples):
+                elev = elevations[offset:offset + len(at)]
+                offset += len(at)
+                if np.isnan(elev).any():
+                    continue
+                rows.append((gid, elev[0], elev[-1])
+                            + summarize_profile(elev, at))
+            yield rows
+
+
+def _vertex_rows(conn, chunk_size: int):
+    with conn.cursor(name='edge_endpoints') as edges:
+        edges.itersize = chunk_size
+        edges.execute('''
+            SELECT gid, length_m, vs.elevation, vt.elevation
+            FROM ways
+              JOIN ways_vertices_pgr vs ON ways.source = vs.id
+              JOIN ways_vertices_pgr vt ON ways.target = vt.id
+            WHERE vs.elevation IS NOT NULL AND vt.elevation IS NOT NULL
+            ''')
+        while True:
+            chunk = edges.fetchmany(chunk_size)
+            if not chunk:
+                break
+            rows = []
+            for gid, length, src, tgt in chunk:
+                elev = np.array([float(src), float(tgt)])
+                rows.append((gid, elev[0], elev[1]) + summarize_profile(
+                    elev, np.array([0.0, float(length)])))
+            yield rows
+
+
+def add_edge_elevation_sql(conn, dem_dir: Optional[str] = None,
+                           from_vertices: bool = False,
+                           chunk_size: int = CHUNK_SIZE,
+                           spacing: float = PROFILE_SPACING_M):
+    """
+    Rebuild ways_elevation.
+    :param dem_dir: DEM tiles to sample profiles from (see utils/dem.py).
+        Edges the DEM doesn't fully cover are looked up remotely.
+    :param from_vertices: Use the endpoint elevations already in
+        ways_vertices_pgr instead of sampling a DEM.
+    :return: Number of edges written.
+    """
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TEMP TABLE ways_elevation_staging
+                (LIKE ways_elevation) ON COMMIT DROP
+            ''')
+
+    if from_vertices:
+        chunks = _vertex_rows(conn, chunk_size)
+    else:
+        provider = ElevationProvider(dem_dir, fallback=UsgsBackend())
+        chunks = _dem_rows(conn, provider, chunk_size, spacing)
+
+    written = 0
+    with conn.cursor() as cur:
+        for rows in chunks:
+            _copy_rows(cur, rows)
+            written += len(rows)
+            logger.info('Staged %d edges', written)
+        cur.execute('''
+            TRUNCATE ways_elevation;
+            INSERT INTO ways_elevation SELECT * FROM ways_elevation_staging;
+            ANALYZE ways_elevation;
+            ''')
+    conn.commit()
+    logger.info('Wrote %d edge profiles in %.1fs', written,
+                time.perf_counter() - start)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Precompute per-edge elevation profiles and grades')
+    parser.add_argument('--dem-dir', default=None,
+                        help='Directory of .hgt/GeoTIFF DEM tiles')
+    parser.add_argument('--from-vertices', action='store_true',
+                        help='Interpolate between vertex elevations instead '
+                             'of sampling a DEM')
+    parser.add_argument('--spacing', type=float, default=PROFILE_SPACING_M,
+                        help='Profile sample spacing in meters')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    conn = db_conn.connPool.getconn()
+    try:
+        print(add_edge_elevation_sql(conn, args.dem_dir, args.from_vertices,
+                                     args.chunk_size, args.spacing))
+    finally:
+        db_conn.connPool.putconn(conn)
+
+
+if __name__ == '__main__':
+    import db_conn
+
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -1,74 +1,128 @@
-import heapq
-import itertools
+import argparse
+import io
 import logging
-import statistics
-import random
-from http import client
+import time
 from typing import *
 
-__all__ = ['OrienteeringRouter']
+import numpy as np
 
-logger = logging.getLogger(__name__)
+from utils import elevation_utils
+from utils.elevation_provider import ElevationProvider, UsgsBackend
 
-# This function will get the elevation at any point in the US (though not all of Alaska)
-def getElevation(latitude, longitude): 
-    return USGS10mElev(latitude, longitude)
-
-# I found this code to query the USGS elevation data at:
-# https://gist.github.com/pyRobShrk/8df3a3c422fb1c88882a5e41b284349f
-def USGS10mElev(lat,lon):
-    usgs = client.HTTPConnection('ned.usgs.gov')
-    usgs.request('GET','/epqs/pqs.php?x=%.6f&y=%.6f&units=FEET&output=xml'% (lon, lat))
-    result = usgs.getresponse()
-    if result.status == 200:
-        xml = result.read()
-        return float(xml[xml.find(b'<Elevation>')+11:xml.find(b'</Elevation>')-1])
-    else: return xml
+logger = logging.getLogger(__name__)
 
 # Assuming that the elevation column already exists
 # (I ran the following in DataGrip before running this python script)
 # -- ALTER TABLE public.ways_vertices_pgr
 # --     ADD elevation numeric(11,3)
+#
+# Elevations are stored in feet, like the USGS service returns them.
+
+CHUNK_SIZE = 50000
+
+
+def _copy_chunk(cur, ids: np.ndarray, elevations: np.ndarray):
+    """COPY (id, elevation) rows into the staging table, skipping NaNs."""
+    ok = ~np.isnan(elevations)
+    buf = io.StringIO()
+    np.savetxt(buf, np.column_stack([ids[ok], elevations[ok]]),
+               fmt=['%d', '%.3f'], delimiter='\t')
+    buf.seek(0)
+    cur.copy_expert('COPY elevation_staging (id, elevation) FROM STDIN', buf)
+    return int(ok.sum())
+
+
+def add_elevation_sql(conn, dem_dir: Optional[str] = None,
+                      remote_fallback: bool = True, only_missing: bool = False,
+                      chunk_size: int = CHUNK_SIZE, workers: int = 16):
+    """
+    Fill in ways_vertices_pgr.elevation.
+
+    Vertices are streamed from a server-side cursor in chunks and sampled
+    from the local DEM tiles in dem_dir. Points the DEM doesn't cover are
+    looked up remotely if remote_fallback is set. Results are COPYed into a
+    staging table and applied with a single UPDATE at the end.
+    :param dem_dir: Directory of DEM tiles (see utils/dem.py), or None to use
+        only the remote service.
+    :param only_missing: Only fill vertices whose elevation is NULL.
+    :return: Number of vertices updated.
+    """
+    provider = ElevationProvider(
+        dem_dir, fallback=UsgsBackend(workers=workers)
+        if remote_fallback else None)
+    start = time.perf_counter()
+    seen = staged = 0
 
-def add_elevation_sql(conn):ß
     with conn.cursor() as cur:
-        # Get the elevation data for each point in our database.
-        # (This probably isn't the most efficient way to do this,
-        # but it only has to be done once.)
-        cur.execute(
-            '''
-            SELECT
-              id, lat, lon, elevation
-            FROM ways_vertices_pgr
-            '''
-        )
-        data = cur.fetchall()
-        for location in data:
-            loc_id = location[0]
-            lat = location[1]
-            lon = location[2]
-            elevation = getElevation(lat, lon)
-            cur.execute(
-                '''
-                UPDATE ways_vertices_pgr
-                    SET elevation = %s
-                    WHERE id = %s
-                ''', (elevation, loc_id)
-            )
-        print("finished")
-        # This takes a while to run, so it prints out something when it is done
-        conn.commit()
-        cur.close()
-        conn.close()
-        return 0
+        cur.execute('''
+            CREATE TEMP TABLE elevation_staging (
+                id bigint PRIMARY KEY,
+                elevation numeric(11,3)
+            ) ON COMMIT DROP
+            ''')
+
+    # Named cursor = server-side cursor, so only one chunk is in memory
+    with conn.cursor(name='elevation_vertices') as vertices, \
+            conn.cursor() as cur:
+        vertices.itersize = chunk_size
+        vertices.execute('''
+            SELECT id, lat, lon FROM ways_vertices_pgr
+            ''' + ('WHERE elevation IS NULL' if only_missing else ''))
+        while True:
+            rows = vertices.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunk = np.array(rows, dtype=np.float64)
+            ids, lats, lons = chunk[:, 0].astype(np.int64), chunk[:, 1], \
+                chunk[:, 2]
+
+            elevations = elevation_utils.metersToFeet(
+                provider.elevations(lats, lons))
+            staged += _copy_chunk(cur, ids, elevations)
+            seen += len(ids)
+            logger.info('Staged %d/%d vertices', staged, seen)
+
+        cur.execute('''
+            UPDATE ways_vertices_pgr v
+                SET elevation = s.elevation
+                FROM elevation_staging s
+                WHERE v.id = s.id
+            ''')
+        updated = cur.rowcount
+
+    conn.commit()
+    logger.info('Updated %d of %d vertices in %.1fs (%d without elevation)',
+                updated, seen, time.perf_counter() - start, seen - staged)
+    return updated
+
 
 def main():
+    parser = argparse.ArgumentParser(
+        description='Fill in ways_vertices_pgr.elevation')
+    parser.add_argument('--dem-dir', default=None,
+                        help='Directory of .hgt/GeoTIFF DEM tiles')
+    parser.add_argument('--no-remote', action='store_true',
+                        help="Don't query USGS for points the DEM misses")
+    parser.add_argument('--only-missing', action='store_true',
+                        help='Only fill vertices without an elevation')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=16,
+                        help='Concurrent remote lookups')
+    args = parser.parse_args()
 
     conn = db_conn.connPool.getconn()
-    print(add_elevation_sql(conn))
+    try:
+        print(add_elevation_sql(conn, args.dem_dir,
+                                remote_fallback=not args.no_remote,
+                                only_missing=args.only_missing,
+                                chunk_size=args.chunk_size,
+                                workers=args.workers))
+    finally:
+        db_conn.connPool.putconn(conn)
 
 
 if __name__ == '__main__':
     import db_conn
 
+    logging.basicConfig(level=logging.INFO)
     main()
@@ -0,0 +1,142 @@
+import argparse
+import json
+import logging
+import os
+import time
+from typing import *
+
+import numpy as np
+
+from routers import edge_costs, orienteering_router
+from routers.graph import Graph
+from routers.poi_distances import PoiDistanceTable, prefs_key
+
+logger = logging.getLogger(__name__)
+
+# Precompute the POI-to-POI distance table of a region (see
+# routers/poi_distances.py), so orienteering requests there only search from
+# the origin and back from the destination.
+#
+# POIs come from a JSON file of [{"place_id", "lat", "lon"}, ...], or from
+# Google Places around the middle of the region.
+#
+# With --in-memory, distances come from Graph.distance_matrix over the
+# cached edge attributes (compiled if Numba is installed) instead of
+# pgr_dijkstra batches.
+
+SOURCES_PER_QUERY = 50
+
+# Preference vectors to precompute if none are given
+DEFAULT_PREFS = [{}, {'green': 1.0}, {'popularity': 1.0}]
+
+
+def _google_pois(bbox: Sequence[float], poi_types: List[str]) -> List[dict]:
+    xmin, ymin, xmax, ymax = bbox
+    center = ((ymin + ymax) / 2, (xmin + xmax) / 2)
+    radius = orienteering_router.haversine_m(ymin, xmin, ymax, xmax) / 2
+    places = orienteering_router.get_pois_from_gmaps(
+        center, float(radius), {t: 1.0 for t in poi_types})
+    return [{'place_id': p.place_id, 'lat': p.latlon[0], 'lon': p.latlon[1]}
+            for p in places if p.place_id]
+
+
+def _graph_distances(conn, edge_prefs: Dict[str, float],
+                     vertices: List[int]) -> np.ndarray:
+    """Distances between vertices by in-memory search, inf if no path."""
+    graph = Graph.from_attributes(edge_costs.edge_attributes(conn),
+                                  edge_prefs)
+    present = np.flatnonzero(np.isin(vertices, graph.vertex_ids))
+    index = [graph.vertex(vertices[i]) for i in present]
+    distances = np.full((len(vertices), len(vertices)), np.inf)
+    distances[np.ix_(present, present)] = graph.distance_matrix(index, index)
+    return distances
+
+
+def build_table(conn, region: str, bbox: Sequence[float], pois: List[dict],
+                prefs: List[Dict[str, float]],
+                sources_per_query: int = SOURCES_PER_QUERY,
+                in_memory: bool = False) -> PoiDistanceTable:
+    """
+    :param pois: [{"place_id", "lat", "lon"}, ...]
+    :param prefs: Edge preference vectors to compute distances for.
+    :param in_memory: Search the in-memory Graph instead of the database.
+    """
+    unique = {p['place_id']: p for p in pois}
+    place_ids = sorted(unique)
+    vertices = [orienteering_router.nearest_vertex(
+        conn, (unique[p]['lat'], unique[p]['lon'])) for p in place_ids]
+    distinct = sorted(set(vertices))
+    column = {v: i for i, v in enumerate(distinct)}
+    rows = np.array([column[v] for v in vertices])
+
+    distances = np.full((len(prefs), len(place_ids), len(place_ids)),
+                        np.inf, dtype=np.float32)
+    for k, edge_prefs in enumerate(prefs):
+        start = time.perf_counter()
+        # Distances between distinct vertices, then spread to the POIs
+        if in_memory:
+            vertex_dist = _graph_distances(conn, edge_prefs, distinct)
+        else:
+            edges_sql = orienteering_router.make_edges_sql(conn, edge_prefs)
+            vertex_dist = np.full((len(distinct), len(distinct)), np.inf)
+            for i in range(0, len(distinct), sources_per_query):
+                pairdist = orienteering_router.pairwise_shortest_path_costs(
+                    conn, edges_sql, distinct[i:i + sources_per_query],
+                    distinct)
+                for (a, b), d in pairdist.items():
+                    vertex_dist[column[a], column[b]] = d
+        np.fill_diagonal(vertex_dist, 0.0)
+        distances[k] = vertex_dist[np.ix_(rows, rows)]
+        logger.info('%s: %d POIs (%d vertices) in %.1fs', prefs_key(edge_prefs),
+                    len(place_ids), len(distinct), time.perf_counter() - start)
+    return PoiDistanceTable(region, bbox, place_ids, vertices,
+                            [prefs_key(p) for p in prefs], distances)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Precompute POI-to-POI road distances for a region')
+    parser.add_argument('region', help='Region name, used as the file name')
+    parser.add_argument('--bbox', required=True,
+                        help='xmin,ymin,xmax,ymax of the region')
+    parser.add_argument('--pois-file', default=None,
+                        help='JSON list of {"place_id", "lat", "lon"}')
+    parser.add_argument('--poi-types', default='park',
+                        help='Comma-separated Google place types to fetch '
+                             'when no --pois-file is given')
+    parser.add_argument('--prefs', default=None,
+                        help='JSON list of edge preference vectors')
+    parser.add_argument('--in-memory', action='store_true',
+                        help='Search the in-memory graph instead of running '
+                             'pgr_dijkstra')
+    parser.add_argument('--output-dir', default=None,
+                        help='Defaults to the poiDistanceDir config option')
+    args = parser.parse_args()
+
+    bbox = [float(x) for x in args.bbox.split(',')]
+    if args.pois_file:
+        with open(args.pois_file) as f:
+            pois = json.load(f)
+    else:
+        pois = _google_pois(bbox, args.poi_types.split(','))
+    prefs = json.loads(args.prefs) if args.prefs else DEFAULT_PREFS
+    output_dir = args.output_dir or config['poiDistanceDir']
+
+    conn = db_conn.connPool.getconn()
+    try:
+        table = build_table(conn, args.region, bbox, pois, prefs,
+                            in_memory=args.in_memory)
+    finally:
+        db_conn.connPool.putconn(conn)
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, args.region + '.npz')
+    table.save(path)
+    print(path, len(table), os.path.getsize(path))
+
+
+if __name__ == '__main__':
+    import db_conn
+    from config import config
+
+    logging.basicConfig(level=logging.INFO)
+    main()
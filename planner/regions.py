@@ -0,0 +1,285 @@
+"""
+Regional sharding: which database, and which process, serves a request.
+
+The "regions" config option maps each region name to a bbox [xmin, ymin,
+xmax, ymax] (lon/lat) and its own database settings (dbHost, dbName, dbUser,
+dbPass, dbPort, dbPoolSize), each defaulting to the top-level option.
+Without it there is a single region, snapshot.DEFAULT_REGION, that covers
+everything and uses the top-level database, as before.
+
+RegionRegistry.route() picks the region holding both a request's origin and
+its destination, and rejects requests outside every region or spanning two
+with ValueError before they queue. Regions open lazily: the first request
+for a region creates its connection pool, and the region's snapshot (see
+routers/snapshot.py) fills as requests use it. At most "maxResidentRegions"
+stay open; opening another closes the least recently used idle region and
+drops its snapshot.
+
+"regionOwners" is the routing table of a fleet where different processes
+serve different regions: region name -> address of the process that owns
+it. A process (at "serverAddress") serves the regions it owns and those
+without an owner; requests for any other raise RegionNotServed, which names
+the owner so the caller can send the request there.
+"""
+import collections
+import logging
+import threading
+from contextlib import contextmanager
+from typing import *
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from routers import snapshot
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+DB_SETTINGS = ('dbHost', 'dbName', 'dbUser', 'dbPass', 'dbPort',
+               'dbPoolSize')
+DEFAULT_MAX_RESIDENT = 4
+
+
+class RegionNotServed(Exception):
+    """The request's region is owned by another planner process."""
+
+    def __init__(self, region: str, owner: str):
+        super().__init__('Region {} is served by {}'.format(region, owner))
+        self.region = region
+        self.owner = owner
+
+
+class Region:
+    def __init__(self, name: str, bbox: Optional[Sequence[float]] = None,
+                 settings: Optional[Dict[str, Any]] = None,
+                 owner: Optional[str] = None):
+        """
+        :param bbox: (xmin, ymin, xmax, ymax); None covers everywhere.
+        :param settings: Database settings, DB_SETTINGS keys.
+        :param owner: Address of the process that serves the region, None
+            for any.
+        """
+        self.name = name
+        self.bbox = tuple(float(x) for x in bbox) if bbox is not None \
+            else None
+        self.settings = dict(settings or {})
+        self.owner = owner
+
+    def contains(self, latlon: Tuple[float, float]) -> bool:
+        if self.bbox is None:
+            return True
+        xmin, ymin, xmax, ymax = self.bbox
+        return xmin <= latlon[1] <= xmax and ymin <= latlon[0] <= ymax
+
+    def _connect_args(self) -> Dict[str, Any]:
+        return dict(host=self.settings.get('dbHost'),
+                    dbname=self.settings.get('dbName'),
+                    user=self.settings.get('dbUser'),
+                    password=self.settings.get('dbPass'),
+                    port=self.settings.get('dbPort'))
+
+    def connect(self, min_size: int = 1) -> ThreadedConnectionPool:
+        """
+        The region's request pool, of dbPoolSize connections but at least
+        min_size: ThreadedConnectionPool raises instead of waiting when
+        it runs out.
+        """
+        size = self.settings.get('dbPoolSize', 10)
+        if size < min_size:
+            logger.warning('dbPoolSize of region %s is %d, using %d: one per '
+                           'request that can run at once', self.name, size,
+                           min_size)
+            size = min_size
+        return ThreadedConnectionPool(1, size, **self._connect_args())
+
+    def connection(self):
+        """A connection of its own, outside the request pool."""
+        return psycopg2.connect(**self._connect_args())
+
+
+class _Resident:
+    """An open region: its pool and the number of requests using it."""
+
+    def __init__(self, pool: ThreadedConnectionPool):
+        self.pool = pool
+        self.users = 0
+
+
+class RegionRegistry:
+    def __init__(self, regions: Sequence[Region],
+                 address: Optional[str] = None,
+                 max_resident: int = DEFAULT_MAX_RESIDENT,
+                 concurrency: int = 1):
+        """
+        :param regions: In order of preference where bboxes overlap.
+        :param address: This process's address in the region owners.
+        :param concurrency: Most requests that can hold a connection at
+            once; every region's pool has room for them all.
+        """
+        self.regions = list(regions)
+        self.address = address
+        self.max_resident = max(1, max_resident)
+        self.concurrency = concurrency
+        # Least recently used first
+        self._resident = collections.OrderedDict()  # name -> _Resident
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any],
+                    concurrency: int = 1) -> 'RegionRegistry':
+        defaults = {k: config[k] for k in DB_SETTINGS if k in config}
+        owners = config.get('regionOwners', {})
+        regions = [
+            Region(name, spec.get('bbox'),
+                   dict(defaults, **{k: spec[k] for k in DB_SETTINGS
+                                     if k in spec}),
+                   owners.get(name))
+            for name, spec in config.get('regions', {}).items()]
+        if not regions:
+            regions = [Region(snapshot.DEFAULT_REGION, None, defaults,
+                              owners.get(snapshot.DEFAULT_REGION))]
+        return cls(regions, config.get('serverAddress'),
+                   config.get('maxResidentRegions', DEFAULT_MAX_RESIDENT),
+                   concurrency)
+
+    def owns(self, region: Region) -> bool:
+        return region.owner is None or region.owner == self.address
+
+    def route(self, origin: Tuple[float, float],
+              dest: Tuple[float, float]) -> Region:
+        """
+        The first region containing origin and dest (lat, lon).
+        ValueError if there is none, RegionNotServed if another process
+        owns it.
+        """
+        for region in self.regions:
+            if region.contains(origin) and region.contains(dest):
+                if not self.owns(region):
+                    raise RegionNotServed(region.name, region.owner)
+                return region
+        for latlon, name in ((origin, 'Origin'), (dest, 'Destination')):
+            if not any(r.contains(latlon) for r in self.regions):
+                raise ValueError('{} is outside every region served'
+                                 .format(name))
+        raise ValueError('Origin and destination are in different regions')
+
+    def resident(self) -> List[str]:
+        """Names of the open regions, least recently used first."""
+        with self._lock:
+            return list(self._resident)
+
+    def _acquire(self, region: Region, touch: bool = True
+                 ) -> Optional[_Resident]:
+        with self._lock:
+            resident = self._resident.get(region.name)
+            if resident is not None:
+                resident.users += 1
+                if touch:
+                    self._resident.move_to_end(region.name)
+            return resident
+
+    def _release(self, resident: _Resident):
+        with self._lock:
+            resident.users -= 1
+            # Regions in use when another opened are closed once idle
+            evicted = self._evict() if resident.users == 0 else []
+        self._close(evicted)
+
+    def _open(self, region: Region) -> _Resident:
+        """Open region (or wait for another thread to), with one user."""
+        # Connecting happens outside _lock so requests for open regions
+        # aren't held up
+        with self._open_lock:
+            resident = self._acquire(region)
+            if resident is not None:
+                return resident
+            pool = region.connect(self.concurrency)
+            try:
+                # Fingerprint the network before anything is loaded, so the
+                # next reload can tell a metadata-only change (snapshot.py)
+                self._reload(region)
+            except Exception:
+                pool.closeall()
+                raise
+            resident = _Resident(pool)
+            resident.users = 1
+            with self._lock:
+                self._resident[region.name] = resident
+                evicted = self._evict()
+        logger.info('Opened region %s', region.name)
+        self._close(evicted)
+        return resident
+
+    def _evict(self) -> List[Tuple[str, _Resident]]:
+        """
+        Take least recently used idle regions out until at most
+        max_resident are left (or every one left is in use). Holds _lock.
+        """
+        evicted = []
+        for name in list(self._resident):
+            if len(self._resident) <= self.max_resident:
+                break
+            if self._resident[name].users == 0:
+                evicted.append((name, self._resident.pop(name)))
+        metrics.resident_regions.set(len(self._resident))
+        return evicted
+
+    @staticmethod
+    def _close(evicted: List[Tuple[str, _Resident]]):
+        for name, resident in evicted:
+            resident.pool.closeall()
+            snapshot.drop(name)
+            logger.info('Closed region %s', name)
+
+    @staticmethod
+    def _reload(region: Region):
+        """snapshot.reload() region on a connection of its own."""
+        conn = region.connection()
+        try:
+            with conn:
+                snapshot.reload(conn, region.name)
+        finally:
+            conn.close()
+
+    @contextmanager
+    def pool(self, region: Region):
+        """region's connection pool, kept open for the block."""
+        resident = self._acquire(region) or self._open(region)
+        try:
+            yield resident.pool
+        finally:
+            self._release(resident)
+
+    def reload_in_background(self) -> Optional[threading.Thread]:
+        """
+        snapshot.reload() every open region, one after the other in a new
+        thread, each on its own connection so requests keep the whole
+        pool. Does nothing if a reload is already running.
+        :return: The thread, or None.
+        """
+        if not self._reload_lock.acquire(blocking=False):
+            logger.info('Snapshot reload already in progress')
+            return None
+
+        def run():
+            try:
+                for region in self.regions:
+                    resident = self._acquire(region, touch=False)
+                    if resident is None:
+                        continue
+                    try:
+                        self._reload(region)
+                    except Exception:
+                        logger.exception('Reloading region %s failed, '
+                                         'keeping its snapshot', region.name)
+                    finally:
+                        self._release(resident)
+            finally:
+                self._reload_lock.release()
+
+        thread = threading.Thread(target=run, name='snapshot-reload',
+                                  daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,227 @@
+"""
+Optional Numba kernels for the planner's hot loops.
+
+When numba is importable (and the "numba" config option isn't false),
+ENABLED is True and these run compiled over flat NumPy arrays:
+  - dijkstra: the search relaxation loop behind Graph.shortest_path and
+    Graph.tree, with an array binary heap
+  - many_to_many: a full search from every source, filling a matrix of
+    path lengths to the targets (Graph.distance_matrix)
+  - orienteering_trials: solve_orienteering's randomized path construction
+    over a distance matrix
+Otherwise callers use their interpreted versions (search.dijkstra and the
+trial loop in orienteering_router) and nothing here is called.
+
+Compiled kernels are cached on disk, in the "numbaCacheDir" config
+directory if set (numba's default is __pycache__ next to this file), so
+workers after the first load them instead of compiling again.
+"""
+import logging
+import os
+
+import numpy as np
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+if config.get('numbaCacheDir'):
+    # Numba reads this once, on import
+    os.environ.setdefault('NUMBA_CACHE_DIR', config['numbaCacheDir'])
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+ENABLED = numba is not None and config.get('numba', True)
+
+
+def _jit(fn):
+    return numba.njit(cache=True, nogil=True)(fn) if ENABLED else fn
+
+
+@_jit
+def _heap_push(keys, values, size, key, value):
+    """Push onto the binary heap in keys/values[:size]. New size."""
+    i = size
+    while i > 0:
+        parent = (i - 1) >> 1
+        if keys[parent] <= key:
+            break
+        keys[i] = keys[parent]
+        values[i] = values[parent]
+        i = parent
+    keys[i] = key
+    values[i] = value
+    return size + 1
+
+
+@_jit
+def _heap_pop(keys, values, size):
+    """Drop the top (keys/values[0]) of the heap. New size."""
+    size -= 1
+    key = keys[size]
+    value = values[size]
+    i = 0
+    while True:
+        child = 2 * i + 1
+        if child >= size:
+            break
+        if child + 1 < size and keys[child + 1] < keys[child]:
+            child += 1
+        if keys[child] >= key:
+            break
+        keys[i] = keys[child]
+        values[i] = values[child]
+        i = child
+    keys[i] = key
+    values[i] = value
+    return size
+
+
+@_jit
+def dijkstra(indptr, arcs, ends, costs, lengths, root, target, max_length,
+             generation, stamp, done, dist, length, pred, heap_keys,
+             heap_values, reached):
+    """
+    search.dijkstra over arrays, on a binary heap of len(arcs) + 1 slots.
+    Reached vertices are written to reached.
+    :return: Number of vertices reached.
+    """
+    stamp[root] = generation
+    dist[root] = 0
+    length[root] = 0.0
+    pred[root] = -1
+    reached[0] = root
+    count = 1
+    size = _heap_push(heap_keys, heap_values, 0, 0, root)
+    while size > 0:
+        d = heap_keys[0]
+        v = heap_values[0]
+        size = _heap_pop(heap_keys, heap_values, size)
+        if done[v] == generation:
+            continue
+        done[v] = generation
+        if v == target:
+            break
+        lv = length[v]
+        for i in range(indptr[v], indptr[v + 1]):
+            arc = arcs[i]
+            nl = lv + lengths[arc]
+            if nl > max_length:
+                continue
+            w = ends[arc]
+            nd = d + costs[arc]
+            if stamp[w] != generation:
+                stamp[w] = generation
+                reached[count] = w
+                count += 1
+            elif nd >= dist[w]:
+                continue
+            dist[w] = nd
+            length[w] = nl
+            pred[w] = arc
+            size = _heap_push(heap_keys, heap_values, size, nd, w)
+    return count
+
+
+@_jit
+def many_to_many(indptr, arcs, ends, costs, lengths, sources, targets,
+                 generation, stamp, done, dist, length, pred, heap_keys,
+                 heap_values, reached, out):
+    """
+    Fill out[i, j] with the length of the cheapest path from sources[i] to
+    targets[j], inf if there is none.
+    :return: The last generation used.
+    """
+    for i in range(len(sources)):
+        generation += 1
+        dijkstra(indptr, arcs, ends, costs, lengths, sources[i], -1, np.inf,
+                 generation, stamp, done, dist, length, pred, heap_keys,
+                 heap_values, reached)
+        for j in range(len(targets)):
+            t = targets[j]
+            out[i, j] = length[t] if done[t] == generation else np.inf
+    return generation
+
+
+@_jit
+def _seed(seed):
+    # Seeds the compiled code's own generator, not NumPy's
+    np.random.seed(seed)
+
+
+@_jit
+def _trials(dist, scores, max_distance, power, top, n_trials, paths,
+            path_lengths, path_scores, path_dists):
+    n = len(scores)
+    dest = n + 1
+    visited = np.zeros(n + 2, dtype=np.int64)
+    feasible = np.empty(n, dtype=np.int64)
+    desirability = np.empty(n, dtype=np.float64)
+    for trial in range(n_trials):
+        cur = 0
+        steps = 0
+        score = 0.0
+        travelled = 0.0
+        while True:
+            count = 0
+            for v in range(1, n + 1):
+                if visited[v] == trial + 1:
+                    continue
+                if travelled + dist[cur, v] + dist[v, dest] < max_distance:
+                    feasible[count] = v
+                    desirability[count] = (
+                        scores[v - 1] / max(dist[cur, v], 1e-9)) ** power
+                    count += 1
+            if count == 0:
+                break
+            # Keep the top most desirable, then draw one in proportion
+            order = np.argsort(-desirability[:count])[:top]
+            total = 0.0
+            for k in order:
+                total += desirability[k]
+            draw = np.random.random() * total
+            nxt = feasible[order[len(order) - 1]]
+            for k in order:
+                draw -= desirability[k]
+                if draw < 0:
+                    nxt = feasible[k]
+                    break
+            paths[trial, steps] = nxt
+            steps += 1
+            visited[nxt] = trial + 1
+            score += scores[nxt - 1]
+            travelled += dist[cur, nxt]
+            cur = nxt
+        path_lengths[trial] = steps
+        path_scores[trial] = score
+        path_dists[trial] = travelled + dist[cur, dest]
+
+
+def orienteering_trials(dist: np.ndarray, scores: np.ndarray,
+                        max_distance: float, power: float, top: int,
+                        n_trials: int, seed: int):
+    """
+    Random paths as in solve_orienteering. Node 0 is the origin, 1..n the
+    POIs and n + 1 the destination; dist is their (n + 2, n + 2) distance
+    matrix, inf for missing pairs.
+    :return: (paths, path_lengths, scores, distances): row t of paths holds
+        the path_lengths[t] POIs trial t visited, in order.
+    """
+    n = len(scores)
+    paths = np.zeros((n_trials, max(n, 1)), dtype=np.int64)
+    path_lengths = np.zeros(n_trials, dtype=np.int64)
+    path_scores = np.zeros(n_trials, dtype=np.float64)
+    path_dists = np.zeros(n_trials, dtype=np.float64)
+    _seed(seed)
+    _trials(np.ascontiguousarray(dist, dtype=np.float64),
+            np.ascontiguousarray(scores, dtype=np.float64),
+            float(max_distance), float(power), int(top), int(n_trials),
+            paths, path_lengths, path_scores, path_dists)
+    return paths, path_lengths, path_scores, path_dists
+
+
+if ENABLED:
+    logger.info('Numba %s kernels enabled', numba.__version__)
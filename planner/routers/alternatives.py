@@ -0,0 +1,94 @@
+"""
+Alternative routes between two points from a single in-memory graph.
+
+The penalty method: find the shortest path, make its edges more expensive,
+search again, and repeat. A candidate is kept only if it's at least
+min_dissimilarity different from every route kept so far, where the
+dissimilarity of two routes is the fraction of the shorter one (by original
+edge cost) that they don't share. Every search reuses the same Graph, so k
+routes cost k-ish Dijkstra runs in memory instead of k planner requests.
+"""
+from typing import *
+
+import numpy as np
+
+from routers import components, route_assembly
+from routers.graph import Graph, network_graph
+from utils import tracing
+
+MAX_ROUTES = 5
+
+
+def dissimilarity(graph: Graph, a: List[int], b: List[int]) -> float:
+    """
+    1 - shared cost / cost of the cheaper route, for two paths given as arc
+    indices. Routes share an edge whichever direction they travel it in.
+    """
+    cost_a = graph.costs[a]
+    cost_b = graph.costs[b]
+    total = min(cost_a.sum(), cost_b.sum())
+    if total <= 0:
+        return 0.0
+    shared = cost_a[np.isin(graph.arc_edges[a], graph.arc_edges[b])].sum()
+    return max(0.0, 1.0 - shared / total)
+
+
+@tracing.timed('alternative_routes')
+def penalty_alternatives(graph: Graph, source: int, target: int, k: int,
+                         penalty: float = 1.5,
+                         min_dissimilarity: float = 0.3,
+                         max_searches: Optional[int] = None
+                         ) -> List[List[int]]:
+    """
+    Up to k mutually dissimilar paths from source to target, cheapest
+    first.
+    :param source, target: Vertex indices in graph.
+    :param penalty: Factor applied to the cost of a found path's edges
+        before the next search.
+    :param min_dissimilarity: Minimum dissimilarity() between any two
+        returned paths.
+    :param max_searches: Give up after this many searches (default 4k).
+    :return: Paths as lists of arc indices. Empty if target is unreachable.
+    """
+    weights = graph.costs.copy()
+    paths = []
+    for _ in range(max_searches or 4 * k):
+        path = graph.shortest_path(source, target, weights)
+        if path is None:
+            break
+        if all(dissimilarity(graph, path, p) >= min_dissimilarity
+               for p in paths):
+            paths.append(path)
+            if len(paths) == k:
+                break
+        if not path:
+            # source == target, nothing to penalize
+            break
+        weights[graph.edge_arcs(graph.arc_edges[path])] *= penalty
+    return paths
+
+
+def alternative_routes(conn, origin: int, dest: int, k: int,
+                       edge_prefs: Optional[Dict[str, float]] = None,
+                       directed: bool = True,
+                       bbox: Optional[Dict[str, float]] = None,
+                       **kwargs) -> List[tuple]:
+    """
+    Up to k dissimilar routes between two vertices over the whole network.
+    :param origin, dest: Vertex ids.
+    :param edge_prefs, directed, bbox: See network_graph.
+    :param kwargs: Passed to penalty_alternatives.
+    :return: route_assembly.route_from_edges results, best first.
+    """
+    components.vertex_components(conn).check_connected(origin, dest)
+    graph = network_graph(conn, edge_prefs, directed, bbox)
+    try:
+        source, target = graph.vertex(origin), graph.vertex(dest)
+    except KeyError:
+        raise ValueError('Origin or destination is not on the road network')
+    paths = penalty_alternatives(graph, source, target, k, **kwargs)
+    if not paths:
+        raise ValueError('No route between origin and destination')
+    return [route_assembly.route_from_edges(conn, graph.arc_edges[path],
+                                            graph.arc_forward[path])
+            for path in paths]
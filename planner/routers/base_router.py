@@ -1,10 +1,27 @@
 import abc
 import json
-import math
 from typing import *
 
+import numpy as np
+
+
+class PathResult(NamedTuple):
+    points: List[int]
+    score: float
+    length: float
+
+
+class GmapsResult(NamedTuple):
+    name: str
+    latlon: Tuple[float, float]
+    score: float
+    type: str
+    place_id: Optional[str] = None
+
 
 class PoiResult:
+    __slots__ = ('location', 'name', 'type', 'length_of_leg')
+
     def __init__(self, location: Tuple[float, float], name: str, type: str,
                  length_of_leg: float):
         """
@@ -15,25 +32,118 @@ class PoiResult:
         self.type = type
         self.length_of_leg = length_of_leg
 
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'location': {'latitude': self.location[0],
+                         'longitude': self.location[1]},
+            'name': self.name,
+            'type': self.type,
+            'length_of_leg': self.length_of_leg
+        }
+
+
+class ElevationData:
+    """
+    A route's elevationData packed as three parallel arrays: each edge's
+    length (meters), the elevation at its start (feet, NaN if unknown) and
+    the index of its last point in the route's linestring. It's encoded as
+    [[length, elevation, index], ...].
+    """
+
+    __slots__ = ('lengths', 'elevations', 'points')
+
+    def __init__(self, lengths, elevations, points):
+        self.lengths = np.asarray(lengths, dtype=np.float64)
+        self.elevations = np.array(elevations, dtype=np.float64)
+        self.points = np.asarray(points, dtype=np.int64)
+
+    @classmethod
+    def from_rows(cls, rows) -> 'ElevationData':
+        """
+        From [[length, elevation, index], ...], as the path SQL functions
+        return it. Values may be Decimals; elevations may be None.
+        """
+        if not rows:
+            return cls([], [], [])
+        lengths, elevations, points = zip(*rows)
+        return cls(np.array(lengths, dtype=np.float64),
+                   [np.nan if e is None else float(e) for e in elevations],
+                   points)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __repr__(self):
+        return 'ElevationData({} edges)'.format(len(self))
+
+    def rows(self) -> List[list]:
+        """As [[length, elevation or None, index], ...]."""
+        elevations = [None if e != e else e
+                      for e in self.elevations.tolist()]
+        return [list(r) for r in zip(self.lengths.tolist(), elevations,
+                                     self.points.tolist())]
+
+    def json(self, separators: Tuple[str, str] = (', ', ': ')) -> str:
+        """Same text as json.dumps(self.rows()), without building rows."""
+        n = len(self)
+        if not n:
+            return '[]'
+        flat = [None] * (3 * n)
+        flat[0::3] = self.lengths.tolist()
+        flat[1::3] = self.elevations.tolist()
+        flat[2::3] = self.points.tolist()
+        sep = separators[0]
+        row = '[%r{0}%r{0}%d]{0}'.format(sep)
+        text = '[' + (row * n)[:-len(sep)] % tuple(flat) + ']'
+        if np.isnan(self.elevations).any():
+            text = text.replace(sep + 'nan' + sep, sep + 'null' + sep)
+        return text
+
 
 class RouteResult:
+    __slots__ = ('geojson', 'score', 'length', 'elevationData', 'pois',
+                 'elevationProfile')
+
     def __init__(self, geojson: str, score: float, length: float, elevationData,
-                 pois: List[PoiResult]):
+                 pois: List[PoiResult], elevationProfile: List[float] = None):
         """
         Create a route result.
         :param geojson: GeoJSON of route.
         :param score: Score of route. It doesn't have meaning alone but can be
                       compared with other routes.
         :param length: Meters.
+        :param elevationData: ElevationData, or rows as returned by the
+                      database for routers that don't parse them.
+        :param elevationProfile: Elevations (feet) sampled evenly along the
+                      route, if precomputed edge profiles are available.
         """
         self.geojson = geojson
         self.score = score
         self.length = length
         self.elevationData = elevationData
         self.pois = pois
+        self.elevationProfile = elevationProfile
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        JSON-ready dict of the route. The GeoJSON is parsed; see
+        route_encoding.encode_reply for serializing without that.
+        """
+        result = {
+            'geojson': json.loads(self.geojson),
+            'score': self.score,
+            'length': self.length,
+            'elevationData': self.elevationData.rows()
+            if isinstance(self.elevationData, ElevationData)
+            else self.elevationData,
+            'pois': [p.to_dict() for p in self.pois]
+        }
+        if self.elevationProfile is not None:
+            result['elevationProfile'] = self.elevationProfile
+        return result
 
     def __str__(self):
-        return str(vars(self))
+        return str({k: getattr(self, k) for k in self.__slots__})
 
 
 class RouteEncoder(json.JSONEncoder):
@@ -41,22 +151,11 @@ class RouteEncoder(json.JSONEncoder):
 
     def default(self, o):
         """Tries to return a serializable object for o."""
-        if isinstance(o, RouteResult):
-            return {
-                'geojson': json.loads(o.geojson),
-                'score': o.score,
-                'length': o.length,
-                'elevationData': o.elevationData,
-                'pois': o.pois
-            }
-
-        elif isinstance(o, PoiResult):
-            return {
-                'location': {'latitude': o.location[0], 'longitude': o.location[1]},
-                'name': o.name,
-                'type': o.type,
-                'length_of_leg': o.length_of_leg
-            }
+        if isinstance(o, (RouteResult, PoiResult)):
+            return o.to_dict()
+
+        elif isinstance(o, ElevationData):
+            return o.rows()
 
         # Let the base class default method raise the TypeError
         return json.JSONEncoder.default(self, o)
@@ -76,18 +175,11 @@ class BaseRouter(abc.ABC):
         """
         raise NotImplementedError
 
-
-
-def distance(coord1, coord2):
-    return math.hypot(coord1[0] - coord2[0], coord1[1] - coord2[1])
-
-
-def orient_linestring(origin, dest, linestring):
-    """Reverse linestring if it is backwards. Return correctly oriented
-    linestring."""
-    linestring = json.loads(linestring)
-    if distance(tuple(reversed(dest)), linestring['coordinates'][0]) \
-            < distance(tuple(reversed(origin)), linestring['coordinates'][0]):
-        linestring['coordinates'].reverse()
-    return json.dumps(linestring)
-
+    def make_routes(self, origin: Tuple[float, float],
+                    dest: Tuple[float, float], num_routes: int,
+                    **kwargs) -> List[RouteResult]:
+        """
+        Make up to num_routes diverse routes, best first. Routers that can't
+        produce alternatives return just make_route's route.
+        """
+        return [self.make_route(origin, dest, **kwargs)]
@@ -0,0 +1,88 @@
+"""
+Connected component labels of road network vertices.
+
+put_components.py stores each vertex's connected component (edges usable
+both ways) and strongly connected component (one-way edges only forwards)
+in vertex_components. Two vertices in different connected components have
+no route between them, so routers check those labels before asking
+pgRouting and drop POIs that can't be reached. Different strongly
+connected components prove nothing (a vertex on a one-way spur is a
+component of its own but still reaches the rest of the network), so they
+are only used by nearest_vertex, which prefers vertices in the largest one.
+If the table hasn't been filled, nothing is checked.
+"""
+import logging
+from typing import *
+
+import numpy as np
+
+from routers import snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class VertexComponents:
+    SQL = '''
+        SELECT id, component, strong_component
+        FROM vertex_components
+        ORDER BY id
+        '''
+
+    def __init__(self, ids, component, strong_component):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.component = np.asarray(component, dtype=np.int64)
+        self.strong_component = np.asarray(strong_component, dtype=np.int64)
+        self.main = self._largest(self.component)
+        self.strong_main = self._largest(self.strong_component)
+
+    @staticmethod
+    def _largest(labels: np.ndarray) -> Optional[int]:
+        if len(labels) == 0:
+            return None
+        values, counts = np.unique(labels, return_counts=True)
+        return int(values[np.argmax(counts)])
+
+    @classmethod
+    def from_db(cls, conn) -> 'VertexComponents':
+        with conn.cursor() as cur:
+            cur.execute(cls.SQL)
+            rows = cur.fetchall()
+        if not rows:
+            logger.warning('vertex_components is empty, connectivity is not '
+                           'checked (run put_components.py)')
+        columns = np.array(rows, dtype=np.int64).reshape(-1, 3).T
+        return cls(*columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def label(self, vertex_id: int, strong: bool = False) -> Optional[int]:
+        """Component of a vertex, or None if it has no label."""
+        i = int(np.searchsorted(self.ids, vertex_id))
+        if i == len(self.ids) or self.ids[i] != vertex_id:
+            return None
+        return int((self.strong_component if strong else self.component)[i])
+
+    def connected(self, a: int, b: int) -> bool:
+        """
+        False if there's surely no route between vertices a and b, in either
+        direction: they are in different connected components. Vertices
+        without labels count as connected.
+        """
+        label_a = self.label(a)
+        label_b = self.label(b)
+        return label_a is None or label_b is None or label_a == label_b
+
+    def check_connected(self, origin: int, dest: int):
+        """ValueError if origin and dest are in different components."""
+        if not self.connected(origin, dest):
+            raise ValueError('Origin and destination are not connected by '
+                             'the road network')
+
+
+snapshot.register('vertex_components', VertexComponents.from_db)
+
+
+def vertex_components(conn) -> VertexComponents:
+    """The snapshot's VertexComponents, loaded from the DB on first use."""
+    return snapshot.value('vertex_components', conn)
@@ -1,25 +1,23 @@
 import logging
 from routers.base_router import *
 from pprint import pprint
+from config import config
+from routers import components, loop_routes, route_assembly
+from routers.graph import network_graph
+from routers.orienteering_router import nearest_vertex
+from utils import metrics
+from utils import tracing
 
 
 __all__ = ['DistEdgePrefsRouter']
 
 logger = logging.getLogger(__name__)
 
+# Accepted relative difference between a route's length and desired_dist
+DIST_TOLERANCE = 0.1
 
-class PathResult(NamedTuple):
-    points: List[int]
-    score: float
-    length: float
-
-
-class GmapsResult(NamedTuple):
-    name: str
-    latlon: Tuple[float, float]
-    score: float
-    type: str
 
+@tracing.timed('path_query')
 def get_route_geojson(conn, origin, dest, distance, popularity, greenery):
     """
     Find route through all vertices and return its GeoJSON.
@@ -36,10 +34,24 @@ def get_route_geojson(conn, origin, dest, distance, popularity, greenery):
     logger.info("Lon1 %s, Lat1 %s, Lon2 %s, Lat2 %s,\n distance %s,\n popularity %s,\n greenery %s",
                 lon1, lat1, lon2, lat2, distance, popularity, greenery)
     with conn.cursor() as cur:
+        # pathfromnearestknownpointslength doesn't order its geometry, so
+        # flip it in the same query if it starts nearer the destination.
         cur.execute('''
-            SELECT * FROM 
-            pathfromnearestknownpointslength(%s, %s, %s, %s, %s, %s, %s)
-            ''', (lon1, lat1, lon2, lat2, distance, popularity, greenery))
+            SELECT
+              CASE WHEN ST_Distance(ST_StartPoint(g), ST_SetSRID(ST_Point(%(lon2)s, %(lat2)s), 4326))
+                        < ST_Distance(ST_StartPoint(g), ST_SetSRID(ST_Point(%(lon1)s, %(lat1)s), 4326))
+                   THEN ST_AsGeoJSON(ST_Reverse(g))
+                   ELSE p.geojson END,
+              p.length, p.elevation_data
+            FROM
+              pathfromnearestknownpointslength(
+                %(lon1)s, %(lat1)s, %(lon2)s, %(lat2)s,
+                %(distance)s, %(popularity)s, %(greenery)s
+              ) AS p(geojson, length, elevation_data),
+              LATERAL ST_SetSRID(ST_GeomFromGeoJSON(p.geojson), 4326) AS g
+            ''', {'lon1': lon1, 'lat1': lat1, 'lon2': lon2, 'lat2': lat2,
+                  'distance': distance, 'popularity': popularity,
+                  'greenery': greenery})
         return cur.fetchone()
 
 
@@ -68,17 +80,22 @@ class DistEdgePrefsRouter(BaseRouter):
         - edge_prefs: Dict[str, float] - Map of edge types to their weights.
           The keys are a subset of ['green', 'popularity'].
 
+        Routes come from loop_routes unless the "nativeDistRoutes" config
+        option is false, in which case the database's
+        pathfromnearestknownpointslength function makes them.
+
         :return: Resulting route.
         """
+        if config.get('nativeDistRoutes', True):
+            return self.make_routes(origin_latlon, dest_latlon, 1, **kwargs)[0]
+
         # Parse kwargs
         length_m = kwargs.pop('desired_dist')
         edge_prefs = kwargs.pop('edge_prefs')
 
         geojson, length, elevationData = get_route_geojson(self.conn, origin_latlon, dest_latlon, length_m, edge_prefs.get('green', 0),
              edge_prefs.get('popularity', 0))
-
-        # Hack: make sure linestring is in the correct direction
-        geojson = orient_linestring(origin_latlon, dest_latlon, geojson)
+        report_length(length_m, length)
 
         return RouteResult(
             geojson,
@@ -86,6 +103,50 @@ class DistEdgePrefsRouter(BaseRouter):
             elevationData, []
         )
 
+    def make_routes(self, origin_latlon: Tuple[float, float],
+                    dest_latlon: Tuple[float, float], num_routes: int,
+                    **kwargs) -> List[RouteResult]:
+        """
+        Up to num_routes dissimilar routes of about desired_dist, best first
+        (see loop_routes.length_routes). Takes the same keyword arguments as
+        make_route.
+        """
+        length_m = kwargs.pop('desired_dist')
+        edge_prefs = kwargs.pop('edge_prefs')
+
+        origin = nearest_vertex(self.conn, origin_latlon)
+        dest = nearest_vertex(self.conn, dest_latlon)
+        components.vertex_components(self.conn).check_connected(origin, dest)
+        graph = network_graph(self.conn, edge_prefs)
+        try:
+            source, target = graph.vertex(origin), graph.vertex(dest)
+        except KeyError:
+            raise ValueError('Origin or destination is not on the road network')
+        routes = loop_routes.length_routes(
+            graph, source, target, length_m, k=num_routes,
+            tolerance=config.get('distTolerance', DIST_TOLERANCE))
+        if not routes:
+            raise ValueError('No route between origin and destination')
+
+        results = []
+        for route in routes:
+            report_length(length_m, route.length)
+            geojson, length, elevationData, profile = \
+                route_assembly.route_from_edges(
+                    self.conn, graph.arc_edges[route.arcs],
+                    graph.arc_forward[route.arcs])
+            results.append(RouteResult(geojson, 0, length, elevationData, [],
+                                       elevationProfile=profile))
+        return results
+
+
+def report_length(desired: float, achieved: float):
+    """Log and record how close a route came to desired_dist."""
+    logger.info('Desired length %.0f m, achieved %.0f m', desired, achieved)
+    if desired > 0:
+        metrics.route_length_ratio.observe(achieved / desired,
+                                           router='DistEdgePrefsRouter')
+
 
 def midpoint(coord1, coord2):
     """Return midpoint of two lat/lon coordinates."""
@@ -0,0 +1,228 @@
+"""
+Edge cost model shared by the SQL (edges_sql) and in-memory routing paths.
+
+Edge preferences discount an edge's length by up to max_discount depending on
+how well the edge matches them:
+  - green: ways_metadata.greenery
+  - popularity: ways_metadata.popularity_highres
+  - flat: 1 - climb, i.e. favour edges with little elevation gain
+  - climb: climb, i.e. favour edges that go uphill
+climb is precomputed per edge and direction by put_edge_elevation.py (see
+sql/waysElevation.sql), so it costs no more per request than greenery.
+"""
+import logging
+from typing import *
+
+import numpy as np
+
+from config import config
+from routers import snapshot, vertex_order
+from utils import elevation_utils
+
+logger = logging.getLogger(__name__)
+
+CLIMB_PREFS = ('flat', 'climb')
+
+# Average grade at which an edge counts as fully "hilly" (climb = 1).
+CLIMB_FULL_GRADE = 0.08
+
+
+def climb_score(gain_ft, length_m):
+    """
+    Normalized climb in [0, 1] for travelling an edge: its average uphill
+    grade relative to CLIMB_FULL_GRADE. Works on scalars and arrays.
+    """
+    gain_m = elevation_utils.feetToMeters(np.asarray(gain_ft, dtype=float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        grade = gain_m / np.asarray(length_m, dtype=float)
+    return np.clip(np.nan_to_num(grade) / CLIMB_FULL_GRADE, 0.0, 1.0)
+
+
+def uses_climb(edge_prefs: Dict[str, float]) -> bool:
+    return any(edge_prefs.get(p, 0) for p in CLIMB_PREFS)
+
+
+def multiplier_sql(edge_prefs: Dict[str, float], climb_column: str,
+                   max_discount: float) -> Tuple[str, tuple]:
+    """
+    SQL expression for an edge's cost multiplier, and its parameters.
+    :param climb_column: Column holding the climb score for the direction
+        being costed ('climb' or 'reverse_climb').
+    """
+    sql = '(1 - %s * (%s * greenery + %s * popularity_highres'
+    params = [max_discount, edge_prefs.get('green', 0),
+              edge_prefs.get('popularity', 0)]
+    if uses_climb(edge_prefs):
+        sql += ' + %s * (1 - COALESCE({0}, 0)) + %s * COALESCE({0}, 0)' \
+            .format(climb_column)
+        params += [edge_prefs.get('flat', 0), edge_prefs.get('climb', 0)]
+    sql += ') / %s)'
+    params.append(sum(edge_prefs.values()))
+    return sql, tuple(params)
+
+
+def multipliers(edge_prefs: Dict[str, float], greenery: np.ndarray,
+                popularity: np.ndarray, climb: np.ndarray,
+                reverse_climb: np.ndarray,
+                max_discount: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    In-memory equivalent of multiplier_sql, for both directions. The
+    direction-independent part is only computed once.
+    """
+    scale = max_discount / sum(edge_prefs.values())
+    base = 1 - scale * (edge_prefs.get('green', 0) * greenery
+                        + edge_prefs.get('popularity', 0) * popularity)
+    if not uses_climb(edge_prefs):
+        return base, base
+    # flat * (1 - climb) + climb_pref * climb, folded into base
+    flat = edge_prefs.get('flat', 0)
+    slope = scale * (edge_prefs.get('climb', 0) - flat)
+    base -= scale * flat
+    return base - slope * climb, base - slope * reverse_climb
+
+
+class EdgeAttributes:
+    """
+    Per-edge arrays needed to cost edges in memory, indexed by position.
+    Edges without ways_metadata have NaN greenery/popularity (the SQL query
+    inner joins ways_metadata, so they are unusable when preferences are
+    set); edges without ways_elevation have climb 0.
+    """
+
+    SQL = '''
+        SELECT ways.gid, source, target, length_m, reverse_cost,
+               greenery, popularity_highres,
+               COALESCE(climb, 0), COALESCE(reverse_climb, 0)
+        FROM ways
+          LEFT JOIN ways_metadata USING (gid)
+          LEFT JOIN ways_elevation USING (gid)
+        ORDER BY ways.gid
+        '''
+
+    METADATA_SQL = 'SELECT gid, greenery, popularity_highres FROM ways_metadata'
+
+    def __init__(self, gid, source, target, length_m, reverse_cost, greenery,
+                 popularity, climb, reverse_climb):
+        self.gid = np.asarray(gid, dtype=np.int64)
+        self.source = np.asarray(source, dtype=np.int64)
+        self.target = np.asarray(target, dtype=np.int64)
+        self.length_m = np.asarray(length_m, dtype=np.float64)
+        self.reverse_cost = np.asarray(reverse_cost, dtype=np.float64)
+        self.greenery = np.asarray(greenery, dtype=np.float64)
+        self.popularity = np.asarray(popularity, dtype=np.float64)
+        self.climb = np.asarray(climb, dtype=np.float64)
+        self.reverse_climb = np.asarray(reverse_climb, dtype=np.float64)
+        # Vertices in the order graphs should number them, if not by id
+        self.vertices = None  # type: Optional[vertex_order.VertexTable]
+
+    @classmethod
+    def from_db(cls, conn) -> 'EdgeAttributes':
+        with conn.cursor() as cur:
+            cur.execute(cls.SQL)
+            rows = cur.fetchall()
+        columns = np.array(rows, dtype=np.float64).reshape(-1, 9).T
+        return cls(*columns)
+
+    def in_vertex_order(self, vertices: vertex_order.VertexTable
+                        ) -> 'EdgeAttributes':
+        """
+        Copy with the edges sorted by the position of their ends in
+        vertices, which the copy keeps as .vertices.
+        """
+        rows = [vertices.position(self.source), vertices.position(self.target)]
+        for r in rows:
+            r[r < 0] = len(vertices)
+        order = np.lexsort((np.maximum(*rows), np.minimum(*rows)))
+        edges = EdgeAttributes(
+            self.gid[order], self.source[order], self.target[order],
+            self.length_m[order], self.reverse_cost[order],
+            self.greenery[order], self.popularity[order], self.climb[order],
+            self.reverse_climb[order])
+        edges.vertices = vertices
+        return edges
+
+    def with_metadata(self, gid, greenery, popularity
+                      ) -> Optional['EdgeAttributes']:
+        """
+        Copy with the greenery and popularity of the edges in gid replaced
+        (NaN for the rest, as without ways_metadata), sharing every other
+        array. None if nothing changes.
+        """
+        if len(self.gid) == 0:
+            return None
+        gid = np.asarray(gid, dtype=np.int64)
+        sorter = np.argsort(self.gid, kind='mergesort')
+        i = np.minimum(np.searchsorted(self.gid[sorter], gid),
+                       len(self.gid) - 1)
+        found = self.gid[sorter][i] == gid
+        rows = sorter[i[found]]
+        new_greenery = np.full(len(self.gid), np.nan)
+        new_popularity = np.full(len(self.gid), np.nan)
+        new_greenery[rows] = np.asarray(greenery, dtype=np.float64)[found]
+        new_popularity[rows] = np.asarray(popularity, dtype=np.float64)[found]
+
+        def same(a, b):
+            return (a == b) | (np.isnan(a) & np.isnan(b))
+        changed = ~(same(self.greenery, new_greenery)
+                    & same(self.popularity, new_popularity))
+        if not changed.any():
+            return None
+        logger.info('New greenery or popularity for %d of %d edges',
+                    int(changed.sum()), len(self.gid))
+        edges = EdgeAttributes(
+            self.gid, self.source, self.target, self.length_m,
+            self.reverse_cost, new_greenery, new_popularity, self.climb,
+            self.reverse_climb)
+        edges.vertices = self.vertices
+        return edges
+
+    def metadata_from_db(self, conn) -> Optional['EdgeAttributes']:
+        """with_metadata for the current contents of ways_metadata."""
+        with conn.cursor() as cur:
+            cur.execute(self.METADATA_SQL)
+            rows = cur.fetchall()
+        gid, greenery, popularity = np.array(
+            rows, dtype=np.float64).reshape(-1, 3).T
+        return self.with_metadata(gid, greenery, popularity)
+
+    def costs(self, edge_prefs: Dict[str, float],
+              max_discount: float = 0.7) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (cost, reverse_cost) of every edge, matching make_edges_sql: lengths
+        scaled by the preference multipliers, negative reverse_cost for
+        one-way edges and inf for edges the SQL query would leave out.
+        """
+        oneway = np.sign(self.reverse_cost)
+        if sum(edge_prefs.values()) == 0:
+            return self.length_m, self.length_m * oneway
+        forward, reverse = multipliers(
+            edge_prefs, self.greenery, self.popularity, self.climb,
+            self.reverse_climb, max_discount)
+        missing = np.isnan(forward)
+        cost = np.where(missing, np.inf, self.length_m * forward)
+        reverse_cost = np.where(missing, np.inf,
+                                self.length_m * oneway * reverse)
+        return cost, reverse_cost
+
+
+def _load_attributes(conn) -> EdgeAttributes:
+    attributes = EdgeAttributes.from_db(conn)
+    method = config.get('vertexOrder', vertex_order.DEFAULT_ORDER)
+    if method != 'id':
+        vertices = vertex_order.VertexTable.from_db(conn).ordered(
+            method, attributes.source, attributes.target)
+        attributes = attributes.in_vertex_order(vertices)
+    return attributes
+
+
+snapshot.register('edge_attributes', _load_attributes,
+                  lambda attributes, conn: attributes.metadata_from_db(conn))
+
+
+def edge_attributes(conn) -> EdgeAttributes:
+    """
+    The snapshot's EdgeAttributes, loaded from the DB on first use, in the
+    "vertexOrder" config order (see vertex_order.py). Snapshot reloads that
+    only change ways_metadata re-read just greenery and popularity.
+    """
+    return snapshot.value('edge_attributes', conn)
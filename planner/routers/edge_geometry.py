@@ -0,0 +1,151 @@
+"""
+In-memory cache of every edge's geometry, for building route geometry without
+PostGIS.
+
+All coordinates live in one flat float64 (lon, lat) buffer; edge i owns
+coords[offsets[i]:offsets[i + 1]], stored source -> target. A route is the
+concatenation of views into that buffer (reversed for edges travelled
+target -> source), serialized straight to GeoJSON text or an encoded
+polyline.
+"""
+from typing import *
+
+import numpy as np
+
+from routers import snapshot
+from utils import tracing
+
+CHUNK_SIZE = 50000
+
+
+class EdgeGeometries:
+    def __init__(self, gids: np.ndarray, offsets: np.ndarray,
+                 coords: np.ndarray):
+        """
+        :param gids: Sorted edge ids.
+        :param offsets: len(gids) + 1 offsets into coords.
+        :param coords: (n, 2) array of (lon, lat).
+        """
+        self.gids = gids
+        self.offsets = offsets
+        self.coords = coords
+
+    @classmethod
+    def from_linestrings(cls, gids: Sequence[int],
+                         linestrings: Sequence[np.ndarray]):
+        """Build from per-edge (n, 2) coordinate arrays, in gid order."""
+        counts = np.fromiter((len(l) for l in linestrings), dtype=np.int64,
+                             count=len(linestrings))
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        coords = np.concatenate(linestrings) if len(linestrings) \
+            else np.empty((0, 2))
+        return cls(np.asarray(gids, dtype=np.int64), offsets,
+                   np.ascontiguousarray(coords, dtype=np.float64))
+
+    @classmethod
+    def from_db(cls, conn, chunk_size: int = CHUNK_SIZE) -> 'EdgeGeometries':
+        """
+        Load all of ways.the_geom. Geometries come over as little-endian
+        WKB, which is decoded without any per-point Python objects.
+        """
+        gids = []
+        linestrings = []
+        with conn.cursor(name='edge_geometry_cache') as cur:
+            cur.itersize = chunk_size
+            cur.execute('''
+                SELECT gid, ST_AsBinary(the_geom, 'NDR')
+                FROM ways
+                ORDER BY gid
+                ''')
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for gid, wkb in rows:
+                    # 1 byte order + 4 type + 4 point count, then doubles
+                    gids.append(gid)
+                    linestrings.append(
+                        np.frombuffer(wkb, dtype='<f8', offset=9)
+                        .reshape(-1, 2))
+        return cls.from_linestrings(gids, linestrings)
+
+    def __len__(self):
+        return len(self.gids)
+
+    def index(self, gids: Sequence[int]) -> np.ndarray:
+        """Positions of the given edge ids. KeyError if any isn't cached."""
+        gids = np.asarray(gids, dtype=np.int64)
+        idx = np.searchsorted(self.gids, gids)
+        idx[idx >= len(self.gids)] = 0
+        if len(gids) and not np.array_equal(self.gids[idx], gids):
+            missing = gids[self.gids[idx] != gids]
+            raise KeyError('Edges not in geometry cache: {}'.format(
+                missing[:10].tolist()))
+        return idx
+
+    def segments(self, idx: np.ndarray) -> np.ndarray:
+        """Number of line segments in each of the edges at idx."""
+        return self.offsets[idx + 1] - self.offsets[idx] - 1
+
+    @tracing.timed('route_geometry')
+    def path(self, gids: Sequence[int], forward: Sequence[bool]) -> np.ndarray:
+        """
+        Coordinates of a path: the edges in order, each reversed unless
+        travelled forward, with the shared point between edges kept once.
+        """
+        idx = self.index(gids)
+        if not len(idx):
+            return np.empty((0, 2))
+        forward = np.asarray(forward, dtype=bool)
+        start = self.offsets[idx]
+        last = self.offsets[idx + 1] - 1
+        # Every edge after the first skips its first point
+        skip = np.ones(len(idx), dtype=np.int64)
+        skip[0] = 0
+        taken = last - start + 1 - skip
+        # Position of each output point within its edge, then in the buffer
+        ends = np.cumsum(taken)
+        within = np.arange(ends[-1]) - np.repeat(ends - taken, taken) \
+            + np.repeat(skip, taken)
+        points = np.where(np.repeat(forward, taken),
+                          np.repeat(start, taken) + within,
+                          np.repeat(last, taken) - within)
+        return self.coords[points]
+
+
+def geojson(coords: np.ndarray, decimals: int = 7) -> str:
+    """
+    GeoJSON LineString text for (lon, lat) coords, laid out like json.dumps.
+    7 decimals is about 1 cm, the precision OSM stores coordinates at.
+    """
+    point = '[%.{0}f, %.{0}f], '.format(decimals)
+    points = (point * len(coords))[:-2] % tuple(coords.ravel().tolist())
+    return '{"type": "LineString", "coordinates": [' + points + ']}'
+
+
+def encoded_polyline(coords: np.ndarray, precision: int = 5) -> str:
+    """Google encoded polyline of (lon, lat) coords."""
+    if not len(coords):
+        return ''
+    scaled = np.round(coords[:, ::-1] * 10 ** precision).astype(np.int64)
+    deltas = scaled.copy()
+    deltas[1:] -= scaled[:-1]
+    deltas = deltas.ravel()
+    # Zigzag, then 5-bit little-endian chunks with a continuation bit
+    values = np.where(deltas < 0, ~(deltas << 1), deltas << 1)
+    remaining = values[:, None] >> np.arange(0, 35, 5, dtype=np.int64)
+    present = remaining > 0
+    present[:, 0] = True
+    more = np.zeros_like(present)
+    more[:, :-1] = present[:, 1:]
+    chars = (remaining & 0x1f).astype(np.uint8) | more.view(np.uint8) << 5
+    return (chars[present] + 63).tobytes().decode('ascii')
+
+
+snapshot.register('edge_geometries', EdgeGeometries.from_db)
+
+
+def edge_geometries(conn) -> EdgeGeometries:
+    """The snapshot's EdgeGeometries, loaded from the DB on first use."""
+    return snapshot.value('edge_geometries', conn)
@@ -0,0 +1,322 @@
+"""
+In-memory routing graph for searches that would otherwise need many
+pgRouting calls, such as computing alternative routes.
+
+Graphs are built from the cached EdgeAttributes (see edge_costs.py), so they
+cost no database round trip, and stored as compressed sparse rows: the arcs
+leaving vertex v are indptr[v]:indptr[v + 1]. Each edge becomes a forward
+arc (source -> target) and, unless its reverse_cost is negative, a reverse
+arc. Arcs with infinite cost (edges make_edges_sql would leave out) are
+dropped. Vertices are numbered in the EdgeAttributes' vertex order (see
+vertex_order.py), so neighbours on the map are mostly neighbours in the
+arrays too.
+
+Searches use the integer-cost priority queues of search.py; the "searchQueue"
+config option picks which ('heapq' by default). With Numba installed they
+run on the compiled kernels of accel.py instead.
+
+network_graph caches the graphs of the most recently used preference
+vectors (the "graphCacheSize" config option) in the current network
+snapshot, so a snapshot reload drops them (see snapshot.py). Graphs limited
+to a request's bbox are built per request.
+"""
+from typing import *
+
+import numpy as np
+
+from config import config
+from routers import accel, edge_costs, search, snapshot
+from utils import tracing
+
+DEFAULT_QUEUE = 'heapq'
+GRAPH_CACHE_SIZE = 4
+
+# Edges make_edges_sql keeps for a bbox
+BBOX_EDGES_SQL = '''
+    SELECT gid FROM ways
+    WHERE the_geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)
+    '''
+
+
+class SearchTree(NamedTuple):
+    """
+    Result of Graph.tree. cost and length are the preference-weighted cost
+    and the length in meters of the tree path between root and each reached
+    vertex; pred is that path's last arc (forward trees) or first arc
+    (reverse trees).
+    """
+    root: int
+    reverse: bool
+    cost: Dict[int, float]
+    length: Dict[int, float]
+    pred: Dict[int, int]
+
+
+class Graph:
+    def __init__(self, edge_ids, source, target, cost, reverse_cost=None,
+                 length=None, queue: Optional[str] = None,
+                 vertex_ids=None):
+        """
+        :param edge_ids, source, target, cost, reverse_cost: Per-edge arrays,
+            as in an edges_sql result. A missing reverse_cost means
+            undirected.
+        :param length: Per-edge length in meters, if cost isn't one.
+        :param queue: Search priority queue, one of search.QUEUES. Defaults
+            to the searchQueue config option.
+        :param vertex_ids: pgRouting vertex ids in the order to number them
+            (see vertex_order.py). Vertices it leaves out come after, by id;
+            by default all are numbered by id.
+        """
+        edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        source = np.asarray(source, dtype=np.int64)
+        target = np.asarray(target, dtype=np.int64)
+        cost = np.asarray(cost, dtype=np.float64)
+        reverse_cost = cost if reverse_cost is None \
+            else np.asarray(reverse_cost, dtype=np.float64)
+        length = cost if length is None \
+            else np.asarray(length, dtype=np.float64)
+
+        # Renumber vertices 0..n-1
+        endpoints = np.concatenate([source, target])
+        self.vertex_ids = np.unique(endpoints)
+        if vertex_ids is not None:
+            vertex_ids = np.asarray(vertex_ids, dtype=np.int64)
+            self.vertex_ids = np.concatenate([
+                vertex_ids[np.isin(vertex_ids, self.vertex_ids)],
+                np.setdiff1d(self.vertex_ids, vertex_ids)])
+        self._id_order = np.argsort(self.vertex_ids, kind='mergesort')
+        self._sorted_ids = self.vertex_ids[self._id_order]
+        ends = self._id_order[np.searchsorted(self._sorted_ids, endpoints)]
+        u, v = ends[:len(source)], ends[len(source):]
+
+        fwd = np.isfinite(cost)
+        rev = (reverse_cost >= 0) & np.isfinite(reverse_cost)
+        tails = np.concatenate([u[fwd], v[rev]])
+        order = np.argsort(tails, kind='mergesort')
+        self.tails = tails[order]
+        self.heads = np.concatenate([v[fwd], u[rev]])[order]
+        self.costs = np.concatenate([cost[fwd], reverse_cost[rev]])[order]
+        self.lengths = np.concatenate([length[fwd], length[rev]])[order]
+        self.arc_edges = np.concatenate(
+            [edge_ids[fwd], edge_ids[rev]])[order]
+        self.arc_forward = np.concatenate(
+            [np.ones(int(fwd.sum()), dtype=bool),
+             np.zeros(int(rev.sum()), dtype=bool)])[order]
+        self.indptr = np.zeros(len(self.vertex_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(tails, minlength=len(self.vertex_ids)),
+                  out=self.indptr[1:])
+        self.out_arcs = np.arange(len(self.heads), dtype=np.int64)
+        self.int_costs = search.quantize(self.costs)
+        # Arcs entering each vertex, for searches towards a target
+        self.in_arcs = np.argsort(self.heads, kind='mergesort')
+        self.in_indptr = np.zeros(len(self.vertex_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.heads, minlength=len(self.vertex_ids)),
+                  out=self.in_indptr[1:])
+        # Plain lists are much faster to index from the Python search loop
+        self._indptr = self.indptr.tolist()
+        self._heads = self.heads.tolist()
+        self._tails = self.tails.tolist()
+        self._out_arcs = self.out_arcs.tolist()
+        self._int_costs = self.int_costs.tolist()
+        self._max_cost = int(self.int_costs.max()) if len(self.heads) else 0
+        self._lengths = self.lengths.tolist()
+        self._in_indptr = self.in_indptr.tolist()
+        self._in_arcs = self.in_arcs.tolist()
+        self.queue = queue or config.get('searchQueue', DEFAULT_QUEUE)
+
+    @classmethod
+    @tracing.timed('build_graph')
+    def from_attributes(cls, attributes: edge_costs.EdgeAttributes,
+                        edge_prefs: Optional[Dict[str, float]] = None,
+                        directed: bool = True,
+                        edges: Optional[np.ndarray] = None) -> 'Graph':
+        """
+        Graph over the whole network, with vertices numbered in the
+        attributes' vertex order.
+        :param edge_prefs: Edge preferences to cost edges with, as in
+            make_edges_sql. None for plain lengths.
+        :param directed: False to ignore one-way restrictions (and travel
+            every edge at its forward cost), like pathFromNearestKnownPoints
+            does.
+        :param edges: Ids of the only edges to use, if not all.
+        """
+        cost, reverse_cost = attributes.costs(edge_prefs or {})
+        if edges is not None:
+            # Infinite costs drop the arcs, as for edges without metadata
+            outside = ~np.isin(attributes.gid, edges)
+            cost = np.where(outside, np.inf, cost)
+            reverse_cost = np.where(outside, np.inf, reverse_cost)
+        vertex_ids = attributes.vertices.ids \
+            if attributes.vertices is not None else None
+        return cls(attributes.gid, attributes.source, attributes.target,
+                   cost, reverse_cost if directed else None,
+                   attributes.length_m, vertex_ids=vertex_ids)
+
+    def __len__(self):
+        return len(self.vertex_ids)
+
+    def vertex(self, vertex_id: int) -> int:
+        """Index of a pgRouting vertex id. KeyError if not in the graph."""
+        i = int(np.searchsorted(self._sorted_ids, vertex_id))
+        if i == len(self._sorted_ids) or self._sorted_ids[i] != vertex_id:
+            raise KeyError(vertex_id)
+        return int(self._id_order[i])
+
+    def edge_arcs(self, edge_ids) -> np.ndarray:
+        """Mask of the arcs (both directions) of the given edges."""
+        return np.isin(self.arc_edges, edge_ids)
+
+    def _search(self, root: int, target: int = -1,
+                costs: Optional[np.ndarray] = None,
+                max_length: float = float('inf'), reverse: bool = False):
+        """
+        Dijkstra from root, on the compiled kernel if accel is enabled.
+        :param costs: Integer arc costs, int_costs by default.
+        :return: (state, reached): the Scratch or ArrayScratch holding the
+            result and the vertices reached, root first.
+        """
+        if costs is None:
+            costs = self.int_costs
+        if accel.ENABLED:
+            if reverse:
+                adjacency = self.in_indptr, self.in_arcs, self.tails
+            else:
+                adjacency = self.indptr, self.out_arcs, self.heads
+            state = search.array_scratch(len(self), len(self.heads))
+            state.generation += 1
+            count = accel.dijkstra(*adjacency, costs, self.lengths, root,
+                                   target, max_length, *state.kernel_args())
+            return state, state.reached[:count]
+
+        if reverse:
+            adjacency = self._in_indptr, self._in_arcs, self._tails
+        else:
+            adjacency = self._indptr, self._out_arcs, self._heads
+        if costs is self.int_costs:
+            cost_list, max_cost = self._int_costs, self._max_cost
+        else:
+            cost_list = costs.tolist()
+            max_cost = int(costs.max()) if len(costs) else 0
+        state = search.scratch(len(self))
+        reached = search.dijkstra(state, *adjacency, cost_list, self._lengths,
+                                  max_cost, root, target, max_length,
+                                  self.queue)
+        return state, reached
+
+    def shortest_path(self, source: int, target: int,
+                      weights: Optional[np.ndarray] = None
+                      ) -> Optional[List[int]]:
+        """
+        Dijkstra from source to target (vertex indices).
+        :param weights: Per-arc weights to use instead of the edge costs.
+        :return: Arc indices of the path, or None if target is unreachable.
+        """
+        costs = None if weights is None else search.quantize(weights)
+        state, _ = self._search(source, target, costs)
+        if state.done[target] != state.generation:
+            return None
+        arcs = []
+        pred, tails = state.pred, self._tails
+        v = target
+        while v != source:
+            arc = int(pred[v])
+            arcs.append(arc)
+            v = tails[arc]
+        arcs.reverse()
+        return arcs
+
+    @tracing.timed('search_tree')
+    def tree(self, root: int, max_length: float = float('inf'),
+             reverse: bool = False) -> SearchTree:
+        """
+        Cheapest paths from root to every vertex (or, with reverse, from
+        every vertex to root), ignoring vertices whose path would be longer
+        than max_length meters.
+        """
+        state, reached = self._search(root, max_length=max_length,
+                                      reverse=reverse)
+        resolution = search.COST_RESOLUTION
+        if isinstance(reached, np.ndarray):
+            vertices = reached.tolist()
+            cost = (state.dist[reached] * resolution).tolist()
+            length = state.length[reached].tolist()
+            pred = state.pred[reached].tolist()
+        else:
+            vertices = reached
+            cost = [state.dist[v] * resolution for v in reached]
+            length = [state.length[v] for v in reached]
+            pred = [state.pred[v] for v in reached]
+        return SearchTree(root, reverse, dict(zip(vertices, cost)),
+                          dict(zip(vertices, length)),
+                          dict(zip(vertices[1:], pred[1:])))
+
+    @tracing.timed('distance_matrix')
+    def distance_matrix(self, sources: Sequence[int],
+                        targets: Sequence[int]) -> np.ndarray:
+        """
+        Length in meters of the cheapest path from each source to each
+        target (vertex indices), inf where there's none.
+        :return: (len(sources), len(targets)) array.
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        out = np.full((len(sources), len(targets)), np.inf)
+        if accel.ENABLED:
+            state = search.array_scratch(len(self), len(self.heads))
+            state.generation = accel.many_to_many(
+                self.indptr, self.out_arcs, self.heads, self.int_costs,
+                self.lengths, sources, targets, *state.kernel_args(), out)
+            return out
+        target_list = targets.tolist()
+        for i, source in enumerate(sources.tolist()):
+            state, _ = self._search(source)
+            done, length = state.done, state.length
+            for j, t in enumerate(target_list):
+                if done[t] == state.generation:
+                    out[i, j] = length[t]
+        return out
+
+    def tree_path(self, tree: SearchTree, v: int) -> List[int]:
+        """
+        Arc indices of the tree path between the root and v, in travel
+        order.
+        """
+        arcs = []
+        step = self._heads if tree.reverse else self._tails
+        while v != tree.root:
+            arc = tree.pred[v]
+            arcs.append(arc)
+            v = step[arc]
+        if not tree.reverse:
+            arcs.reverse()
+        return arcs
+
+
+def bbox_edges(conn, bbox: Dict[str, float]) -> np.ndarray:
+    """Ids of the edges whose geometry's bounding box intersects bbox."""
+    with conn.cursor() as cur:
+        cur.execute(BBOX_EDGES_SQL, tuple(float(bbox[k]) for k in (
+            'xmin', 'ymin', 'xmax', 'ymax')))
+        return np.array([gid for gid, in cur.fetchall()], dtype=np.int64)
+
+
+def network_graph(conn, edge_prefs: Optional[Dict[str, float]] = None,
+                  directed: bool = True,
+                  bbox: Optional[Dict[str, float]] = None) -> Graph:
+    """
+    Graph.from_attributes over the snapshot's EdgeAttributes, shared by
+    every request with the same preferences. Don't modify it.
+    :param bbox: {xmin, ymin, xmax, ymax}: only use the edges
+        make_edges_sql would for it. Such graphs aren't cached.
+    """
+    if bbox is not None:
+        return Graph.from_attributes(edge_costs.edge_attributes(conn),
+                                     edge_prefs, directed,
+                                     bbox_edges(conn, bbox))
+    key = (tuple(sorted((k, float(v)) for k, v in (edge_prefs or {}).items()
+                        if v)), directed)
+    return snapshot.current().cached(
+        'graphs', key,
+        lambda: Graph.from_attributes(edge_costs.edge_attributes(conn),
+                                      edge_prefs, directed),
+        config.get('graphCacheSize', GRAPH_CACHE_SIZE))
@@ -0,0 +1,99 @@
+"""
+Routes of a desired length between two points (a loop when they're the
+same), found in memory.
+
+One search tree grows out of the origin and one grows backwards from the
+destination, both bounded by the desired length. Every vertex reached by
+both is a candidate via point: going origin -> via -> dest along the two
+tree paths has a known length and preference-weighted cost without any
+further search. Candidates whose length is within tolerance of the desired
+length are ranked by cost per meter, so routes over preferred edges come
+first, and routes that mostly retrace their own steps are skipped.
+"""
+from typing import *
+
+import numpy as np
+
+from routers import alternatives
+from routers.graph import Graph
+from utils import tracing
+
+
+class LengthRoute(NamedTuple):
+    arcs: List[int]
+    length: float
+    cost: float
+
+
+def overlap(graph: Graph, arcs: List[int]) -> float:
+    """Fraction of a path's length spent on edges it travels more than once."""
+    if not arcs:
+        return 0.0
+    edges = graph.arc_edges[arcs]
+    _, inverse, counts = np.unique(edges, return_inverse=True,
+                                   return_counts=True)
+    lengths = graph.lengths[arcs]
+    total = lengths.sum()
+    return float(lengths[counts[inverse] > 1].sum() / total) if total else 0.0
+
+
+@tracing.timed('length_routes')
+def length_routes(graph: Graph, source: int, target: int, desired: float,
+                  k: int = 1, tolerance: float = 0.1,
+                  max_overlap: float = 0.3, min_dissimilarity: float = 0.3,
+                  max_candidates: int = 200) -> List[LengthRoute]:
+    """
+    Up to k routes from source to target of about desired meters, best
+    first.
+    :param source, target: Vertex indices in graph.
+    :param tolerance: Accepted relative difference from desired.
+    :param max_overlap: Maximum overlap() of a route.
+    :param min_dissimilarity: Minimum alternatives.dissimilarity between
+        returned routes.
+    :param max_candidates: Number of best-ranked via points to try.
+    :return: Routes. If no via point gives a length within tolerance, the
+        single route closest to desired. Empty if target is unreachable.
+    """
+    max_length = desired * (1 + tolerance)
+    forward = graph.tree(source, max_length)
+    backward = graph.tree(target, max_length, reverse=True)
+
+    via = np.sort(np.fromiter(forward.length.keys() & backward.length.keys(),
+                              dtype=np.int64))
+    if len(via) == 0:
+        # Even the cheapest route is longer than desired
+        path = graph.shortest_path(source, target)
+        if path is None:
+            return []
+        return [LengthRoute(path, float(graph.lengths[path].sum()),
+                            float(graph.costs[path].sum()))]
+    length = np.array([forward.length[v] + backward.length[v] for v in via])
+    cost = np.array([forward.cost[v] + backward.cost[v] for v in via])
+
+    within = np.abs(length - desired) <= tolerance * desired
+    if within.any():
+        via, length, cost = via[within], length[within], cost[within]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rank = np.argsort(np.nan_to_num(cost / length),
+                              kind='mergesort')[:max_candidates]
+    else:
+        rank = np.argsort(np.abs(length - desired), kind='mergesort')[:1]
+
+    routes = []
+    for i in rank:
+        v = int(via[i])
+        path = graph.tree_path(forward, v) + graph.tree_path(backward, v)
+        if overlap(graph, path) > max_overlap:
+            continue
+        if all(alternatives.dissimilarity(graph, path, r.arcs)
+               >= min_dissimilarity for r in routes):
+            routes.append(LengthRoute(path, float(length[i]), float(cost[i])))
+            if len(routes) == k:
+                break
+    if not routes:
+        # Every candidate retraces itself; take the best one anyway
+        v = int(via[rank[0]])
+        path = graph.tree_path(forward, v) + graph.tree_path(backward, v)
+        routes.append(LengthRoute(path, float(length[rank[0]]),
+                                  float(cost[rank[0]])))
+    return routes
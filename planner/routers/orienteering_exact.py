@@ -0,0 +1,100 @@
+"""
+Exact orienteering for a handful of POIs.
+
+A bitmask dynamic program over the pairdist matrix: for every set of
+visited POIs and every POI the path currently ends at, the shortest path
+from the origin that visits exactly that set. Sets whose every path is
+already over the distance budget are never extended. Time and memory grow
+as 2^n * n, so solve_orienteering only uses this below EXACT_MAX_POIS
+candidates and falls back to its randomized search above that.
+"""
+from typing import *
+
+import numpy as np
+
+from routers.base_router import PathResult
+from utils import tracing
+
+# Above this many POIs the randomized search is faster (see
+# benchmarks/bench_orienteering_solver.py)
+EXACT_MAX_POIS = 12
+
+
+@tracing.timed('solve_orienteering_exact')
+def solve_orienteering_exact(
+        poi_score: Dict[int, float], max_distance: float,
+        pairdist: Dict[Tuple[int, int], float],
+        origin: int, dest: int, num_paths: int = 1) -> List[PathResult]:
+    """
+    Highest-scoring paths from origin to dest, like solve_orienteering but
+    optimal. Takes the same arguments; pairs missing from pairdist are
+    unreachable. (origin, dest) must be in pairdist.
+    :return: Up to num_paths paths visiting different sets of POIs, best
+        first. The direct path is always a candidate, even when it's over
+        max_distance, as in solve_orienteering.
+    """
+    direct = PathResult([origin, dest], 0.0, pairdist[(origin, dest)])
+    pois = list(poi_score)
+    n = len(pois)
+    if n == 0:
+        return [direct]
+    inf = float('inf')
+    # Distances between POIs, from the origin and to the destination
+    dist = np.array([[pairdist.get((a, b), inf) if a != b else inf
+                      for b in pois] for a in pois]).reshape(n, n)
+    from_origin = np.array([pairdist.get((origin, p), inf) for p in pois])
+    to_dest = np.array([pairdist.get((p, dest), inf) for p in pois])
+    scores = np.array([poi_score[p] for p in pois], dtype=np.float64)
+
+    # best[mask, j]: length of the shortest path from the origin visiting
+    # the POIs in mask and ending at POI j (in mask); parent[mask, j] is the
+    # POI before j, -1 for the origin
+    best = np.full((1 << n, n), inf)
+    parent = np.full((1 << n, n), -1, dtype=np.int64)
+    bits = 1 << np.arange(n)
+    # A POI is only worth visiting if the destination is still in reach
+    reachable = from_origin + to_dest < max_distance
+    best[bits[reachable], np.flatnonzero(reachable)] = \
+        from_origin[reachable]
+
+    # Extend every set to every POI it doesn't contain. Masks only grow, so
+    # each is final by the time it's extended.
+    for mask in range(1, 1 << n):
+        row = best[mask]
+        ends = np.flatnonzero(row < inf)
+        if len(ends) == 0:
+            continue
+        # Shortest way to step from this set onto each POI
+        step = row[ends, None] + dist[ends]
+        via = step.argmin(axis=0)
+        length = step[via, np.arange(n)]
+        ok = ((mask & bits) == 0) & (length + to_dest < max_distance)
+        for j in np.flatnonzero(ok):
+            next_mask = mask | int(bits[j])
+            if length[j] < best[next_mask, j]:
+                best[next_mask, j] = length[j]
+                parent[next_mask, j] = ends[via[j]]
+
+    # Best ending of each set, then the best sets
+    total = best + to_dest
+    last = total.argmin(axis=1)
+    lengths = total[np.arange(1 << n), last]
+    feasible = np.flatnonzero(lengths < max_distance)
+    mask_scores = ((feasible[:, None] & bits) != 0).dot(scores)
+    order = np.lexsort((lengths[feasible], -mask_scores))
+
+    paths = []
+    for i in order[:num_paths]:
+        mask, j = int(feasible[i]), int(last[feasible[i]])
+        points = []
+        while j >= 0:
+            points.append(pois[j])
+            mask, j = mask & ~int(bits[j]), int(parent[mask, j])
+        paths.append(PathResult([origin] + points[::-1] + [dest],
+                                float(mask_scores[i]),
+                                float(lengths[feasible[i]])))
+    # Going straight to the destination visits no POIs, which only beats
+    # paths that score nothing either
+    paths.append(direct)
+    paths.sort(key=lambda p: (-p.score, p.length))
+    return paths[:num_paths]
@@ -1,30 +1,24 @@
 import logging
 import random
 from typing import *
+
+import numpy as np
 from googleplaces import GooglePlacesAttributeError
 import utils.poi_types as poi_types
 from routers.base_router import *
 from pprint import pprint
 
+from routers import (accel, components, edge_costs, poi_distances,
+                     route_assembly)
+from routers.orienteering_exact import EXACT_MAX_POIS, solve_orienteering_exact
 from utils import google_utils as GoogleUtils
+from utils import tracing
 
 
 logger = logging.getLogger(__name__)
 
 
-class PathResult(NamedTuple):
-    points: List[int]
-    score: float
-    length: float
-
-
-class GmapsResult(NamedTuple):
-    name: str
-    latlon: Tuple[float, float]
-    score: float
-    type: str
-
-
+@tracing.timed('google_places')
 def get_pois_from_gmaps(loc: Tuple[float, float], radius: float,
                         poi_prefs: Dict[str, float]) -> List[GmapsResult]:
     """
@@ -57,7 +51,8 @@ def get_pois_from_gmaps(loc: Tuple[float, float], radius: float,
                     latlon=(float(place.geo_location['lat']),
                             float(place.geo_location['lng'])),
                     score=float(place.rating) * poi_prefs[poitype],
-                    type=poitype
+                    type=poitype,
+                    place_id=place.place_id
                 ))
             except GooglePlacesAttributeError:
                 # Name, location, or rating wasn't available. Skip it
@@ -66,22 +61,122 @@ def get_pois_from_gmaps(loc: Tuple[float, float], radius: float,
     return output
 
 
+EARTH_RADIUS_M = 6371000.0
+
+# Most POIs to snap and route between after pre-filtering
+MAX_POI_CANDIDATES = 30
+
+# How much farther away (meters) nearest_vertex will snap to get a vertex in
+# the main component
+SNAP_SLACK_M = 100.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters. Works on scalars and arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64))
+                              for x in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 \
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+@tracing.timed('prefilter_pois')
+def prefilter_pois(pois: List[GmapsResult], origin: Tuple[float, float],
+                   dest: Tuple[float, float], max_distance: float,
+                   max_candidates: int = MAX_POI_CANDIDATES
+                   ) -> List[GmapsResult]:
+    """
+    Drop POIs no route of at most max_distance could visit, before they're
+    snapped and routed between.
+
+    The straight-line distance origin -> POI -> dest is a lower bound on any
+    route through the POI. POIs whose bound exceeds max_distance are
+    dropped; of the rest, the max_candidates with the most score per meter
+    of that bound are kept, best first.
+    """
+    if not pois:
+        return pois
+    lat = np.array([p.latlon[0] for p in pois])
+    lon = np.array([p.latlon[1] for p in pois])
+    bound = haversine_m(origin[0], origin[1], lat, lon) \
+        + haversine_m(lat, lon, dest[0], dest[1])
+    feasible = np.flatnonzero(bound <= max_distance)
+    score = np.array([pois[i].score for i in feasible])
+    density = score / np.maximum(bound[feasible], 1.0)
+    keep = feasible[np.argsort(-density, kind='mergesort')[:max_candidates]]
+    logger.info('POI pre-filter: %d candidates, %d out of range, %d over '
+                'the cap of %d', len(pois), len(pois) - len(feasible),
+                len(feasible) - len(keep), max_candidates)
+    return [pois[i] for i in keep]
+
+
 def nearest_vertex(conn, latlon: Tuple[float, float]) -> int:
     """
-    Return nearest vertex to a (lat, lon) pair.
+    Return nearest vertex to a (lat, lon) pair, preferring vertices in the
+    main strongly connected component: the nearest of those wins unless it's
+    more than SNAP_SLACK_M farther away than the nearest vertex overall.
     :param latlon: (lat, lon) tuple.
     :return: vertex ID.
     """
+    return nearest_vertices(conn, [latlon])[0]
+
+
+# The nearest vertex to each point and, with MAIN_VERTEX_JOIN, the nearest
+# in the main strong component, one index scan each
+NEAREST_VERTICES_SQL = '''
+WITH p AS (
+    SELECT i, ST_SetSRID(ST_Point(lon, lat), 4326) AS geom
+    FROM unnest(%s::float8[], %s::float8[]) WITH ORDINALITY AS q(lon, lat, i)
+)
+SELECT nearest.id, nearest.distance, {main}
+FROM p
+  CROSS JOIN LATERAL (
+    SELECT v.id, ST_Distance(v.the_geom::geography, p.geom::geography)
+      AS distance
+    FROM ways_vertices_pgr v
+    ORDER BY v.the_geom <-> p.geom
+    LIMIT 1) nearest
+  {main_join}
+ORDER BY p.i;
+'''
+
+MAIN_VERTEX_JOIN = '''LEFT JOIN LATERAL (
+    SELECT v.id, ST_Distance(v.the_geom::geography, p.geom::geography)
+      AS distance
+    FROM ways_vertices_pgr v
+      JOIN vertex_components c ON v.id = c.id
+    WHERE c.strong_component = %s
+    ORDER BY v.the_geom <-> p.geom
+    LIMIT 1) main ON true'''
+
+
+@tracing.timed('nearest_vertex')
+def nearest_vertices(conn, latlons: Sequence[Tuple[float, float]]
+                     ) -> List[int]:
+    """
+    nearest_vertex() of every (lat, lon) pair, in one query.
+    :return: vertex IDs, in the order of latlons.
+    """
+    if not latlons:
+        return []
+    main = components.vertex_components(conn).strong_main
+    # Careful!!! PostGIS ST_Point is (lon, lat)!
+    params = [[float(lon) for _, lon in latlons],
+              [float(lat) for lat, _ in latlons]]
+    if main is None:
+        sql = NEAREST_VERTICES_SQL.format(main='NULL, NULL', main_join='')
+    else:
+        sql = NEAREST_VERTICES_SQL.format(main='main.id, main.distance',
+                                          main_join=MAIN_VERTEX_JOIN)
+        params.append(main)
     with conn.cursor() as cur:
-        # Careful!!! PostGIS ST_Point is (lon, lat)!
-        cur.execute('''
-        SELECT * FROM ways_vertices_pgr
-        ORDER BY the_geom <-> ST_SetSRID(ST_Point(%s, %s), 4326)
-        LIMIT 1;
-        ''', (latlon[1], latlon[0]))
-        result = cur.fetchone()
-        return result[0]
+        cur.execute(sql, params)
+        return [in_main if in_main is not None
+                and in_main_distance <= distance + SNAP_SLACK_M else nearest
+                for nearest, distance, in_main, in_main_distance
+                in cur.fetchall()]
 
+@tracing.timed('make_edges_sql')
 def make_edges_sql(conn, edge_prefs: Dict[str, float],
                    max_discount: float = 0.7, bbox=None) -> str:
     """
@@ -109,30 +204,30 @@ def make_edges_sql(conn, edge_prefs: Dict[str, float],
 
 
 
-        # Adjust edge costs by their greenery/popularity values, weighted by
-        # preferences
+        # Adjust edge costs by their greenery/popularity/climb values,
+        # weighted by preferences. Climb depends on the direction of travel,
+        # so reverse_cost gets its own multiplier.
+        forward_sql, forward_params = edge_costs.multiplier_sql(
+            edge_prefs, 'climb', max_discount)
+        reverse_sql, reverse_params = edge_costs.multiplier_sql(
+            edge_prefs, 'reverse_climb', max_discount)
+        elevation_join = 'LEFT JOIN ways_elevation USING (gid)' \
+            if edge_costs.uses_climb(edge_prefs) else ''
         return cur.mogrify(
             '''
             SELECT
               gid AS id, source, target,
-              length_m * multiplier AS cost,
-              length_m * SIGN(reverse_cost) * multiplier AS reverse_cost
+              length_m * {} AS cost,
+              length_m * SIGN(reverse_cost) * {} AS reverse_cost
             FROM ways
-              INNER JOIN (
-                SELECT
-                  gid, 
-                  (1 - %s * ((%s * greenery + %s * popularity_highres)) / %s) 
-                    AS multiplier
-                FROM ways_metadata                  
-              ) AS ways_multipliers USING (gid)
-            ''' + bbox_query,
-            (max_discount,
-             edge_prefs.get('green', 0),
-             edge_prefs.get('popularity', 0),
-             sum(edge_prefs.values()))
+              INNER JOIN ways_metadata USING (gid)
+              {}
+            '''.format(forward_sql, reverse_sql, elevation_join) + bbox_query,
+            forward_params + reverse_params
         ).decode()
 
 
+@tracing.timed('pairwise_dijkstra')
 def pairwise_shortest_path_costs(conn, edges_sql: str, origins: List[int],
          dests: List[int]) -> Dict[Tuple[int, int], float]:
     """
@@ -165,12 +260,51 @@ def pairwise_shortest_path_costs(conn, edges_sql: str, origins: List[int],
                 for (start_vid, end_vid, length) in results}
 
 
+def reverse_edges_sql(edges_sql: str) -> str:
+    """
+    edges_sql with every edge turned around, so a search from a vertex in
+    the result finds the cheapest paths *to* it in the original graph.
+    """
+    return '''
+        SELECT id, target AS source, source AS target,
+          reverse_cost AS cost, cost AS reverse_cost
+        FROM ({}) AS edges'''.format(edges_sql)
+
+
+def pairwise_costs_with_table(conn, edges_sql: str, origin: int, dest: int,
+                              pois: List[int],
+                              table: poi_distances.PoiDistanceTable,
+                              key: str, known: Dict[int, int]
+                              ) -> Dict[Tuple[int, int], float]:
+    """
+    Same result as pairwise_shortest_path_costs(edges_sql, [origin] + pois,
+    pois + [dest]), but with distances between POIs in the table looked
+    up instead of searched for. Only the origin and the POIs not in the
+    table are searched from, and only the destination and those POIs are
+    searched back from, so with every POI in the table that's 2 searches
+    instead of len(pois) + 1.
+    :param key: prefs_key of the edge preferences edges_sql was made with.
+    :param known: Table row of each POI vertex that's in the table.
+    """
+    unknown = [v for v in pois if v not in known]
+    pairdist = table.pairdist(key, list(known.values()))
+    pairdist.update(pairwise_shortest_path_costs(
+        conn, edges_sql, [origin] + unknown, pois + [dest]))
+    # Searching backwards from dest and the unknown POIs gives the
+    # distances from every POI in the table to them
+    backwards = pairwise_shortest_path_costs(
+        conn, reverse_edges_sql(edges_sql), [dest] + unknown, list(known))
+    pairdist.update({(b, a): d for (a, b), d in backwards.items()})
+    return pairdist
+
+
+@tracing.timed('solve_orienteering')
 def solve_orienteering(
         poi_score: Dict[int, float], max_distance: float,
         pairdist: Dict[Tuple[int, int], float],
         origin: int, dest: int,
         power_param: float = 4.0, length_param: int = 4,
-        n_total_trials: int = 1000) -> PathResult:
+        n_total_trials: int = 1000, num_paths: int = 1) -> List[PathResult]:
     """
     Return high-scoring paths from any origin to any destination.
     Paths accumulate score by visiting POIs.
@@ -187,7 +321,11 @@ def solve_orienteering(
     :param power_param: Configures how desirability is calculated.
     :param length_param: Configures how many of the top nodes to keep.
     :param n_total_trials: Number of total random paths to try.
-    :return: List of (path, score, length), for each best path.
+    :param num_paths: Number of paths to return. They visit different sets
+        of POIs.
+    With at most EXACT_MAX_POIS POIs, the optimal paths are found with
+    solve_orienteering_exact instead of the randomized search.
+    :return: List of (path, score, length), for each best path, best first.
     """
     def make_path(origin: int, dest: int) -> PathResult:
         """
@@ -250,13 +388,48 @@ def solve_orienteering(
     if (origin, dest) not in pairdist:
         raise ValueError("Origin and dest are not connected")
 
-    bestpath = None
-    for _ in range(n_total_trials):
-        path = make_path(origin, dest)
-        if bestpath is None or bestpath.score < path.score:
-            bestpath = path
-
-    return bestpath
+    if len(poi_score) <= EXACT_MAX_POIS:
+        return solve_orienteering_exact(poi_score, max_distance, pairdist,
+                                        origin, dest, num_paths)
+
+    if accel.ENABLED:
+        trials = compiled_trials(poi_score, max_distance, pairdist, origin,
+                                 dest, power_param, length_param,
+                                 n_total_trials)
+    else:
+        trials = (make_path(origin, dest) for _ in range(n_total_trials))
+
+    # Best path for each set of POIs visited
+    bestpaths = {}
+    for path in trials:
+        pois = frozenset(path.points[1:-1])
+        if pois not in bestpaths or bestpaths[pois].score < path.score:
+            bestpaths[pois] = path
+
+    # Highest score first; the shorter path wins a tie
+    return sorted(bestpaths.values(),
+                  key=lambda p: (-p.score, p.length))[:num_paths]
+
+
+def compiled_trials(poi_score: Dict[int, float], max_distance: float,
+                    pairdist: Dict[Tuple[int, int], float], origin: int,
+                    dest: int, power_param: float, length_param: int,
+                    n_total_trials: int) -> List[PathResult]:
+    """solve_orienteering's random paths, made by accel.orienteering_trials."""
+    pois = list(poi_score)
+    nodes = [origin] + pois + [dest]
+    inf = float('inf')
+    dist = np.array([[pairdist.get((a, b), inf) for b in nodes]
+                     for a in nodes])
+    scores = np.array([poi_score[p] for p in pois], dtype=np.float64)
+    paths, counts, path_scores, lengths = accel.orienteering_trials(
+        dist, scores, max_distance, power_param, length_param,
+        n_total_trials, random.getrandbits(32))
+    return [PathResult([origin] + [pois[i - 1] for i in row[:count]]
+                       + [dest], score, length)
+            for row, count, score, length in zip(
+                paths.tolist(), counts.tolist(), path_scores.tolist(),
+                lengths.tolist())]
 
 
 def get_route_geojson(conn, edges_sql: str, nodes: List[int]):
@@ -264,26 +437,10 @@ def get_route_geojson(conn, edges_sql: str, nodes: List[int]):
     Find route through all vertices and return its GeoJSON.
     :param edges_sql: Edges query for pgr_dijkstra.
     :param nodes: List of vertices.
-    :return: GeoJSON of path, as a LineString.
+    :return: (GeoJSON of path as a LineString, length, elevationData,
+        elevation profile).
     """
-    with conn.cursor() as cur:
-        cur.execute('''
-        WITH dijkstra AS (
-            SELECT * FROM pgr_dijkstraVia(%s, %s)
-        )
-        SELECT
-          ST_AsGeoJSON(ST_MakeLine(
-            CASE WHEN node = source THEN the_geom ELSE ST_Reverse(the_geom) END
-          )) AS geojson,
-          array_agg(ARRAY[length_m, elevation, nPoints]) as elevationData
-            FROM (
-                SELECT node, source, ways.the_geom, length_m, wvp.elevation, 
-                    SUM(ST_NumPoints(ways.the_geom) - 1) OVER (ORDER BY seq) as nPoints
-                FROM dijkstra JOIN ways ON dijkstra.edge = ways.gid
-                JOIN ways_vertices_pgr wvp on dijkstra.node = wvp.id) subq;
-        ''', (edges_sql, nodes,))
-
-        return cur.fetchone()
+    return route_assembly.route_via(conn, edges_sql, nodes)
 
 
 class OrienteeringRouter(BaseRouter):
@@ -313,43 +470,87 @@ class OrienteeringRouter(BaseRouter):
 
         :return: Resulting route.
         """
+        return self.make_routes(origin_latlon, dest_latlon, 1, **kwargs)[0]
+
+    def make_routes(self, origin_latlon: Tuple[float, float],
+                    dest_latlon: Tuple[float, float], num_routes: int,
+                    **kwargs) -> List[RouteResult]:
+        """
+        Up to num_routes routes, best first, each visiting a different set
+        of POIs. They all come from the same orienteering trials. Takes the
+        same keyword arguments as make_route.
+        """
         # Parse kwargs
         length_m = kwargs.pop('desired_dist')
         poi_prefs = kwargs.pop('poi_prefs')
         edge_prefs = kwargs.pop('edge_prefs')
         bbox = kwargs.pop('bbox', None)
 
+        # Map origin and dest to actual vertices, and give up early if
+        # there's no route between them
+        labels = components.vertex_components(self.conn)
+        origin = nearest_vertex(self.conn, origin_latlon)
+        dest = nearest_vertex(self.conn, dest_latlon)
+        labels.check_connected(origin, dest)
+
         # Get points of interest
         center = midpoint(origin_latlon, dest_latlon)
         pois = get_pois_from_gmaps(center, length_m / 2, poi_prefs)
-
-        # Map origins, dests, and POIs to actual vertices
-        origin = nearest_vertex(self.conn, origin_latlon)
-        dest = nearest_vertex(self.conn, dest_latlon)
-        poi_nodes = {
-            nearest_vertex(self.conn, poi.latlon): poi
-            for poi in pois
-        }
+        pois = prefilter_pois(pois, origin_latlon, dest_latlon, length_m)
+
+        # POI-to-POI distances may have been precomputed for this region
+        # (only without a bbox, which would change them)
+        table = poi_distances.table_for(center, edge_prefs) \
+            if bbox is None else None
+        table_rows = table.index([poi.place_id for poi in pois]) \
+            if table is not None else [-1] * len(pois)
+
+        # Map POIs to vertices. POIs that can't be reached from the origin
+        # are dropped before any routing.
+        poi_nodes = {}
+        known = {}
+        for poi, row in zip(pois, table_rows):
+            if row >= 0:
+                vertex = int(table.vertices[row])
+            else:
+                vertex = nearest_vertex(self.conn, poi.latlon)
+            if labels.connected(origin, vertex):
+                poi_nodes[vertex] = poi
+                if row >= 0:
+                    known[vertex] = int(row)
+                else:
+                    known.pop(vertex, None)
         logger.info('Origin %s, dest %s, center %s', origin, dest, center)
-        logger.info('POIs: %s', poi_nodes.keys())
+        logger.info('POIs: %s (%d unreachable, %d precomputed)',
+                    poi_nodes.keys(), len(pois) - len(poi_nodes), len(known))
         poi_score = {vid: poi_nodes[vid].score for vid in poi_nodes}
 
         # Compute edges_sql based on edge preferences
         edges_sql = make_edges_sql(self.conn, edge_prefs, bbox=bbox)
 
         # Compute pairwise distances between origins, dests, and POIs
-        pairdist = pairwise_shortest_path_costs(
-            self.conn, edges_sql, [origin] + list(poi_nodes.keys()),
-            list(poi_nodes.keys()) + [dest])
+        if known:
+            pairdist = pairwise_costs_with_table(
+                self.conn, edges_sql, origin, dest, list(poi_nodes), table,
+                poi_distances.prefs_key(edge_prefs), known)
+        else:
+            pairdist = pairwise_shortest_path_costs(
+                self.conn, edges_sql, [origin] + list(poi_nodes.keys()),
+                list(poi_nodes.keys()) + [dest])
         logger.info('Computed pairdist')
-        # TODO if a node is not connected, pairdist may silently omit distances
-        # Sanity check that dest is actually reachable from origin?
-        # Other checks for strongly connected components?
+        # Everything is in the origin's component, but a bbox can still cut
+        # some pairs apart, so solve_orienteering allows missing entries
 
         # Solve orienteering problem
-        path = solve_orienteering(poi_score, length_m, pairdist, origin, dest)
-        logger.info('Best path: %s', path)
-
+        paths = solve_orienteering(poi_score, length_m, pairdist, origin, dest,
+                                   num_paths=num_routes)
+        logger.info('Best path: %s', paths[0])
+        return [self._route_result(path, poi_nodes, pairdist, edges_sql)
+                for path in paths]
+
+    def _route_result(self, path: PathResult, poi_nodes: Dict[int, GmapsResult],
+                      pairdist: Dict[Tuple[int, int], float],
+                      edges_sql: str) -> RouteResult:
         # Build list of POI results
         poiresults = []
         for prev, curr in zip(path.points[:-2], path.points[1:-1]):
@@ -363,12 +564,14 @@ class OrienteeringRouter(BaseRouter):
                 pairdist[(prev, curr)]
             ))
 
-        geojson, elevationData = get_route_geojson(self.conn, edges_sql, path.points)
+        geojson, _, elevationData, profile = get_route_geojson(
+            self.conn, edges_sql, path.points)
         return RouteResult(
             geojson,
             path.score, path.length,
             elevationData,
-            pois=poiresults
+            pois=poiresults,
+            elevationProfile=profile
         )
 
 
@@ -0,0 +1,134 @@
+"""
+Precomputed POI-to-POI road distances.
+
+Most of the orienteering distance matrix is distances between POIs, which
+don't depend on where the user starts. put_poi_distances.py computes them
+offline for the POIs of a region and a few common edge preference vectors,
+and stores one table per region as an .npz file in the "poiDistanceDir"
+config directory:
+  - region, bbox (xmin, ymin, xmax, ymax)
+  - place_ids: Google place ids of the POIs, sorted
+  - vertices: vertex each POI was snapped to
+  - keys: prefs_key of each stored preference vector
+  - distances: (len(keys), n, n) float32 meters, inf where there's no path
+
+Distances are the true lengths of the cheapest paths under each preference
+vector, the same as pairwise_shortest_path_costs returns.
+"""
+import glob
+import logging
+import os
+from typing import *
+
+import numpy as np
+
+from config import config
+from routers import snapshot
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def prefs_key(edge_prefs: Dict[str, float]) -> str:
+    """Canonical name of an edge preference vector, 'default' if empty."""
+    items = sorted((k, float(v)) for k, v in edge_prefs.items() if v)
+    if not items:
+        return 'default'
+    return ','.join('{}={:g}'.format(k, v) for k, v in items)
+
+
+class PoiDistanceTable:
+    def __init__(self, region: str, bbox: Sequence[float],
+                 place_ids: Sequence[str], vertices: Sequence[int],
+                 keys: Sequence[str], distances: np.ndarray):
+        order = np.argsort(np.asarray(place_ids, dtype=str), kind='mergesort')
+        self.region = region
+        self.bbox = tuple(float(x) for x in bbox)
+        self.place_ids = np.asarray(place_ids, dtype=str)[order]
+        self.vertices = np.asarray(vertices, dtype=np.int64)[order]
+        self.keys = list(keys)
+        self.distances = np.asarray(distances, dtype=np.float32)[
+            :, order][:, :, order]
+
+    @classmethod
+    def load(cls, path: str) -> 'PoiDistanceTable':
+        with np.load(path) as data:
+            return cls(str(data['region']), data['bbox'], data['place_ids'],
+                       data['vertices'], [str(k) for k in data['keys']],
+                       data['distances'])
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f, region=self.region, bbox=np.array(self.bbox),
+                place_ids=self.place_ids, vertices=self.vertices,
+                keys=np.array(self.keys), distances=self.distances)
+
+    def __len__(self):
+        return len(self.place_ids)
+
+    def contains(self, latlon: Tuple[float, float]) -> bool:
+        xmin, ymin, xmax, ymax = self.bbox
+        return xmin <= latlon[1] <= xmax and ymin <= latlon[0] <= ymax
+
+    def index(self, place_ids: Sequence[Optional[str]]) -> np.ndarray:
+        """Row of each place id, -1 for ids not in the table."""
+        ids = np.array([p or '' for p in place_ids], dtype=str)
+        if len(self.place_ids) == 0:
+            return np.full(len(ids), -1, dtype=np.int64)
+        idx = np.minimum(np.searchsorted(self.place_ids, ids),
+                         len(self.place_ids) - 1)
+        return np.where(self.place_ids[idx] == ids, idx, -1)
+
+    def pairdist(self, key: str, idx: Sequence[int]
+                 ) -> Dict[Tuple[int, int], float]:
+        """
+        pairwise_shortest_path_costs-style map between the vertices of the
+        given rows (all >= 0). Missing paths are left out.
+        """
+        idx = np.asarray(idx, dtype=np.int64)
+        sub = self.distances[self.keys.index(key)][np.ix_(idx, idx)]
+        vertices = self.vertices[idx].tolist()
+        a, b = np.nonzero(np.isfinite(sub))
+        return {(vertices[i], vertices[j]): float(sub[i, j])
+                for i, j in zip(a.tolist(), b.tolist()) if i != j}
+
+
+def _table_files() -> List[Tuple[str, float]]:
+    """(path, mtime) of every table file in poiDistanceDir."""
+    directory = config.get('poiDistanceDir')
+    paths = sorted(glob.glob(os.path.join(directory, '*.npz'))) \
+        if directory else []
+    return [(p, os.path.getmtime(p)) for p in paths]
+
+
+def _load_tables(conn=None):
+    files = _table_files()
+    loaded = [PoiDistanceTable.load(p) for p, _ in files]
+    logger.info('Loaded %d POI distance tables', len(loaded))
+    return files, loaded
+
+
+def _reload_tables(old, conn=None):
+    """Tables again if put_poi_distances.py rewrote any since old."""
+    return _load_tables() if _table_files() != old[0] else None
+
+
+snapshot.register('poi_distance_tables', _load_tables, _reload_tables)
+
+
+def tables() -> List[PoiDistanceTable]:
+    """Every table in poiDistanceDir, loaded on first use."""
+    return snapshot.value('poi_distance_tables', None)[1]
+
+
+def table_for(latlon: Tuple[float, float],
+              edge_prefs: Dict[str, float]) -> Optional[PoiDistanceTable]:
+    """A table covering latlon with distances for edge_prefs, if any."""
+    key = prefs_key(edge_prefs)
+    for table in tables():
+        if key in table.keys and table.contains(latlon):
+            metrics.cache_hit('poi_distances')
+            return table
+    metrics.cache_miss('poi_distances')
+    return None
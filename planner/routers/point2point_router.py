@@ -1,4 +1,9 @@
-from routers.base_router import BaseRouter, RouteResult, orient_linestring
+from typing import *
+
+from routers import alternatives
+from routers.base_router import BaseRouter, ElevationData, RouteResult
+from routers.orienteering_router import nearest_vertex
+from utils import tracing
 
 
 class Point2PointRouter(BaseRouter):
@@ -12,7 +17,7 @@ class Point2PointRouter(BaseRouter):
         :return:
         """
 
-        with self.conn.cursor() as cur:
+        with self.conn.cursor() as cur, tracing.stage('path_query'):
             if 'bbox' in kwargs:
                 bbox = kwargs['bbox']
                 cur.execute(
@@ -23,17 +28,32 @@ class Point2PointRouter(BaseRouter):
                     'SELECT * FROM pathFromNearestKnownPoints(%s,%s,%s,%s)',
                     (*reversed(origin), *reversed(dest)))
             linestring, length, elevationData = cur.fetchone()
+        if linestring is None:
+            raise ValueError('No route between origin and destination')
 
-            # HACK: reverse linestring if it is backwards.
-            linestring = orient_linestring(origin, dest, linestring)
+        return RouteResult(
+            geojson=linestring,
+            score=0,
+            length=length,
+            elevationData=ElevationData.from_rows(elevationData),
+            pois=[]
+        )
 
-            return RouteResult(
-                geojson=linestring,
-                score=0,
-                length=length,
-                elevationData=elevationData,
-                pois=[]
-            )
+    def make_routes(self, origin, dest, num_routes, **kwargs):
+        """
+        Up to num_routes dissimilar routes, shortest first. Like make_route
+        they ignore one-way restrictions and stay on edges in the bbox, if
+        one is given.
+        """
+        if num_routes == 1:
+            return [self.make_route(origin, dest, **kwargs)]
+        routes = alternatives.alternative_routes(
+            self.conn, nearest_vertex(self.conn, origin),
+            nearest_vertex(self.conn, dest), num_routes, directed=False,
+            bbox=kwargs.get('bbox'))
+        return [RouteResult(geojson, 0, length, elevationData, [],
+                            elevationProfile=profile)
+                for geojson, length, elevationData, profile in routes]
 
 
 def main():
@@ -1,13 +1,28 @@
 import logging
+import math
+
+import numpy as np
+
 from routers.base_router import *
 import utils.poi_types as poi_types
 # Sorta hack: importing from another router
 import routers.orienteering_router as orientrouter
 
+from routers import components, route_assembly
+from routers.graph import SearchTree, network_graph
 from utils import google_utils as GoogleUtils
 
 logger = logging.getLogger(__name__)
 
+# Number of POIs to visit
+NUM_POIS = 3
+
+# POIs are only considered within this much of the origin and destination
+# by road: MAX_DETOUR_FACTOR times a bound on the direct distance, plus
+# MAX_DETOUR_M meters
+MAX_DETOUR_FACTOR = 1.5
+MAX_DETOUR_M = 2000.0
+
 
 class POIsOnWayRouter(BaseRouter):
     """
@@ -26,6 +41,10 @@ class POIsOnWayRouter(BaseRouter):
                    dest_latlon: Tuple[float, float], **kwargs) -> RouteResult:
         """
         Make routes that visits nearby points of interest.
+
+        POIs are chosen by the real detour they add to the shortest route
+        and visited in the order they come up along it. With a bbox, only
+        edges in it are used, as in make_edges_sql.
         :return: Resulting route.
         """
         # Parse kwargs
@@ -33,89 +52,118 @@ class POIsOnWayRouter(BaseRouter):
         edge_prefs = kwargs.pop('edge_prefs')
         bbox = kwargs.pop('bbox', None)
 
+        # Map origin and dest to actual vertices, and give up early if
+        # there's no route between them
+        labels = components.vertex_components(self.conn)
+        origin_id, dest_id = orientrouter.nearest_vertices(
+            self.conn, [origin_latlon, dest_latlon])
+        labels.check_connected(origin_id, dest_id)
+
         # Get points of interest
         center = orientrouter.midpoint(origin_latlon, dest_latlon)
         # TODO: the radius is some arbitrary large #
         gmaps_results = orientrouter.get_pois_from_gmaps(center, 10000, poi_prefs)
 
-        # Compute nearest POIs to path
-        def ellipse_distance_sq(f1, f2, p):
-            """dist(f1, p)^2 + dist(f2, p)^2"""
-            return (p[0] - f1[0]) ** 2 + (p[1] - f1[1]) ** 2 + (p[0] - f2[0]) ** 2 + (p[1] - f2[1]) ** 2
-
-        gmaps_results.sort(key=lambda g: ellipse_distance_sq(origin_latlon, dest_latlon, g.latlon))
-        gmaps_results = gmaps_results[:3]
-        logger.info('POIs: {}'.format(gmaps_results))
-
-        # Sort the POIs by their scalar projection on the line from the origin
-        # to the destination. This approximates the optimal order to visit them
-        def scalar_proj(o, a, d):
-            """Compute scalar projection of OA onto OD"""
-            oa = (a[0] - o[0], a[1] - o[1])
-            od = (d[0] - o[0], d[1] - o[1])
-            dot_product = oa[0] * od[0] + oa[1] * od[1]
-            magnitude_od = math.hypot(od[0], od[1])
-            return dot_product / magnitude_od
-        # print('Before sorting:')
-        # for gmaps_result in gmaps_results:
-        #     print(gmaps_result, 'proj=', scalar_proj(origin_latlon, gmaps_result.latlon, dest_latlon))
-        gmaps_results.sort(key=lambda g: scalar_proj(origin_latlon, g.latlon, dest_latlon))
-        logger.info('After sorting: {}'.format(gmaps_results))
-
-        # Map origins, dests, and POIs to actual vertices
-        origin = orientrouter.nearest_vertex(self.conn, origin_latlon)
-        dest = orientrouter.nearest_vertex(self.conn, dest_latlon)
-        pois = [orientrouter.nearest_vertex(self.conn, g.latlon) for g in gmaps_results]
+        # Map POIs to vertices, all in one query. POIs that can't be reached
+        # from the origin are dropped.
+        graph = network_graph(self.conn, edge_prefs, bbox=bbox)
+        try:
+            origin, dest = graph.vertex(origin_id), graph.vertex(dest_id)
+        except KeyError:
+            raise ValueError('Origin or destination is not on the road network')
+        candidates = {}
+        vertex_ids = orientrouter.nearest_vertices(
+            self.conn, [g.latlon for g in gmaps_results])
+        for g, vertex_id in zip(gmaps_results, vertex_ids):
+            if not labels.connected(origin_id, vertex_id):
+                continue
+            try:
+                vertex = graph.vertex(vertex_id)
+            except KeyError:
+                continue
+            # Keep the best-scoring POI at each vertex
+            if vertex not in candidates or candidates[vertex].score < g.score:
+                candidates[vertex] = g
+
+        # Shortest paths from the origin and to the destination, as far as
+        # any POI worth its detour could be
+        max_length = MAX_DETOUR_FACTOR * road_distance_bound(
+            origin_latlon, dest_latlon) + MAX_DETOUR_M
+        forward = graph.tree(origin, max_length)
+        backward = graph.tree(dest, max_length, reverse=True)
+        if dest not in forward.cost:
+            # The roads wind more than the bound allows for
+            forward = graph.tree(origin)
+            backward = graph.tree(dest, reverse=True)
+            if dest not in forward.cost:
+                raise ValueError('No route between origin and destination')
+
+        # Visit the POIs that cost the least extra to go through, in the
+        # order they're reached along the way
+        pois = cheapest_detours(forward, backward, dest, list(candidates),
+                                NUM_POIS)
+        pois.sort(key=lambda v: forward.length[v] - backward.length[v])
+        logger.info('POIs: %s', [candidates[v] for v in pois])
 
         # Make route
-        edges_sql = orientrouter.make_edges_sql(self.conn, edge_prefs, bbox=bbox)
         nodes = [origin] + pois + [dest]
-        with self.conn.cursor() as cur:
-            cur.execute('''
-            WITH dijkstra AS (
-                SELECT * FROM pgr_dijkstraVia(%s, %s)
-            )
-            SELECT
-              ST_AsGeoJSON(ST_MakeLine(
-                CASE WHEN node = source THEN the_geom ELSE ST_Reverse(the_geom) END
-              )) AS geojson,
-              array_agg(ARRAY[length_m, elevation, nPoints]) AS elevationData, SUM(length_m) AS length
-                FROM (
-                    SELECT node, source, ways.the_geom, length_m, wvp.elevation, 
-                        SUM(ST_NumPoints(ways.the_geom) - 1) OVER (ORDER BY seq) AS nPoints
-                    FROM dijkstra JOIN ways ON dijkstra.edge = ways.gid
-                    JOIN ways_vertices_pgr wvp ON dijkstra.node = wvp.id) subq;
-            ''', (edges_sql, nodes))
-            geojson, elevationData, length = cur.fetchone()
-
-            # # Compute length of each leg
-            # cur.execute('''
-            # SELECT SUM(cost)
-            # FROM dijkstra
-            # GROUP BY path_id
-            # ORDER BY path_id;
-            # ''', ())
-            # lengths_of_legs = cur.fetchall()
-            # # length_of_legs is a list of 1-tuples. Convert to list of floats
-            # lengths_of_legs = [l[0] for l in lengths_of_legs]
-            #
-            #
-            # logger.info('Lengths of legs: {}'.format(lengths_of_legs))
-
-        # Old Compute POIResult objects
-        # poiresults = [PoiResult(g.latlon, g.name, g.type, l)
-        #               for g, l in zip(gmaps_results, lengths_of_legs)]
-        # Compute POIResult objects
-        poiresults = [PoiResult(g.latlon, g.name, g.type, -1)
-                      for g in gmaps_results]
+        legs = []
+        for i, (a, b) in enumerate(zip(nodes[:-1], nodes[1:])):
+            if i == 0:
+                legs.append(graph.tree_path(forward, b))
+            elif b == dest:
+                legs.append(graph.tree_path(backward, a))
+            else:
+                leg = graph.shortest_path(a, b)
+                if leg is None:
+                    raise ValueError('No route through the requested points')
+                legs.append(leg)
+        arcs = [arc for leg in legs for arc in leg]
+        geojson, length, elevationData, profile = \
+            route_assembly.route_from_edges(self.conn, graph.arc_edges[arcs],
+                                            graph.arc_forward[arcs])
+
+        # Length of the leg leading to each POI
+        poiresults = [PoiResult(candidates[v].latlon, candidates[v].name,
+                                candidates[v].type,
+                                float(graph.lengths[leg].sum()))
+                      for v, leg in zip(pois, legs)]
         return RouteResult(
             geojson,
             0, length,
             elevationData,
-            pois=poiresults
+            pois=poiresults,
+            elevationProfile=profile
         )
 
 
+def road_distance_bound(origin: Tuple[float, float],
+                        dest: Tuple[float, float]) -> float:
+    """
+    Rough upper bound on the road distance between two points, in meters:
+    the Manhattan distance, padded for winding roads.
+    """
+    lat = math.radians((origin[0] + dest[0]) / 2)
+    dy = abs(origin[0] - dest[0]) * 111320
+    dx = abs(origin[1] - dest[1]) * 111320 * math.cos(lat)
+    return 1.5 * (dx + dy)
+
+
+def cheapest_detours(forward: SearchTree, backward: SearchTree, dest: int,
+                     vertices: List[int], n: int) -> List[int]:
+    """
+    The n vertices with the smallest detour cost
+    d(origin, v) + d(v, dest) - d(origin, dest), using the trees from the
+    origin and to dest. Vertices outside either tree are left out.
+    """
+    base = forward.cost[dest]
+    reachable = [v for v in vertices
+                 if v in forward.cost and v in backward.cost]
+    detour = np.array([forward.cost[v] + backward.cost[v] - base
+                       for v in reachable])
+    return [reachable[i] for i in np.argsort(detour, kind='mergesort')[:n]]
+
+
 def main():
     origin = (34.140003, -118.122775)  # Avery
     dest = (34.140771, -118.132323)  # Lake ave
@@ -0,0 +1,206 @@
+"""
+Build a route's geometry and elevation data from a pgr_dijkstraVia path, or
+from a path already found in memory (route_from_edges).
+
+Elevation comes from the precomputed ways_elevation table (see
+put_edge_elevation.py), falling back to the vertex elevations from
+put_elevation.py for edges it has no row for, and the per-edge profiles are
+stitched together in Python. Geometry is sliced out of
+the in-memory edge geometry cache (see edge_geometry.py) unless it's turned
+off with the "edgeGeometryCache" config option, in which case PostGIS
+builds it.
+"""
+from typing import *
+
+import numpy as np
+
+from config import config
+from routers import edge_geometry
+from routers.base_router import ElevationData
+from utils import tracing
+
+ROUTE_VIA_SQL = '''
+WITH dijkstra AS (
+    SELECT * FROM pgr_dijkstraVia(%s, %s)
+)
+SELECT
+  ST_AsGeoJSON(ST_MakeLine(
+    CASE WHEN dijkstra.node = ways.source THEN ways.the_geom
+         ELSE ST_Reverse(ways.the_geom) END
+    ORDER BY dijkstra.seq)) AS geojson,
+  SUM(ways.length_m) AS length,
+  array_agg(ways.length_m ORDER BY dijkstra.seq) AS lengths,
+  array_agg(ST_NumPoints(ways.the_geom) - 1 ORDER BY dijkstra.seq) AS segments,
+  array_agg(dijkstra.node = ways.source ORDER BY dijkstra.seq) AS forward,
+  array_agg(CASE WHEN dijkstra.node = ways.source
+                 THEN COALESCE(we.source_elevation, wvp.elevation)
+                 ELSE COALESCE(we.target_elevation, wvp.elevation)
+            END ORDER BY dijkstra.seq) AS elevations,
+  array_agg(we.profile ORDER BY dijkstra.seq) AS profiles
+FROM dijkstra
+  JOIN ways ON dijkstra.edge = ways.gid
+  LEFT JOIN ways_elevation we ON ways.gid = we.gid
+  LEFT JOIN ways_vertices_pgr wvp ON dijkstra.node = wvp.id;
+'''
+
+# Same as ROUTE_VIA_SQL, minus the geometry
+ROUTE_VIA_EDGES_SQL = '''
+WITH dijkstra AS (
+    SELECT * FROM pgr_dijkstraVia(%s, %s)
+)
+SELECT
+  array_agg(dijkstra.edge ORDER BY dijkstra.seq) AS edges,
+  SUM(ways.length_m) AS length,
+  array_agg(ways.length_m ORDER BY dijkstra.seq) AS lengths,
+  array_agg(dijkstra.node = ways.source ORDER BY dijkstra.seq) AS forward,
+  array_agg(CASE WHEN dijkstra.node = ways.source
+                 THEN COALESCE(we.source_elevation, wvp.elevation)
+                 ELSE COALESCE(we.target_elevation, wvp.elevation)
+            END ORDER BY dijkstra.seq) AS elevations,
+  array_agg(we.profile ORDER BY dijkstra.seq) AS profiles
+FROM dijkstra
+  JOIN ways ON dijkstra.edge = ways.gid
+  LEFT JOIN ways_elevation we ON ways.gid = we.gid
+  LEFT JOIN ways_vertices_pgr wvp ON dijkstra.node = wvp.id;
+'''
+
+# Elevation (and, with the cache off, geometry) of a given list of edges
+PATH_EDGES_SQL = '''
+SELECT
+  {geometry}
+  SUM(ways.length_m) AS length,
+  array_agg(ways.length_m ORDER BY path.seq) AS lengths,
+  array_agg(CASE WHEN path.forward
+                 THEN COALESCE(we.source_elevation, wvp.elevation)
+                 ELSE COALESCE(we.target_elevation, wvp.elevation)
+            END ORDER BY path.seq) AS elevations,
+  array_agg(we.profile ORDER BY path.seq) AS profiles
+FROM unnest(%s::bigint[], %s::boolean[])
+    WITH ORDINALITY AS path(gid, forward, seq)
+  JOIN ways ON path.gid = ways.gid
+  LEFT JOIN ways_elevation we ON ways.gid = we.gid
+  LEFT JOIN ways_vertices_pgr wvp
+    ON wvp.id = CASE WHEN path.forward THEN ways.source ELSE ways.target END;
+'''
+
+PATH_GEOMETRY_SQL = '''
+  ST_AsGeoJSON(ST_MakeLine(
+    CASE WHEN path.forward THEN ways.the_geom
+         ELSE ST_Reverse(ways.the_geom) END
+    ORDER BY path.seq)) AS geojson,
+  array_agg(ST_NumPoints(ways.the_geom) - 1 ORDER BY path.seq) AS segments,
+'''
+
+
+def elevation_data(lengths: Sequence[float],
+                   elevations: Sequence[Optional[float]],
+                   segments: Sequence[int]) -> ElevationData:
+    """
+    Per-edge length_m, elevation at the edge's start and index of the edge's
+    last point in the route linestring, the format the API expects.
+    """
+    return ElevationData(
+        lengths, [np.nan if e is None else e for e in elevations],
+        np.cumsum(segments))
+
+
+def elevation_profile(elevations: Sequence[Optional[float]],
+                      forward: Sequence[bool],
+                      profiles: Sequence[Optional[bytes]]) -> Optional[list]:
+    """
+    Concatenate the per-edge float16 profiles along the route, reversing
+    edges that are travelled target -> source. None if any edge has no
+    precomputed profile.
+    """
+    parts = []
+    for i, (start, fwd, profile) in enumerate(zip(elevations, forward,
+                                                  profiles)):
+        if profile is None or start is None:
+            return None
+        deltas = np.frombuffer(profile, dtype='<f2').astype(np.float64)
+        if fwd:
+            part = start + deltas
+        else:
+            # start is the target elevation; deltas are relative to source
+            part = (start - deltas[-1] + deltas)[::-1]
+        # Consecutive edges share their joining point
+        parts.append(part if i == 0 else part[1:])
+    if not parts:
+        return None
+    return np.round(np.concatenate(parts), 1).tolist()
+
+
+@tracing.timed('pgr_dijkstra_via')
+def _route_via_rows(conn, sql: str, edges_sql: str, nodes: List[int]):
+    with conn.cursor() as cur:
+        cur.execute(sql, (edges_sql, nodes))
+        return cur.fetchone()
+
+
+def route_via(conn, edges_sql: str, nodes: List[int]):
+    """
+    Route through all nodes in order.
+    :param edges_sql: Edges query for pgr_dijkstraVia.
+    :param nodes: List of vertices.
+    :return: (GeoJSON LineString, length in meters, elevationData,
+        elevation profile or None).
+    """
+    if not config.get('edgeGeometryCache', True):
+        return _route_via_postgis(conn, edges_sql, nodes)
+
+    edges, length, lengths, forward, elevations, profiles = \
+        _route_via_rows(conn, ROUTE_VIA_EDGES_SQL, edges_sql, nodes)
+    if edges is None:
+        raise ValueError('No route through the requested points')
+    geometries = edge_geometry.edge_geometries(conn)
+    try:
+        coords = geometries.path(edges, forward)
+    except KeyError:
+        # Edges added since the cache was loaded
+        return _route_via_postgis(conn, edges_sql, nodes)
+    segments = geometries.segments(geometries.index(edges))
+    return (edge_geometry.geojson(coords), length,
+            elevation_data(lengths, elevations, segments),
+            elevation_profile(elevations, forward, profiles))
+
+
+def _route_via_postgis(conn, edges_sql: str, nodes: List[int]):
+    geojson, length, lengths, segments, forward, elevations, profiles = \
+        _route_via_rows(conn, ROUTE_VIA_SQL, edges_sql, nodes)
+    if geojson is None:
+        raise ValueError('No route through the requested points')
+    return (geojson, length, elevation_data(lengths, elevations, segments),
+            elevation_profile(elevations, forward, profiles))
+
+
+@tracing.timed('path_edges')
+def route_from_edges(conn, edges: Sequence[int], forward: Sequence[bool]):
+    """
+    Assemble a route whose edges are already known.
+    :param edges: Edge gids in travel order.
+    :param forward: Whether each edge is travelled source -> target.
+    :return: Same as route_via.
+    """
+    edges = [int(e) for e in edges]
+    forward = [bool(f) for f in forward]
+    if not edges:
+        raise ValueError('No route between origin and destination')
+    use_cache = config.get('edgeGeometryCache', True)
+    if use_cache:
+        geometries = edge_geometry.edge_geometries(conn)
+        try:
+            coords = geometries.path(edges, forward)
+        except KeyError:
+            use_cache = False
+    with conn.cursor() as cur:
+        cur.execute(PATH_EDGES_SQL.format(
+            geometry='' if use_cache else PATH_GEOMETRY_SQL), (edges, forward))
+        row = cur.fetchone()
+    if use_cache:
+        length, lengths, elevations, profiles = row
+        text = edge_geometry.geojson(coords)
+        segments = geometries.segments(geometries.index(edges))
+    else:
+        text, segments, length, lengths, elevations, profiles = row
+    return (text, length, elevation_data(lengths, elevations, segments),
+            elevation_profile(elevations, forward, profiles))
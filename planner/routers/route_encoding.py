@@ -0,0 +1,99 @@
+"""
+Serialize PlanRoute replies.
+
+RouteEncoder turns each RouteResult into a dict, which means parsing the
+route's GeoJSON just so the encoder can write it out again. encode_reply
+writes the same JSON without that: the GeoJSON text is spliced in as is and
+packed ElevationData is formatted straight from its arrays.
+
+With the stdlib backend the output is byte for byte what
+RouteEncoder().encode(reply) gives whenever the GeoJSON is laid out the way
+json.dumps lays it out (as edge_geometry.geojson does). The "jsonBackend"
+config option picks the backend: "stdlib" (the default), "orjson", or
+"auto", which uses orjson if it's installed. orjson writes compact JSON
+(no spaces after separators), so the bytes differ but the parsed result is
+the same.
+"""
+import logging
+from typing import *
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from config import config
+from routers.base_router import ElevationData, RouteEncoder, RouteResult
+
+logger = logging.getLogger(__name__)
+
+_route_encoder = RouteEncoder()
+
+
+def _orjson_default(o):
+    return _route_encoder.default(o)
+
+
+class _Writer:
+    def __init__(self, dumps: Callable[[Any], str],
+                 separators: Tuple[str, str]):
+        self.dumps = dumps
+        self.item_sep, self.key_sep = separators
+
+    def encode(self, o) -> str:
+        # Only containers of routes need walking; anything else goes to
+        # the backend in one call
+        if isinstance(o, RouteResult):
+            return self.route(o)
+        if isinstance(o, dict):
+            return '{' + self.item_sep.join(
+                self.dumps(str(k)) + self.key_sep + self.encode(v)
+                for k, v in o.items()) + '}'
+        if isinstance(o, (list, tuple)) \
+                and any(isinstance(v, RouteResult) for v in o):
+            return '[' + self.item_sep.join(self.encode(v) for v in o) + ']'
+        if isinstance(o, ElevationData):
+            return o.json((self.item_sep, self.key_sep))
+        return self.dumps(o)
+
+    def route(self, o: RouteResult) -> str:
+        fields = [
+            ('geojson', o.geojson),
+            ('score', self.dumps(o.score)),
+            ('length', self.dumps(o.length)),
+            ('elevationData', self.encode(o.elevationData)),
+            ('pois', self.dumps(o.pois)),
+        ]
+        if o.elevationProfile is not None:
+            fields.append(('elevationProfile',
+                           self.dumps(o.elevationProfile)))
+        return '{' + self.item_sep.join(
+            '"' + k + '"' + self.key_sep + v for k, v in fields) + '}'
+
+
+WRITERS = {'stdlib': _Writer(_route_encoder.encode, (', ', ': '))}
+if orjson is not None:
+    WRITERS['orjson'] = _Writer(
+        lambda o: orjson.dumps(o, default=_orjson_default).decode(),
+        (',', ':'))
+
+
+def _default_backend() -> str:
+    name = config.get('jsonBackend', 'stdlib')
+    if name == 'auto':
+        return 'orjson' if 'orjson' in WRITERS else 'stdlib'
+    if name not in WRITERS:
+        logger.warning('JSON backend %r is not available, using stdlib', name)
+        return 'stdlib'
+    return name
+
+
+DEFAULT_BACKEND = _default_backend()
+
+
+def encode_reply(reply: Dict[str, Any], backend: Optional[str] = None) -> str:
+    """
+    JSON text of a PlanRoute reply.
+    :param backend: Key of WRITERS, or None for the configured backend.
+    """
+    return WRITERS[backend or DEFAULT_BACKEND].encode(reply)
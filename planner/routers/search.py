@@ -0,0 +1,274 @@
+"""
+Dijkstra core for Graph searches.
+
+Searches run on integer costs, Graph costs quantized to COST_RESOLUTION, so
+they can use monotone integer priority queues instead of a heap of float
+tuples:
+  - 'heapq': binary heap of (cost, vertex) tuples. Its push and pop run in
+    C, which under CPython outweighs the better bounds of the others (see
+    benchmarks/bench_search_queues.py)
+  - 'radix': radix heap; a vertex sits in the bucket of the highest bit
+    where its cost differs from the last popped cost, and a bucket is only
+    redistributed when everything below it is empty
+  - 'bucket': Dial's bucket queue, a circular array of max arc cost + 1
+    buckets scanned in cost order. Falls back to 'radix' when arcs are too
+    long for a reasonable number of buckets.
+
+Per-vertex state lives in preallocated per-thread Scratch lists that are
+never cleared: each search takes a new generation number, and an entry
+only counts if its stamp matches the current generation.
+"""
+import functools
+import heapq
+import threading
+from typing import *
+
+import numpy as np
+
+# Meters (or cost units) per integer cost step
+COST_RESOLUTION = 0.1
+
+QUEUES = ('heapq', 'radix', 'bucket')
+
+# Above this many buckets the bucket queue costs more to scan than it saves
+MAX_BUCKETS = 1 << 16
+
+
+def quantize(costs: np.ndarray) -> np.ndarray:
+    """Integer costs in COST_RESOLUTION steps."""
+    return np.rint(np.asarray(costs, dtype=np.float64)
+                   / COST_RESOLUTION).astype(np.int64)
+
+
+class HeapQueue:
+    def __init__(self):
+        self.heap = []
+        # Bound C functions, no Python frame per push or pop
+        self.push = functools.partial(heapq.heappush, self.heap)
+        self.pop = functools.partial(heapq.heappop, self.heap)
+
+    def reset(self):
+        self.heap.clear()
+
+    def __len__(self):
+        return len(self.heap)
+
+
+class RadixHeap:
+    """Monotone queue: costs pushed must be >= the last cost popped."""
+
+    def __init__(self):
+        self.last = 0
+        self.size = 0
+        self.buckets = [[] for _ in range(65)]
+
+    def reset(self):
+        if self.size:
+            for bucket in self.buckets:
+                bucket.clear()
+        self.last = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, entry: Tuple[int, int]):
+        self.buckets[(entry[0] ^ self.last).bit_length()].append(entry)
+        self.size += 1
+
+    def pop(self) -> Tuple[int, int]:
+        if not self.size:
+            raise IndexError('pop from empty queue')
+        buckets = self.buckets
+        if not buckets[0]:
+            i = 1
+            while not buckets[i]:
+                i += 1
+            bucket = buckets[i]
+            last = self.last = min(bucket)[0]
+            # Every entry lands in a lower bucket, at least one in bucket 0
+            for entry in bucket:
+                buckets[(entry[0] ^ last).bit_length()].append(entry)
+            bucket.clear()
+        self.size -= 1
+        return buckets[0].pop()
+
+
+class BucketQueue:
+    """
+    Monotone queue for costs within span - 1 of the last cost popped:
+    bucket cost % span only ever holds one cost.
+    """
+
+    def __init__(self, span: int):
+        self.span = span
+        self.buckets = [[] for _ in range(span)]
+        self.cursor = 0
+        self.size = 0
+
+    def reset(self):
+        for bucket in self.buckets:
+            if not self.size:
+                break
+            self.size -= len(bucket)
+            bucket.clear()
+        self.cursor = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def push(self, entry: Tuple[int, int]):
+        self.buckets[entry[0] % self.span].append(entry[1])
+        self.size += 1
+
+    def pop(self) -> Tuple[int, int]:
+        if not self.size:
+            raise IndexError('pop from empty queue')
+        cursor = self.cursor
+        buckets, span = self.buckets, self.span
+        while not buckets[cursor % span]:
+            cursor += 1
+        self.cursor = cursor
+        self.size -= 1
+        return cursor, buckets[cursor % span].pop()
+
+
+class Scratch:
+    """Per-vertex search state, reused by every search on one thread."""
+
+    def __init__(self, n: int):
+        self.generation = 0
+        self.stamp = [0] * n
+        self.done = [0] * n
+        self.dist = [0] * n
+        self.length = [0.0] * n
+        self.pred = [-1] * n
+        self.heap = HeapQueue()
+        self.radix = RadixHeap()
+        self.buckets = {}  # span -> BucketQueue
+
+    def __len__(self):
+        return len(self.stamp)
+
+    def queue(self, name: str, max_cost: int):
+        if name == 'bucket' and max_cost < MAX_BUCKETS:
+            span = max_cost + 1
+            if span not in self.buckets:
+                self.buckets[span] = BucketQueue(span)
+            queue = self.buckets[span]
+        elif name in ('radix', 'bucket'):
+            queue = self.radix
+        elif name == 'heapq':
+            queue = self.heap
+        else:
+            raise ValueError('Unknown search queue {!r}, expected one of {}'
+                             .format(name, ', '.join(QUEUES)))
+        queue.reset()
+        return queue
+
+
+class ArrayScratch:
+    """
+    Scratch for the compiled kernels in accel.py: the same state in NumPy
+    arrays, plus a binary heap with room for every arc and a buffer for the
+    vertices reached.
+    """
+
+    def __init__(self, n: int, m: int):
+        self.generation = 0
+        self.stamp = np.zeros(n, dtype=np.int64)
+        self.done = np.zeros(n, dtype=np.int64)
+        self.dist = np.zeros(n, dtype=np.int64)
+        self.length = np.zeros(n, dtype=np.float64)
+        self.pred = np.full(n, -1, dtype=np.int64)
+        self.reached = np.zeros(n, dtype=np.int64)
+        self.heap_keys = np.zeros(m + 1, dtype=np.int64)
+        self.heap_values = np.zeros(m + 1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.stamp)
+
+    def kernel_args(self) -> tuple:
+        """The state arguments of accel.dijkstra, generation first."""
+        return (self.generation, self.stamp, self.done, self.dist,
+                self.length, self.pred, self.heap_keys, self.heap_values,
+                self.reached)
+
+
+_local = threading.local()
+
+
+def scratch(n: int) -> Scratch:
+    """This thread's Scratch, grown to at least n vertices."""
+    current = getattr(_local, 'scratch', None)
+    if current is None or len(current) < n:
+        current = _local.scratch = Scratch(n)
+    return current
+
+
+def array_scratch(n: int, m: int) -> ArrayScratch:
+    """This thread's ArrayScratch, grown to at least n vertices, m arcs."""
+    current = getattr(_local, 'array_scratch', None)
+    if current is None or len(current) < n \
+            or len(current.heap_keys) < m + 1:
+        current = _local.array_scratch = ArrayScratch(n, m)
+    return current
+
+
+def dijkstra(state: Scratch, indptr: List[int], arcs: List[int],
+             ends: List[int], costs: List[int], lengths: List[float],
+             max_cost: int, root: int, target: int = -1,
+             max_length: float = float('inf'), queue: str = 'heapq'
+             ) -> List[int]:
+    """
+    Settle vertices from root in cost order until target is settled or
+    nothing is left. Results are in state for the new state.generation.
+    :param indptr, arcs, ends: Adjacency: the arcs of vertex v are
+        arcs[indptr[v]:indptr[v + 1]], leading to ends[arc].
+    :param costs: Integer cost of each arc, max_cost at most.
+    :param lengths: Length of each arc; paths longer than max_length are
+        not followed.
+    :return: Every vertex reached, root first.
+    """
+    state.generation += 1
+    generation = state.generation
+    stamp, done = state.stamp, state.done
+    dist, length, pred = state.dist, state.length, state.pred
+    pending = state.queue(queue, max_cost)
+    push, pop = pending.push, pending.pop
+
+    stamp[root] = generation
+    dist[root] = 0
+    length[root] = 0.0
+    pred[root] = -1
+    reached = [root]
+    push((0, root))
+    while True:
+        # Cheaper than asking the queue for its length every time
+        try:
+            d, v = pop()
+        except IndexError:
+            break
+        if done[v] == generation:
+            continue
+        done[v] = generation
+        if v == target:
+            break
+        lv = length[v]
+        for arc in arcs[indptr[v]:indptr[v + 1]]:
+            nl = lv + lengths[arc]
+            if nl > max_length:
+                continue
+            w = ends[arc]
+            nd = d + costs[arc]
+            if stamp[w] != generation:
+                stamp[w] = generation
+                reached.append(w)
+            elif nd >= dist[w]:
+                continue
+            dist[w] = nd
+            length[w] = nl
+            pred[w] = arc
+            push((nd, w))
+    return reached
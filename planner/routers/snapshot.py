@@ -0,0 +1,236 @@
+"""
+Versioned, hot-swappable snapshots of the in-memory network data.
+
+Everything the planner keeps in memory about the network (EdgeAttributes,
+VertexComponents, EdgeGeometries, POI distance tables, graphs built from
+them) belongs to a Snapshot. Modules register a loader for their value and
+read it with value(); it is loaded into the current snapshot on first use.
+
+reload() builds a new snapshot and swaps it in, read-copy-update style:
+  - A PlanRoute call pins the snapshot that is current when it starts
+    (pinned()), and every value() in that thread comes from it, so a
+    request never mixes versions. In-flight requests finish on the old
+    snapshot, which is freed once the last of them lets go of it.
+  - If the structure of the network (ways, vertices, elevation) hasn't
+    changed, only the registered deltas run (e.g. greenery and popularity
+    from ways_metadata). Values without a delta are shared with the old
+    snapshot, and nothing is swapped if no delta found a change.
+  - Otherwise every value the old snapshot had loaded is loaded again
+    before the swap, so new requests don't pay for it.
+Caches of derived objects (cached()) live on the snapshot, so they are
+dropped along with it.
+
+Each region (see regions.py) has its own line of snapshots; code that runs
+outside a pinned() block, like the put_*.py scripts, sees DEFAULT_REGION.
+"""
+import collections
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import *
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Cheap fingerprint of everything but ways_metadata. Renumbered, added or
+# removed edges and vertices, or new elevation data, change it. Floats are
+# summed as numeric: float sums depend on the (parallel) summation order, so
+# they could differ between runs over the same rows.
+SIGNATURE_SQL = '''
+    SELECT (SELECT ROW(count(*), sum(gid), sum(source), sum(target),
+                       sum(length_m::numeric),
+                       sum(reverse_cost::numeric))::text FROM ways),
+           (SELECT ROW(count(*), sum(id))::text FROM ways_vertices_pgr),
+           (SELECT ROW(count(*), sum(climb::numeric),
+                       sum(reverse_climb::numeric))::text
+            FROM ways_elevation)
+    '''
+
+_MISSING = object()
+
+
+class Snapshot:
+    def __init__(self, version: int, signature: Optional[tuple] = None,
+                 values: Optional[Dict[str, Any]] = None):
+        """
+        :param signature: network_signature() of the data, None if unknown.
+        :param values: Already loaded values, by loader name.
+        """
+        self.version = version
+        self.signature = signature
+        self.created = time.time()
+        self._values = dict(values or {})
+        self._caches = {}  # name -> OrderedDict, most recently used last
+        self._lock = threading.Lock()
+        self._load_locks = collections.defaultdict(threading.Lock)
+
+    def get(self, name: str, load: Callable[[Any], Any], conn) -> Any:
+        """The value of name, loaded with load(conn) on first use."""
+        value = self._values.get(name, _MISSING)
+        if value is not _MISSING:
+            metrics.cache_hit(name)
+            return value
+        with self._lock:
+            load_lock = self._load_locks[name]
+        # One lock per value, so a slow load doesn't hold up the others
+        with load_lock:
+            if name not in self._values:
+                metrics.cache_miss(name)
+                self._values[name] = load(conn)
+            return self._values[name]
+
+    def loaded(self) -> Dict[str, Any]:
+        """The values loaded so far, by name."""
+        with self._lock:
+            return dict(self._values)
+
+    def cached(self, name: str, key: Hashable, build: Callable[[], Any],
+               maxsize: int) -> Any:
+        """
+        build() for key, remembered in this snapshot's LRU cache name of at
+        most maxsize entries. Two threads missing at once may both build.
+        """
+        with self._lock:
+            cache = self._caches.setdefault(name, collections.OrderedDict())
+            value = cache.get(key, _MISSING)
+            if value is not _MISSING:
+                cache.move_to_end(key)
+        if value is not _MISSING:
+            metrics.cache_hit(name)
+            return value
+        metrics.cache_miss(name)
+        value = build()
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > maxsize:
+                cache.popitem(last=False)
+        return value
+
+
+class _Loader(NamedTuple):
+    load: Callable[[Any], Any]
+    delta: Optional[Callable[[Any, Any], Any]]
+
+
+_loaders = collections.OrderedDict()  # name -> _Loader
+_current = {}  # region -> latest Snapshot
+_lock = threading.Lock()
+_reload_locks = collections.defaultdict(threading.Lock)  # region -> Lock
+_local = threading.local()
+
+DEFAULT_REGION = 'default'
+
+
+def register(name: str, load: Callable[[Any], Any],
+             delta: Optional[Callable[[Any, Any], Any]] = None):
+    """
+    Register a snapshot value.
+    :param load: load(conn) -> the value, from scratch.
+    :param delta: delta(old_value, conn) -> the value updated for changes
+        that leave the network structure alone, or None if it is unchanged.
+        Without one the value is kept as is on such reloads.
+    """
+    _loaders[name] = _Loader(load, delta)
+
+
+def latest(region: str = DEFAULT_REGION) -> Snapshot:
+    """The newest snapshot of region."""
+    with _lock:
+        snapshot = _current.get(region)
+        if snapshot is None:
+            snapshot = _current[region] = Snapshot(1)
+            metrics.snapshot_version.set(1, region=region)
+        return snapshot
+
+
+def current() -> Snapshot:
+    """
+    The snapshot pinned by this thread, or else the latest one of the
+    default region.
+    """
+    pinned = getattr(_local, 'snapshot', None)
+    return pinned if pinned is not None else latest()
+
+
+def value(name: str, conn) -> Any:
+    """The registered value name from current(), loaded if need be."""
+    return current().get(name, _loaders[name].load, conn)
+
+
+@contextmanager
+def pinned(region: str = DEFAULT_REGION):
+    """Keep this thread on the latest snapshot of region for the block."""
+    previous = getattr(_local, 'snapshot', None)
+    snapshot = _local.snapshot = latest(region)
+    try:
+        yield snapshot
+    finally:
+        _local.snapshot = previous
+
+
+def drop(region: str):
+    """
+    Forget everything loaded for region; it is loaded again on next use.
+    Requests that pinned the old snapshot keep it.
+    """
+    with _lock:
+        old = _current.get(region)
+        if old is not None:
+            _current[region] = Snapshot(old.version + 1)
+            metrics.snapshot_version.set(old.version + 1, region=region)
+
+
+def network_signature(conn) -> tuple:
+    with conn.cursor() as cur:
+        cur.execute(SIGNATURE_SQL)
+        return tuple(cur.fetchone())
+
+
+def reload(conn, region: str = DEFAULT_REGION) -> Snapshot:
+    """
+    Load a new snapshot of region from the DB conn is connected to and make
+    it the latest, unless nothing changed. Runs in the calling thread;
+    requests keep being served from the old snapshot meanwhile. Concurrent
+    calls for a region run one after the other.
+    :return: The latest snapshot afterwards.
+    """
+    with _lock:
+        reload_lock = _reload_locks[region]
+    with reload_lock:
+        start = time.perf_counter()
+        old = latest(region)
+        signature = network_signature(conn)
+        values = old.loaded()
+        # Before anything is loaded there is nothing to reload, only the
+        # signature to record
+        if signature == old.signature or (old.signature is None
+                                          and not values):
+            kind = 'unchanged'
+            for name, loader in _loaders.items():
+                if name in values and loader.delta is not None:
+                    updated = loader.delta(values[name], conn)
+                    if updated is not None:
+                        values[name] = updated
+                        kind = 'metadata'
+        else:
+            kind = 'full'
+            values = {name: _loaders[name].load(conn)
+                      for name in _loaders if name in values}
+
+        metrics.snapshot_reloads_total.inc(region=region, kind=kind)
+        if kind == 'unchanged':
+            old.signature = signature
+            logger.info('Snapshot %s/%d is up to date', region, old.version)
+            return old
+        new = Snapshot(old.version + 1, signature, values)
+        with _lock:
+            _current[region] = new
+        metrics.snapshot_version.set(new.version, region=region)
+        logger.info('Snapshot %s/%d -> %d (%s reload of %s) in %.1f s',
+                    region, old.version, new.version, kind,
+                    ', '.join(values) or 'nothing',
+                    time.perf_counter() - start)
+        return new
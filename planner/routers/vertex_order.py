@@ -0,0 +1,183 @@
+"""
+Cache-friendly vertex order for the in-memory graph.
+
+pgRouting vertex ids (and OSM ids) say nothing about where a vertex is, so
+numbering graph vertices by id scatters neighbouring vertices all over the
+search arrays. Ordering them along a space-filling curve (or breadth first)
+puts vertices that are close on the map close in memory, so a search
+touches far fewer cache lines.
+
+VertexTable holds every vertex's pgRouting id, osm_id and position, in the
+chosen order; edge_costs.edge_attributes applies the "vertexOrder" config
+option ('hilbert' by default, or 'morton', 'bfs', 'id') when it loads the
+network, and Graph numbers vertices in that order.
+"""
+import collections
+from typing import *
+
+import numpy as np
+
+ORDERS = ('id', 'hilbert', 'morton', 'bfs')
+DEFAULT_ORDER = 'hilbert'
+
+# Bits per axis of the curve grid
+CURVE_BITS = 16
+
+
+def _grid(lon: np.ndarray, lat: np.ndarray, bits: int
+          ) -> Tuple[np.ndarray, np.ndarray]:
+    """Coordinates scaled to integers in [0, 2^bits) over their bbox."""
+    side = (1 << bits) - 1
+
+    def scale(v):
+        v = np.asarray(v, dtype=np.float64)
+        if len(v) == 0:
+            return v.astype(np.int64)
+        span = v.max() - v.min()
+        if span == 0:
+            return np.zeros(len(v), dtype=np.int64)
+        return np.rint((v - v.min()) / span * side).astype(np.int64)
+
+    return scale(lon), scale(lat)
+
+
+def hilbert_key(lon: np.ndarray, lat: np.ndarray,
+                bits: int = CURVE_BITS) -> np.ndarray:
+    """Position of each point along a Hilbert curve over their bbox."""
+    x, y = _grid(lon, lat, bits)
+    n = 1 << bits
+    key = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = ((x & s) > 0).astype(np.int64)
+        ry = ((y & s) > 0).astype(np.int64)
+        key += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant so the curve's sub-squares line up
+        flip = (ry == 0) & (rx == 1)
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ry == 0
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+    return key
+
+
+def morton_key(lon: np.ndarray, lat: np.ndarray,
+               bits: int = CURVE_BITS) -> np.ndarray:
+    """Position of each point along a Z-order (Morton) curve."""
+    x, y = _grid(lon, lat, bits)
+    key = np.zeros(len(x), dtype=np.int64)
+    for bit in range(bits):
+        key |= ((x >> bit) & 1) << (2 * bit)
+        key |= ((y >> bit) & 1) << (2 * bit + 1)
+    return key
+
+
+def bfs_order(n: int, source: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """
+    Vertex indices 0..n-1 in breadth-first order over the edges
+    (source, target) (indices, both directions), one component after
+    another.
+    """
+    ends = np.concatenate([source, target])
+    neighbours = np.concatenate([target, source])
+    order = np.argsort(ends, kind='mergesort')
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ends, minlength=n), out=indptr[1:])
+    indptr = indptr.tolist()
+    neighbours = neighbours[order].tolist()
+
+    seen = [False] * n
+    result = []
+    queue = collections.deque()
+    for start in range(n):
+        if seen[start]:
+            continue
+        seen[start] = True
+        queue.append(start)
+        while queue:
+            v = queue.popleft()
+            result.append(v)
+            for w in neighbours[indptr[v]:indptr[v + 1]]:
+                if not seen[w]:
+                    seen[w] = True
+                    queue.append(w)
+    return np.array(result, dtype=np.int64)
+
+
+class VertexTable:
+    SQL = '''
+        SELECT id, osm_id, lon, lat
+        FROM ways_vertices_pgr
+        ORDER BY id
+        '''
+
+    def __init__(self, ids, osm_ids, lon, lat):
+        """Per-vertex arrays, in the order the graph should number them."""
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.osm_ids = np.asarray(osm_ids, dtype=np.int64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self._sorter = np.argsort(self.ids, kind='mergesort')
+
+    @classmethod
+    def from_db(cls, conn) -> 'VertexTable':
+        with conn.cursor() as cur:
+            cur.execute(cls.SQL)
+            rows = cur.fetchall()
+        columns = np.array(rows, dtype=np.float64).reshape(-1, 4).T
+        return cls(*columns)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, vertex_ids) -> np.ndarray:
+        """Row of each pgRouting vertex id, -1 if it isn't in the table."""
+        vertex_ids = np.asarray(vertex_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.full(len(vertex_ids), -1, dtype=np.int64)
+        sorted_ids = self.ids[self._sorter]
+        i = np.minimum(np.searchsorted(sorted_ids, vertex_ids),
+                       len(self.ids) - 1)
+        return np.where(sorted_ids[i] == vertex_ids, self._sorter[i], -1)
+
+    def osm_id(self, vertex_ids) -> np.ndarray:
+        """osm_id of each pgRouting vertex id (which must be present)."""
+        return self.osm_ids[self.position(vertex_ids)]
+
+    def take(self, rows: np.ndarray) -> 'VertexTable':
+        return VertexTable(self.ids[rows], self.osm_ids[rows], self.lon[rows],
+                           self.lat[rows])
+
+    def ordered(self, method: str, source: Optional[np.ndarray] = None,
+                target: Optional[np.ndarray] = None) -> 'VertexTable':
+        """
+        The table reordered by method, one of ORDERS.
+        :param source, target: Edge endpoints (pgRouting ids), for 'bfs'.
+        """
+        if method == 'id':
+            rows = self._sorter
+        elif method == 'hilbert':
+            rows = np.argsort(hilbert_key(self.lon, self.lat),
+                              kind='mergesort')
+        elif method == 'morton':
+            rows = np.argsort(morton_key(self.lon, self.lat), kind='mergesort')
+        elif method == 'bfs':
+            # Edges to vertices missing from the table can't be followed
+            u, v = self.position(source), self.position(target)
+            keep = (u >= 0) & (v >= 0)
+            rows = bfs_order(len(self), u[keep], v[keep])
+        else:
+            raise ValueError('Unknown vertex order {!r}, expected one of {}'
+                             .format(method, ', '.join(ORDERS)))
+        return self.take(rows)
+
+
+def arc_span(graph) -> float:
+    """
+    Mean distance between the indices of an arc's ends: how far apart in
+    memory a search's neighbouring reads land. Lower is better.
+    """
+    if len(graph.heads) == 0:
+        return 0.0
+    return float(np.abs(graph.heads - graph.tails).mean())
@@ -1,72 +1,215 @@
 import logging
 from concurrent import futures
+import signal
+import threading
 import time
 import json
 import grpc
+from psycopg2.extensions import QueryCanceledError
 
 import planner_pb2
 import planner_pb2_grpc
 
-from db_conn import connPool
-from routers.base_router import RouteEncoder
+from config import config
+from regions import RegionNotServed, RegionRegistry
+from routers.alternatives import MAX_ROUTES
+from routers.route_encoding import encode_reply
 from routers.orienteering_router import OrienteeringRouter
 from routers.point2point_router import Point2PointRouter
 from routers.dist_edge_prefs_router import DistEdgePrefsRouter
 from routers.pois_on_way_router import POIsOnWayRouter
+from routers import snapshot
+from utils import metrics
+from utils.admission import AdmissionController, AdmissionRejected
+from utils import profiling
+from utils import tracing
 
 _ONE_DAY_IN_SECONDS = 60 * 60 * 24
 
 logger = logging.getLogger(__name__)
 
+# Toggled at runtime with SIGUSR1; SIGUSR2 writes the samples collected so far
+profiler = profiling.SamplingProfiler(
+    sample_rate=config.get('profileSampleRate', 0.01),
+    interval=config.get('profileIntervalMs', 5) / 1000,
+    output_dir=config.get('profileDir', 'profiles'))
+
+# Orienteering runs many-to-many Dijkstra plus the randomized search, so it
+# gets far fewer slots than point-to-point. The defaults add up to the default
+# DB pool size.
+admission = AdmissionController(
+    limits=config.get('concurrencyLimits', {
+        'Point2PointRouter': 4,
+        'POIsOnWayRouter': 2,
+        'DistEdgePrefsRouter': 2,
+        'OrienteeringRouter': 2,
+    }),
+    queue_limits=config.get('queueLimits', {}))
+
+ROUTER_CLASSES = (Point2PointRouter, POIsOnWayRouter, DistEdgePrefsRouter,
+                  OrienteeringRouter)
+
+# Which database serves a request, and whether this process serves it at
+# all. Each region's pool fits every request admission lets run at once.
+regions = RegionRegistry.from_config(
+    config, admission.concurrency(r.__name__ for r in ROUTER_CLASSES))
+
+
+def select_router(req) -> type:
+    """Pick the router class that handles a PlanRoute request."""
+    has_pois = 'poi_prefs' in req and req['poi_prefs'] != {}
+    if 'desired_dist' not in req:
+        # If POIs not provided
+        return POIsOnWayRouter if has_pois else Point2PointRouter
+    return OrienteeringRouter if has_pois else DistEdgePrefsRouter
+
 
 class RoutePlanner(planner_pb2_grpc.RoutePlannerServicer):
 
+    @staticmethod
+    def _make_routes(pool, region, router_class, state, state_lock, origin,
+                     dest, num_routes, req):
+        """Run the router on a connection to region's database."""
+        with tracing.stage('pool_wait'):
+            wait_start = time.perf_counter()
+            conn = pool.getconn()
+            metrics.pool_wait_seconds.observe(time.perf_counter() - wait_start)
+        with state_lock:
+            state['conn'] = conn
+        try:
+            # The whole request sees one version of the region's network,
+            # even if a reload swaps in a new one
+            with conn, snapshot.pinned(region.name):
+                router = router_class(conn)
+                if num_routes is None:
+                    return router.make_route(origin, dest, **req)
+                return router.make_routes(origin, dest, num_routes, **req)
+        finally:
+            with state_lock:
+                state['conn'] = None
+            pool.putconn(conn)
+
     def PlanRoute(self, jsonrequest, context):
         req = json.loads(jsonrequest.jsonData)
         logger.info('Received PlanRoute() call. Data: %s', req)
-
-        try:
-            # Convert origin and dest to tuples
-            origin = req.pop('origin')
-            origin = (origin['latitude'], origin['longitude'])
-            dest = req.pop('dest')
-            dest = (dest['latitude'], dest['longitude'])
-
-            # Make routes
-            conn = connPool.getconn()
+        # Clients can ask for the per-stage timing breakdown in the reply
+        debug_timings = req.pop('debug_timings', False)
+        # Without num_routes the reply keeps its single-route shape
+        num_routes = req.pop('num_routes', None)
+        router_class = select_router(req)
+        status = 'OK'
+
+        # When the RPC terminates early (client cancelled, deadline passed),
+        # abort whatever query the request is running so the work stops.
+        state = {'conn': None, 'done': False}
+        state_lock = threading.Lock()
+
+        def on_rpc_done():
+            with state_lock:
+                if not state['done'] and state['conn'] is not None:
+                    logger.info('PlanRoute() cancelled, cancelling DB query')
+                    state['conn'].cancel()
+
+        context.add_callback(on_rpc_done)
+        gate = admission.gate(router_class.__name__)
+
+        with tracing.trace(router_class.__name__) as t, \
+                profiler.sample(router_class.__name__):
             try:
-                with conn:
-                    if 'desired_dist' not in req:
-                        # If POIs not provided
-                        if 'poi_prefs' not in req or req['poi_prefs'] == {}:
-                            router = Point2PointRouter(conn)
-                        else:
-                            router = POIsOnWayRouter(conn)
-                    else:
-                        if 'poi_prefs' not in req or req['poi_prefs'] == {}:
-                            router = DistEdgePrefsRouter(conn)
-                        else:
-                            router = OrienteeringRouter(conn)
-
-                    routes = router.make_route(origin, dest, **req)
-            finally:
-                connPool.putconn(conn)
-
-            # jsonData is not the JS object, but its string
-            jsonData = RouteEncoder().encode({'routes': routes})
+                if num_routes is not None and not (
+                        type(num_routes) is int
+                        and 1 <= num_routes <= MAX_ROUTES):
+                    raise ValueError('num_routes must be an integer from 1 '
+                                     'to {}'.format(MAX_ROUTES))
+
+                # Convert origin and dest to tuples
+                origin = req.pop('origin')
+                origin = (origin['latitude'], origin['longitude'])
+                dest = req.pop('dest')
+                dest = (dest['latitude'], dest['longitude'])
+                region = regions.route(origin, dest)
+
+                with tracing.stage('queue_wait'):
+                    slot = gate.acquire(context.time_remaining(),
+                                        lambda: not context.is_active())
+                try:
+                    with regions.pool(region) as pool:
+                        routes = self._make_routes(
+                            pool, region, router_class, state, state_lock,
+                            origin, dest, num_routes, req)
+                finally:
+                    gate.release(slot)
+
+                # jsonData is not the JS object, but its string
+                reply = {'routes': routes}
+                with tracing.stage('encode'):
+                    if debug_timings:
+                        # Encoding itself is left out of the reported numbers
+                        reply['timings'] = t.breakdown()
+                    jsonData = encode_reply(reply)
+
+                return planner_pb2.JsonReply(jsonData=jsonData)
+
+            except ValueError as e:
+                status = 'INVALID_ARGUMENT'
+                context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+                context.set_details(str(e))
+                return planner_pb2.JsonReply()
+
+            except RegionNotServed as e:
+                # Tell the caller where to send it instead
+                status = 'FAILED_PRECONDITION'
+                context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+                context.set_details(str(e))
+                context.set_trailing_metadata((('region-owner', e.owner),))
+                return planner_pb2.JsonReply()
+
+            except AdmissionRejected as e:
+                status = 'RESOURCE_EXHAUSTED'
+                context.set_code(grpc.StatusCode.RESOURCE_EXHAUSTED)
+                context.set_details(str(e))
+                return planner_pb2.JsonReply()
+
+            except QueryCanceledError:
+                status = 'CANCELLED'
+                context.set_code(grpc.StatusCode.CANCELLED)
+                context.set_details('Request cancelled')
+                return planner_pb2.JsonReply()
+
+            except Exception:
+                status = 'INTERNAL'
+                raise
 
-            return planner_pb2.JsonReply(jsonData=jsonData)
-
-        except ValueError as e:
-            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
-            context.set_details(str(e))
-            return planner_pb2.JsonReply()
+            finally:
+                with state_lock:
+                    state['done'] = True
+                metrics.requests_total.inc(router=t.router, status=status)
+                metrics.request_seconds.observe(t.elapsed, router=t.router)
+                logger.info('PlanRoute() %s %s in %.1f ms, stages: %s',
+                            t.router, status, t.elapsed * 1000,
+                            t.breakdown())
 
 
 def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    # Every admitted or queued request holds a worker thread; anything beyond
+    # that is turned away by gRPC with RESOURCE_EXHAUSTED instead of piling up
+    # invisibly in the executor.
+    capacity = admission.capacity(r.__name__ for r in ROUTER_CLASSES)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=capacity),
+                         maximum_concurrent_rpcs=capacity)
     planner_pb2_grpc.add_RoutePlannerServicer_to_server(RoutePlanner(), server)
     server.add_insecure_port('[::]:1235')
+    if config.get('metricsPort') is not None:
+        metrics.start_http_server(config['metricsPort'],
+                                  config.get('metricsHost', '127.0.0.1'))
+    signal.signal(signal.SIGUSR1, lambda signum, frame: profiler.toggle())
+    signal.signal(signal.SIGUSR2, lambda signum, frame: profiler.flush())
+    # SIGHUP reloads the open regions' network snapshots (see
+    # routers/snapshot.py) without a restart
+    signal.signal(signal.SIGHUP, lambda signum, frame:
+                  regions.reload_in_background())
+    if config.get('profileOnStart', False):
+        profiler.enable()
     logger.info('Starting server')
     server.start()
     try:
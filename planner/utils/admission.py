@@ -0,0 +1,162 @@
+"""
+Admission control for PlanRoute.
+
+Each router type gets an AdmissionGate with its own concurrency limit and a
+bounded queue, so a burst of expensive orienteering requests can't starve
+cheap point-to-point ones. Requests are rejected up front when the queue is
+full or when the estimated queueing plus service time would blow through the
+client's deadline, instead of being accepted and timing out after doing the
+work anyway.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import *
+
+from utils import metrics
+
+# How often a queued request wakes up to check whether its client went away
+_POLL_INTERVAL = 0.05
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted; the message says why."""
+
+
+class AdmissionGate:
+
+    def __init__(self, name: str, max_concurrent: int, max_queued: int,
+                 initial_service_time: float = 0.5, ewma_alpha: float = 0.2):
+        """
+        :param name: Router type, used in metrics and messages.
+        :param max_concurrent: Requests allowed to run at once.
+        :param max_queued: Requests allowed to wait for a slot.
+        :param initial_service_time: Seconds; service time estimate used
+            until real requests have completed.
+        :param ewma_alpha: Smoothing factor for the service time estimate.
+        """
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.service_time = initial_service_time
+        self.ewma_alpha = ewma_alpha
+        self.running = 0
+        self.queued = 0
+        self._cond = threading.Condition()
+
+    def estimated_wait(self) -> float:
+        """Seconds a request arriving now would wait for a slot."""
+        if self.running < self.max_concurrent:
+            return 0.0
+        # Each slot frees up every service_time on average
+        return (self.queued + 1) * self.service_time / self.max_concurrent
+
+    def acquire(self, time_remaining: Optional[float] = None,
+                cancelled: Callable[[], bool] = lambda: False) -> float:
+        """
+        Take a slot, queueing for one if necessary.
+        :param time_remaining: Seconds until the client's deadline, or None.
+        :param cancelled: Returns True once the client has gone away.
+        :return: Token to pass to release().
+        :raises AdmissionRejected: If the request can't be served in time.
+        """
+        enqueued = time.perf_counter()
+        with self._cond:
+            if self.running >= self.max_concurrent or self.queued:
+                self._wait_for_slot(time_remaining, cancelled)
+            self.running += 1
+            self._update_gauges()
+        start = time.perf_counter()
+        metrics.queue_wait_seconds.observe(start - enqueued, router=self.name)
+        return start
+
+    def release(self, token: float):
+        """Give back the slot taken by the acquire() that returned token."""
+        elapsed = time.perf_counter() - token
+        with self._cond:
+            self.running -= 1
+            self.service_time += self.ewma_alpha * (elapsed - self.service_time)
+            self._update_gauges()
+            self._cond.notify()
+
+    @contextmanager
+    def admit(self, time_remaining: Optional[float] = None,
+              cancelled: Callable[[], bool] = lambda: False):
+        """Hold a slot for the duration of the block; see acquire()."""
+        token = self.acquire(time_remaining, cancelled)
+        try:
+            yield
+        finally:
+            self.release(token)
+
+    def _wait_for_slot(self, time_remaining, cancelled):
+        """Queue until a slot is free. Must hold self._cond."""
+        if self.queued >= self.max_queued:
+            self._reject('queue_full', '{} queue is full ({} waiting)'.format(
+                self.name, self.queued))
+        if time_remaining is not None:
+            expected = self.estimated_wait() + self.service_time
+            if expected > time_remaining:
+                self._reject('deadline', (
+                    '{} is overloaded: expected completion in {:.2f}s '
+                    'exceeds the {:.2f}s deadline').format(
+                        self.name, expected, time_remaining))
+
+        deadline = None if time_remaining is None \
+            else time.monotonic() + time_remaining
+        self.queued += 1
+        self._update_gauges()
+        try:
+            while self.running >= self.max_concurrent:
+                timeout = _POLL_INTERVAL
+                if deadline is not None:
+                    timeout = min(timeout, deadline - time.monotonic())
+                    if timeout <= 0:
+                        self._reject('deadline', '{} deadline expired while '
+                                                 'queued'.format(self.name))
+                self._cond.wait(timeout)
+                if cancelled():
+                    self._reject('cancelled', 'Request cancelled while '
+                                              'queued')
+        finally:
+            self.queued -= 1
+            self._update_gauges()
+
+    def _reject(self, reason: str, message: str):
+        metrics.rejected_total.inc(router=self.name, reason=reason)
+        raise AdmissionRejected(message)
+
+    def _update_gauges(self):
+        metrics.running_requests.set(self.running, router=self.name)
+        metrics.queued_requests.set(self.queued, router=self.name)
+
+
+class AdmissionController:
+    """One AdmissionGate per router type."""
+
+    def __init__(self, limits: Dict[str, int], queue_limits: Dict[str, int],
+                 default_limit: int = 2, default_queue: int = 10):
+        self._limits = limits
+        self._queue_limits = queue_limits
+        self._default_limit = default_limit
+        self._default_queue = default_queue
+        self._gates = {}
+        self._lock = threading.Lock()
+
+    def gate(self, router: str) -> AdmissionGate:
+        with self._lock:
+            if router not in self._gates:
+                self._gates[router] = AdmissionGate(
+                    router,
+                    self._limits.get(router, self._default_limit),
+                    self._queue_limits.get(router, self._default_queue))
+            return self._gates[router]
+
+    def concurrency(self, routers: Iterable[str]) -> int:
+        """Requests of the given router types that can run at once."""
+        return sum(self.gate(r).max_concurrent for r in routers)
+
+    def capacity(self, routers: Iterable[str]) -> int:
+        """Running plus queued requests the given router types can hold."""
+        return sum(self.gate(r).max_concurrent + self.gate(r).max_queued
+                   for r in routers)
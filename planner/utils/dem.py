@@ -0,0 +1,213 @@
+"""
+Local digital elevation model (DEM) tiles.
+
+Reads a directory of elevation rasters and samples them with vectorized
+bilinear interpolation. Two formats are supported:
+
+- SRTM .hgt tiles (e.g. N34W119.hgt): 1x1 degree, big-endian int16 meters,
+  memory-mapped when opened.
+- GeoTIFF (.tif/.tiff), if rasterio is installed.
+
+All elevations are in meters; NaN marks points outside every tile or on
+void cells.
+"""
+import collections
+import glob
+import logging
+import math
+import os
+import re
+import threading
+from typing import *
+
+import numpy as np
+
+try:
+    import rasterio
+except ImportError:
+    rasterio = None
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+HGT_VOID = -32768
+_HGT_NAME = re.compile(r'^([NS])(\d{2})([EW])(\d{3})\.hgt$', re.IGNORECASE)
+
+
+class DemTile:
+    """A north-up raster whose pixel centers lie on a regular lat/lon grid."""
+
+    def __init__(self, data: np.ndarray, north: float, west: float,
+                 dlat: float, dlon: float, nodata: Optional[float] = None,
+                 name: str = ''):
+        """
+        :param data: 2D array of elevations, row 0 is the northernmost row.
+        :param north: Latitude of the center of row 0.
+        :param west: Longitude of the center of column 0.
+        :param dlat: Degrees between rows (positive).
+        :param dlon: Degrees between columns (positive).
+        :param nodata: Value marking void cells.
+        """
+        self.data = data
+        self.north = north
+        self.west = west
+        self.dlat = dlat
+        self.dlon = dlon
+        self.nodata = nodata
+        self.name = name
+
+    @property
+    def south(self) -> float:
+        return self.north - (self.data.shape[0] - 1) * self.dlat
+
+    @property
+    def east(self) -> float:
+        return self.west + (self.data.shape[1] - 1) * self.dlon
+
+    def contains(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        return (lats >= self.south) & (lats <= self.north) \
+            & (lons >= self.west) & (lons <= self.east)
+
+    def sample(self, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+        """
+        Bilinearly interpolated elevations; points must be inside. Only the
+        four cells around each point are read and converted to float, voids
+        to NaN.
+        """
+        nrows, ncols = self.data.shape
+        rows = (self.north - lats) / self.dlat
+        cols = (lons - self.west) / self.dlon
+        r0 = np.clip(np.floor(rows).astype(np.int64), 0, nrows - 2)
+        c0 = np.clip(np.floor(cols).astype(np.int64), 0, ncols - 2)
+        fr = rows - r0
+        fc = cols - c0
+
+        corners = np.stack([self.data[r0, c0], self.data[r0, c0 + 1],
+                            self.data[r0 + 1, c0], self.data[r0 + 1, c0 + 1]])
+        corners = corners.astype(np.float64)
+        if self.nodata is not None:
+            corners[corners == self.nodata] = np.nan
+        return (corners[0] * (1 - fc) + corners[1] * fc) * (1 - fr) \
+            + (corners[2] * (1 - fc) + corners[3] * fc) * fr
+
+    @classmethod
+    def from_hgt(cls, path: str) -> 'DemTile':
+        match = _HGT_NAME.match(os.path.basename(path))
+        if match is None:
+            raise ValueError('Not an SRTM tile name: {}'.format(path))
+        ns, lat, ew, lon = match.groups()
+        south = int(lat) * (1 if ns.upper() == 'N' else -1)
+        west = int(lon) * (1 if ew.upper() == 'E' else -1)
+        size = int(math.sqrt(os.path.getsize(path) // 2))
+        data = np.memmap(path, dtype='>i2', mode='r', shape=(size, size))
+        step = 1.0 / (size - 1)
+        return cls(data, south + 1, west, step, step, HGT_VOID,
+                   os.path.basename(path))
+
+    @classmethod
+    def from_geotiff(cls, path: str) -> 'DemTile':
+        if rasterio is None:
+            raise ImportError('rasterio is required to read GeoTIFF DEMs')
+        with rasterio.open(path) as src:
+            t = src.transform
+            # transform maps pixel corners; shift to pixel centers
+            return cls(src.read(1), t.f + t.e / 2, t.c + t.a / 2,
+                       -t.e, t.a, src.nodata, os.path.basename(path))
+
+
+def open_tile(path: str) -> DemTile:
+    if path.lower().endswith('.hgt'):
+        return DemTile.from_hgt(path)
+    return DemTile.from_geotiff(path)
+
+
+class DemTileSet:
+    """
+    All DEM tiles in a directory, sampled as one surface.
+
+    Tiles are opened lazily and the most recently used `cache_size` are
+    kept open in an LRU cache. SRTM tiles stay memory-mapped, so a cached
+    tile costs a file handle rather than a decoded copy (an SRTM1 tile is
+    ~52 MB as float32); the OS page cache keeps the parts in use.
+    """
+
+    def __init__(self, directory: str, cache_size: int = 16):
+        self.directory = directory
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # SRTM tiles are indexed by their integer (south, west) corner
+        self._hgt = {}
+        for path in glob.glob(os.path.join(directory, '*.[hH][gG][tT]')):
+            match = _HGT_NAME.match(os.path.basename(path))
+            if match is not None:
+                ns, lat, ew, lon = match.groups()
+                key = (int(lat) * (1 if ns.upper() == 'N' else -1),
+                       int(lon) * (1 if ew.upper() == 'E' else -1))
+                self._hgt[key] = path
+
+        tiffs = sorted(glob.glob(os.path.join(directory, '*.tif')) +
+                       glob.glob(os.path.join(directory, '*.tiff')))
+        if tiffs and rasterio is None:
+            logger.warning('Skipping GeoTIFF DEMs in %s: rasterio is not '
+                           'installed', directory)
+            tiffs = []
+        self._tiffs = tiffs
+        logger.info('Found %d DEM tile(s) in %s', len(self._hgt) + len(tiffs),
+                    directory)
+
+    def _tile(self, key, path: str) -> DemTile:
+        with self._lock:
+            tile = self._cache.get(key)
+            if tile is not None:
+                self._cache.move_to_end(key)
+                metrics.cache_hit('dem_tiles')
+                return tile
+        metrics.cache_miss('dem_tiles')
+        tile = open_tile(path)
+        with self._lock:
+            self._cache[key] = tile
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return tile
+
+    def elevations(self, lats, lons) -> np.ndarray:
+        """
+        Elevations in meters for 1D arrays of latitudes and longitudes.
+        NaN where no tile covers the point.
+        """
+        lats = np.ravel(np.asarray(lats, dtype=np.float64))
+        lons = np.ravel(np.asarray(lons, dtype=np.float64))
+        out = np.full(lats.shape, np.nan)
+        if self._hgt:
+            # Points on a shared edge belong to either tile; try the one to
+            # the north/east first, then the one to the south/west.
+            on_edge = (lats == np.floor(lats)) | (lons == np.floor(lons))
+            for rounding, todo in ((np.floor, np.ones(lats.shape, bool)),
+                                   (lambda x: np.ceil(x) - 1, on_edge)):
+                todo = todo & np.isnan(out)
+                if not todo.any():
+                    continue
+                south = rounding(lats[todo]).astype(np.int64)
+                west = rounding(lons[todo]).astype(np.int64)
+                idx = np.flatnonzero(todo)
+                keys = np.stack([south, west], axis=1)
+                for key in np.unique(keys, axis=0):
+                    key = (int(key[0]), int(key[1]))
+                    path = self._hgt.get(key)
+                    if path is None:
+                        continue
+                    sel = idx[(south == key[0]) & (west == key[1])]
+                    out[sel] = self._tile(key, path).sample(lats[sel],
+                                                            lons[sel])
+        for path in self._tiffs:
+            todo = np.isnan(out)
+            if not todo.any():
+                break
+            tile = self._tile(path, path)
+            mask = todo & tile.contains(lats, lons)
+            if mask.any():
+                out[mask] = tile.sample(lats[mask], lons[mask])
+        return out
@@ -0,0 +1,109 @@
+"""
+Batch elevation lookups.
+
+ElevationProvider answers elevations(lats, lons) from local DEM tiles
+(utils/dem.py) and sends only the points the tiles don't cover to a remote
+backend. UsgsBackend talks to the USGS Elevation Point Query Service over
+keep-alive connections, a few requests at a time, with retries; point it at
+another host/port to use a stub server instead.
+"""
+import logging
+import threading
+import time
+from concurrent import futures
+from http import client
+from typing import *
+
+import numpy as np
+
+from utils.dem import DemTileSet
+
+logger = logging.getLogger(__name__)
+
+
+class UsgsBackend:
+    """USGS point query service. One request per point, elevations in meters."""
+
+    def __init__(self, host: str = 'ned.usgs.gov', port: Optional[int] = None,
+                 path: str = '/epqs/pqs.php', workers: int = 8,
+                 retries: int = 3, backoff: float = 0.5,
+                 timeout: float = 10.0):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> client.HTTPConnection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = client.HTTPConnection(
+                self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def elevation(self, lat: float, lon: float) -> float:
+        """Elevation of one point, in meters. NaN if every attempt failed."""
+        for attempt in range(self.retries):
+            try:
+                conn = self._connection()
+                conn.request('GET', '%s?x=%.6f&y=%.6f&units=Meters&output=xml'
+                              % (self.path, lon, lat))
+                result = conn.getresponse()
+                xml = result.read()
+                if result.status != 200:
+                    raise IOError('HTTP {}'.format(result.status))
+                return float(xml[xml.find(b'<Elevation>') + 11:
+                                 xml.find(b'</Elevation>')])
+            except (IOError, ValueError, client.HTTPException) as e:
+                logger.warning('Elevation lookup for (%s, %s) failed '
+                               '(attempt %d): %s', lat, lon, attempt + 1, e)
+                self._local.conn = None
+                if attempt + 1 < self.retries:
+                    time.sleep(self.backoff * 2 ** attempt)
+        return float('nan')
+
+    def elevations(self, lats, lons) -> np.ndarray:
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        if len(lats) == 1:
+            return np.array([self.elevation(lats[0], lons[0])])
+        with futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return np.fromiter(pool.map(self.elevation, lats, lons),
+                               dtype=np.float64, count=len(lats))
+
+
+class ElevationProvider:
+
+    def __init__(self, dem_dir: Optional[str] = None, tile_cache_size: int = 16,
+                 fallback: Optional[UsgsBackend] = None):
+        """
+        :param dem_dir: Directory of DEM tiles, or None for none.
+        :param tile_cache_size: Number of DEM tiles kept open.
+        :param fallback: Backend for points the DEM doesn't cover.
+        """
+        self.dem = DemTileSet(dem_dir, tile_cache_size) \
+            if dem_dir is not None else None
+        self.fallback = fallback
+
+    def elevations(self, lats, lons) -> np.ndarray:
+        """
+        Elevations in meters for 1D arrays of latitudes and longitudes.
+        NaN where neither the DEM nor the fallback has an answer.
+        """
+        lats = np.ravel(np.asarray(lats, dtype=np.float64))
+        lons = np.ravel(np.asarray(lons, dtype=np.float64))
+        if self.dem is not None:
+            out = self.dem.elevations(lats, lons)
+        else:
+            out = np.full(lats.shape, np.nan)
+        missing = np.isnan(out)
+        if self.fallback is not None and missing.any():
+            out[missing] = self.fallback.elevations(lats[missing],
+                                                    lons[missing])
+        return out
+
+    def elevation(self, lat: float, lon: float) -> float:
+        return float(self.elevations([lat], [lon])[0])
@@ -1,28 +1,46 @@
-from http import client
 import math
 
+import numpy as np
+
+from utils.elevation_provider import ElevationProvider, UsgsBackend
+
 metersPerFoot = 0.3048
 radiansPerDegree = math.pi / 180
 earthRadius = 6371000
 
+_provider = None
+
+# Shared ElevationProvider: local DEM tiles from config "demDir" (if set), with
+# the USGS service as a fallback for anything the tiles don't cover.
+def getProvider():
+	global _provider
+	if _provider is None:
+		from config import config
+		_provider = ElevationProvider(config.get('demDir'),
+			config.get('demTileCacheSize', 16), fallback=UsgsBackend())
+	return _provider
+
+def setProvider(provider):
+	global _provider
+	_provider = provider
+
 # This function will get the elevation at any point in the US (though not all of Alaska)
 def getElevation(latitude, longitude): 
-	return USGS10mElev(latitude, longitude)
+	return metersToFeet(getProvider().elevation(latitude, longitude))
+
+# Elevations in feet for arrays of latitudes and longitudes, in one batch
+def getElevations(latitudes, longitudes):
+	return metersToFeet(getProvider().elevations(latitudes, longitudes))
 
 # I found this code to query the USGS elevation data at:
 # https://gist.github.com/pyRobShrk/8df3a3c422fb1c88882a5e41b284349f
 def USGS10mElev(lat,lon):
-    usgs = client.HTTPConnection('ned.usgs.gov')
-    usgs.request('GET','/epqs/pqs.php?x=%.6f&y=%.6f&units=FEET&output=xml'% (lon, lat))
-    result = usgs.getresponse()
-    if result.status == 200:
-        xml = result.read()
-        return float(xml[xml.find(b'<Elevation>')+11:xml.find(b'</Elevation>')-1])
-    else: return xml
+    return metersToFeet(UsgsBackend().elevation(lat, lon))
 
 # Calculate the elevation change between two latitude / longitude coordinates
 def elevationChange(startLat, startLon, endLat, endLon):
-	return getElevation(endLat, endLon) - getElevation(startLat, startLon)
+	start, end = getElevations([startLat, endLat], [startLon, endLon])
+	return end - start
 
 # Calculate the distance in feet between two latitude / longitude coordinates
 # uses the haversine formula as discussed here: https://www.movable-type.co.uk/scripts/latlong.html
@@ -45,18 +63,9 @@ def slopeBetweenSimple(startLat, startLon, endLat, endLon):
 
 # Sample the elevations between two coordinates, and return as an array (for use in a visual of the elevation changes along the route)
 def sampleElevations(startLat, startLon, endLat, endLon, numPoints = 10):
-	elevations = []
-	dlat = (endLat - startLat) / (numPoints - 1)
-	dlon = (endLon - startLon) / (numPoints - 1)
-	lat = startLat
-	lon = startLon
-
-	for i in range(numPoints):
-		elevations += [getElevation(lat, lon)]
-		lat += dlat
-		lon += dlon
-
-	return elevations
+	lats = np.linspace(startLat, endLat, numPoints)
+	lons = np.linspace(startLon, endLon, numPoints)
+	return getElevations(lats, lons).tolist()
 
 
 # Conversion utility functions:
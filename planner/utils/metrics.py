@@ -0,0 +1,245 @@
+"""
+Minimal Prometheus-compatible metrics.
+
+Counters, gauges and histograms with labels, rendered in the Prometheus text
+exposition format and served over HTTP by start_http_server(). This keeps the
+planner free of extra dependencies; anything that scrapes Prometheus
+endpoints can read it.
+"""
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from typing import *
+
+logger = logging.getLogger(__name__)
+
+# Seconds. Covers everything from a cache lookup to a slow orienteering run.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...],
+                   extra: str = '') -> str:
+    parts = ['{}="{}"'.format(n, str(v).replace('\\', '\\\\')
+                              .replace('"', '\\"'))
+             for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError('{} expects labels {}, got {}'.format(
+                self.name, self.labelnames, tuple(labels)))
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.type)]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _render_sample(self, key, value):
+        return ['{}_total{} {}'.format(
+            self.name, _format_labels(self.labelnames, key), repr(value))]
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0.0)
+
+    def _render_sample(self, key, value):
+        return ['{}{} {}'.format(
+            self.name, _format_labels(self.labelnames, key), repr(value))]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (+Inf last), sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1),
+                                             0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    def _render_sample(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('{}_bucket{} {}'.format(
+                self.name,
+                _format_labels(self.labelnames, key, 'le="{}"'.format(le)),
+                cumulative))
+        labels = _format_labels(self.labelnames, key)
+        lines.append('{}_sum{} {}'.format(self.name, labels, repr(total)))
+        lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames,
+                                       buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+requests_total = REGISTRY.counter(
+    'planner_requests', 'PlanRoute calls by router type and status code.',
+    ('router', 'status'))
+request_seconds = REGISTRY.histogram(
+    'planner_request_seconds', 'PlanRoute latency by router type.',
+    ('router',))
+stage_seconds = REGISTRY.histogram(
+    'planner_stage_seconds', 'Time spent in each router stage.',
+    ('router', 'stage'))
+pool_wait_seconds = REGISTRY.histogram(
+    'planner_db_pool_wait_seconds',
+    'Time spent waiting for a database connection.')
+queue_wait_seconds = REGISTRY.histogram(
+    'planner_queue_wait_seconds', 'Time spent queued for admission.',
+    ('router',))
+rejected_total = REGISTRY.counter(
+    'planner_rejected', 'Requests shed by admission control.',
+    ('router', 'reason'))
+running_requests = REGISTRY.gauge(
+    'planner_running_requests', 'Requests currently being served.',
+    ('router',))
+queued_requests = REGISTRY.gauge(
+    'planner_queued_requests', 'Requests waiting for admission.',
+    ('router',))
+route_length_ratio = REGISTRY.histogram(
+    'planner_route_length_ratio',
+    'Achieved / desired length of routes with a desired distance.',
+    ('router',), buckets=(0.5, 0.8, 0.9, 0.95, 1.0, 1.05, 1.1, 1.2, 1.5, 2.0))
+cache_requests_total = REGISTRY.counter(
+    'planner_cache_requests', 'Cache lookups by cache name and result.',
+    ('cache', 'result'))
+snapshot_version = REGISTRY.gauge(
+    'planner_snapshot_version', 'Version of the network snapshot new '
+    'requests use, by region.', ('region',))
+snapshot_reloads_total = REGISTRY.counter(
+    'planner_snapshot_reloads', 'Snapshot reloads by region and kind (full, '
+    'metadata, unchanged).', ('region', 'kind'))
+resident_regions = REGISTRY.gauge(
+    'planner_resident_regions', 'Regions with a database pool and loaded '
+    'snapshot.')
+
+
+def cache_hit(cache: str):
+    cache_requests_total.inc(cache=cache, result='hit')
+
+
+def cache_miss(cache: str):
+    cache_requests_total.inc(cache=cache, result='miss')
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_http_server(port: int, host: str = '127.0.0.1',
+                      registry: Registry = REGISTRY) -> HTTPServer:
+    """Serve registry at http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type',
+                             'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = _ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics-http',
+                     daemon=True).start()
+    logger.info('Serving metrics on http://%s:%s/metrics', host, port)
+    return server
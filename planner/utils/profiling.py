@@ -0,0 +1,142 @@
+"""
+Low-overhead sampling profiler for live traffic.
+
+While enabled, a fraction of requests is selected for profiling. A single
+background thread periodically captures the stacks of the threads serving
+selected requests and counts them per label (the router class). Counts are
+written as collapsed stacks ("frame;frame;frame count" lines), which
+flamegraph.pl, speedscope and similar tools read directly.
+
+Unselected requests only pay for one random() call, and the sampler thread
+sleeps whenever no selected request is in flight.
+"""
+import collections
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import *
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name,
+                               os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+class SamplingProfiler:
+
+    def __init__(self, sample_rate: float = 0.01, interval: float = 0.005,
+                 output_dir: str = 'profiles', max_depth: int = 128):
+        """
+        :param sample_rate: Fraction of requests to profile while enabled.
+        :param interval: Seconds between stack samples.
+        :param output_dir: Where collapsed stack files are written.
+        :param max_depth: Stacks deeper than this are truncated at the root.
+        """
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.output_dir = output_dir
+        self.max_depth = max_depth
+        self.enabled = False
+        self._active = {}  # thread ident -> label
+        self._counts = collections.defaultdict(collections.Counter)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        with self._lock:
+            if self.enabled:
+                return
+            self.enabled = True
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+        logger.info('Profiling enabled, sampling %.1f%% of requests',
+                    self.sample_rate * 100)
+
+    def disable(self):
+        with self._lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+        self._wakeup.set()
+        logger.info('Profiling disabled')
+        self.flush()
+
+    def toggle(self):
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    @contextmanager
+    def sample(self, label: str):
+        """Profile the block with probability sample_rate, if enabled."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            self._active[ident] = label
+        self._wakeup.set()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active.pop(ident, None)
+
+    def _run(self):
+        while self.enabled:
+            with self._lock:
+                active = dict(self._active)
+            if not active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            frames = sys._current_frames()
+            for ident, label in active.items():
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(label)
+                stack.reverse()
+                with self._lock:
+                    self._counts[label][';'.join(stack)] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def flush(self) -> List[str]:
+        """
+        Write all samples so far to <output_dir>/<label>.collapsed, one file
+        per label. Files are rewritten with cumulative counts.
+        :return: Paths written.
+        """
+        with self._lock:
+            counts = {label: dict(c) for label, c in self._counts.items()}
+        os.makedirs(self.output_dir, exist_ok=True)
+        paths = []
+        for label, stacks in counts.items():
+            path = os.path.join(self.output_dir, label + '.collapsed')
+            with open(path, 'w') as f:
+                for stack, n in sorted(stacks.items()):
+                    f.write('{} {}\n'.format(stack, n))
+            paths.append(path)
+        logger.info('Wrote profiles: %s', paths)
+        return paths
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
@@ -0,0 +1,90 @@
+"""
+Per-request stage timing.
+
+A Trace is bound to the current thread for the duration of a PlanRoute call.
+Router code marks its stages with the `stage` context manager or the `timed`
+decorator; each stage's time is added to the trace (so the breakdown can be
+logged or returned to the client) and observed in the stage histogram.
+Outside of a trace, stages cost a couple of perf_counter() calls.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import *
+
+from utils import metrics
+
+_local = threading.local()
+
+
+class Trace:
+    def __init__(self, router: str = 'unknown'):
+        self.router = router
+        self.start = time.perf_counter()
+        self.end = None
+        self._stages = {}  # name -> [seconds, count], in first-seen order
+
+    def add(self, stage: str, seconds: float):
+        entry = self._stages.get(stage)
+        if entry is None:
+            self._stages[stage] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    @property
+    def elapsed(self) -> float:
+        """Seconds since the trace started (until it ended, if it has)."""
+        return (self.end or time.perf_counter()) - self.start
+
+    def breakdown(self) -> Dict[str, float]:
+        """Milliseconds per stage, plus the total."""
+        out = {name: round(seconds * 1000, 3)
+               for name, (seconds, _) in self._stages.items()}
+        out['total'] = round(self.elapsed * 1000, 3)
+        return out
+
+    def counts(self) -> Dict[str, int]:
+        return {name: count for name, (_, count) in self._stages.items()}
+
+
+def current() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def trace(router: str = 'unknown'):
+    """Bind a new Trace to this thread for the duration of the block."""
+    previous = current()
+    t = _local.trace = Trace(router)
+    try:
+        yield t
+    finally:
+        t.end = time.perf_counter()
+        _local.trace = previous
+
+
+@contextmanager
+def stage(name: str):
+    """Time the block as stage `name` of the current trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        t = current()
+        if t is not None:
+            t.add(name, elapsed)
+            metrics.stage_seconds.observe(elapsed, router=t.router, stage=name)
+
+
+def timed(name: str):
+    """Decorator form of `stage`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,37 +1,96 @@
--- Define function that finds shortest path between 2 points given in EPSG:4326 coordinate reference.
+-- Define functions that find the shortest path between 2 points given in EPSG:4326 coordinate reference.
+--
+-- The geometry is built in path order, with every edge flipped to the direction it's travelled in, so it always runs
+-- from the origin to the destination. elevationData is [[length_m, elevation at the start of the edge, index of the
+-- edge's last point in the linestring], ...], like the other routers return (see planner/routers/route_assembly.py).
+
+-- Older versions returned only (geojson, length)
+DROP FUNCTION IF EXISTS pathFromNearestKnownPoints(numeric, numeric, numeric, numeric);
+
+CREATE OR REPLACE FUNCTION pathFromEdges(
+    IN edges_sql TEXT,
+    IN x1 numeric, IN y1 numeric,
+    IN x2 numeric, IN y2 numeric,
+    OUT geojson TEXT,
+    OUT length FLOAT,
+    OUT elevationData json
+)
+RETURNS SETOF record AS
+$BODY$
+BEGIN
+    RETURN QUERY
+    WITH
+    dijkstra AS (
+        SELECT *
+        FROM pgr_dijkstra(
+            edges_sql,
+            -- known source closest to actual source
+            (SELECT id FROM ways_vertices_pgr
+                ORDER BY the_geom <-> ST_SetSRID(ST_Point(x1, y1), 4326) LIMIT 1),
+            -- known target closest to actual target
+            (SELECT id FROM ways_vertices_pgr
+                ORDER BY the_geom <-> ST_SetSRID(ST_Point(x2, y2), 4326) LIMIT 1),
+            directed:=false)
+    ),
+    path AS (
+        SELECT
+            dijkstra.seq,
+            CASE WHEN dijkstra.node = ways.source THEN ways.the_geom ELSE ST_Reverse(ways.the_geom) END AS geom,
+            ways.length_m,
+            -- Vertex elevations for edges put_edge_elevation.py hasn't covered
+            CASE WHEN dijkstra.node = ways.source THEN COALESCE(we.source_elevation, wvp.elevation)
+                 ELSE COALESCE(we.target_elevation, wvp.elevation) END AS elevation,
+            SUM(ST_NumPoints(ways.the_geom) - 1) OVER (ORDER BY dijkstra.seq) AS points
+        FROM dijkstra
+            JOIN ways ON dijkstra.edge = ways.gid
+            LEFT JOIN ways_elevation we ON ways.gid = we.gid
+            LEFT JOIN ways_vertices_pgr wvp ON dijkstra.node = wvp.id
+    )
+    SELECT
+        ST_AsGeoJSON(ST_MakeLine(geom ORDER BY seq)) AS geojson,
+        SUM(length_m) AS length,
+        json_agg(json_build_array(length_m, elevation, points) ORDER BY seq) AS elevationData
+    FROM path;
+END;
+$BODY$
+LANGUAGE 'plpgsql' STABLE;
+
 CREATE OR REPLACE FUNCTION pathFromNearestKnownPoints(
     IN x1 numeric, IN y1 numeric,
     IN x2 numeric, IN y2 numeric,
     OUT geojson TEXT,
-    OUT length FLOAT
+    OUT length FLOAT,
+    OUT elevationData json
 )
 RETURNS SETOF record AS
 $BODY$
-DECLARE
-    final_query TEXT;
 BEGIN
-    final_query :=
-        FORMAT( $$
-            WITH
-            dijkstra AS (
-                SELECT *
-                FROM pgr_dijkstra(
-                    'SELECT gid AS id, source, target, cost FROM ways',
-                    -- known source closest to actual source
-                    (SELECT id FROM ways_vertices_pgr 
-                        ORDER BY the_geom <-> ST_SetSRID(ST_Point(%1$s, %2$s), 4326) LIMIT 1),
-                    -- known target closest to actual target
-                    (SELECT id FROM ways_vertices_pgr
-                        ORDER BY the_geom <-> ST_SetSRID(ST_Point(%3$s, %4$s), 4326) LIMIT 1)),
-                    directed:=false)
-            )
-            SELECT
-                ST_AsGeoJSON(ST_LineMerge(ST_Union(the_geom))) as geojson, SUM(length_m) as length
-            FROM dijkstra JOIN ways ON dijkstra.edge = ways.gid;$$,
-        x1,y1,x2,y2);
-    RAISE notice '%', final_query;
-    RETURN QUERY EXECUTE final_query;
+    RETURN QUERY SELECT * FROM pathFromEdges(
+        'SELECT gid AS id, source, target, cost FROM ways',
+        x1, y1, x2, y2);
 END;
 $BODY$
-LANGUAGE 'plpgsql';
+LANGUAGE 'plpgsql' STABLE;
 
+-- Same, only considering edges that intersect the bounding box
+CREATE OR REPLACE FUNCTION pathFromNearestKnownPointsBBOX(
+    IN x1 numeric, IN y1 numeric,
+    IN x2 numeric, IN y2 numeric,
+    IN xmin numeric, IN ymin numeric,
+    IN xmax numeric, IN ymax numeric,
+    OUT geojson TEXT,
+    OUT length FLOAT,
+    OUT elevationData json
+)
+RETURNS SETOF record AS
+$BODY$
+BEGIN
+    RETURN QUERY SELECT * FROM pathFromEdges(
+        FORMAT($$
+            SELECT gid AS id, source, target, cost FROM ways
+            WHERE the_geom && ST_MakeEnvelope(%s, %s, %s, %s, 4326)$$,
+            xmin, ymin, xmax, ymax),
+        x1, y1, x2, y2);
+END;
+$BODY$
+LANGUAGE 'plpgsql' STABLE;
@@ -0,0 +1,10 @@
+-- Connected component labels per vertex, filled in by planner/put_components.py. component is the vertex's connected
+-- component with every edge usable both ways; strong_component is its strongly connected component when one-way edges
+-- (reverse_cost < 0) are only travelled forwards. Vertices with different component labels have no route between them;
+-- different strong_component labels don't rule one out (a one-way spur is its own strong component but still reaches
+-- the network), so they only guide snapping to the main component (see planner/routers/components.py).
+CREATE TABLE IF NOT EXISTS vertex_components (
+    id bigint PRIMARY KEY,
+    component bigint NOT NULL,
+    strong_component bigint NOT NULL
+);
@@ -0,0 +1,18 @@
+-- Per-edge elevation summary, filled in by planner/put_edge_elevation.py.
+-- Elevations are in feet, like ways_vertices_pgr.elevation. gain/loss and
+-- max_grade are for travelling source -> target; the reverse direction swaps
+-- gain and loss. profile holds little-endian float16 samples along the edge
+-- (source -> target), relative to source_elevation. climb/reverse_climb are
+-- the normalized climb scores edge preferences use for each direction (see
+-- planner/routers/edge_costs.py).
+CREATE TABLE IF NOT EXISTS ways_elevation (
+    gid bigint PRIMARY KEY,
+    source_elevation real,
+    target_elevation real,
+    gain real,
+    loss real,
+    climb real,
+    reverse_climb real,
+    max_grade real,
+    profile bytea
+);